@@ -1,21 +1,118 @@
-
-
-
 import streamlit as st
 import streamlit.components.v1 as components
+import atexit
 import json
 import pandas as pd
-import sqlite3
 import os
-from core.fhir_to_omop import fhir_to_omop_sql, client
-from core.qa_copilot import run_quality_checks
+import requests
+from core.fhir_to_omop import fhir_to_omop_sql
+from core.llm_prompts import stream_generate
 from utils.db_utils import get_db_engine
-from utils.fhir_utils import extract_patient_id
+from utils.table_browser import TableBrowser, FILTER_OPS
+from utils.sql_inserts import load_llm_inserts
+from core.fhir_dedup import ResourceIndex, resource_fingerprint, index_path, database_identity
+from core.llm_cache import LLMResponseCache
+from core.cohort import CohortEngine, ConceptCriterion, AgeCriterion, ObservationWindowCriterion
+from core.fhir_mappers import RESOURCE_MAPPERS, map_resources
 from utils.config_utils import load_config
 from core.orchestration.mcp_orchestrator import MCPOrchestrator
+from core.orchestration.job_queue import JobQueue, JobWorkerPool, EXCLUSIVE_STEPS
+
+FHIR_BASE = "https://hapi.fhir.org/baseR4"
+
+# --- Cached resources and data ---
+# Streamlit reruns this script on every interaction; engines, the orchestrator
+# and the LLM client are shared across reruns, and query results are cached
+# until they expire or an ETL/mapping step invalidates them.
+
+@st.cache_data
+def get_config(config_path="config.yaml"):
+    return load_config(config_path)
+
+@st.cache_resource
+def get_orchestrator(config_path="config.yaml"):
+    return MCPOrchestrator(config_path=config_path)
+
+@st.cache_resource
+def get_engine(db_type, db_path=None, pg_items=None, shards=1):
+    # pg_items is a tuple of (key, value) pairs so the arguments stay hashable
+    return get_db_engine(db_type=db_type, db_path=db_path, pg_settings=dict(pg_items) if pg_items else None, shards=shards)
+
+@st.cache_resource
+def get_llm_client():
+    from core.fhir_to_omop import get_client
+    return get_client()
+
+@st.cache_resource
+def get_cbioportal_client(cache_dir):
+    from integration.oncology.cbioportal_loader import CBioPortalClient
+    return CBioPortalClient(cache_dir=cache_dir)
+
+@st.cache_resource
+def get_job_queue(db_path, workers):
+    # Worker processes are started once per server and shared by all sessions,
+    # and stopped with it (workers also exit on their own if the server is killed)
+    pool = JobWorkerPool(db_path, workers=workers).start()
+    atexit.register(pool.stop)
+    return JobQueue(db_path)
+
+@st.cache_resource
+def get_resource_index(index_path):
+    # Persistent index of FHIR resources already mapped to OMOP (Bloom filter kept in memory)
+    return ResourceIndex(index_path)
+
+@st.cache_resource
+def get_llm_cache(cache_path, max_entries):
+    # Shared by all sessions: repeated (or near-identical) questions are answered without calling the LLM
+    return LLMResponseCache(cache_path, max_entries=max_entries)
+
+@st.cache_resource
+def get_cohort_engine(db_key):
+    # Criterion bitmaps are cached inside the engine until the OMOP tables change
+    return CohortEngine(get_engine(*db_key))
+
+@st.cache_resource
+def get_table_browser(db_key):
+    return TableBrowser(get_engine(*db_key))
+
+@st.cache_data(ttl=600, show_spinner=False)
+def load_preview(db_key, table, limit=10):
+    return get_table_browser(db_key).page(table, page_size=limit)[0]
+
+@st.cache_data(ttl=600, show_spinner=False)
+def load_page(db_key, table, columns, filters, sort, descending, after, page_size):
+    return get_table_browser(db_key).page(table, columns=list(columns) or None, filters=list(filters), sort=sort,
+                                          descending=descending, after=after, page_size=page_size)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def count_rows(db_key, table, filters):
+    return get_table_browser(db_key).count(table, filters=list(filters))
+
+@st.cache_data(ttl=600, show_spinner=False)
+def list_tables(db_key):
+    return get_table_browser(db_key).tables()
+
+@st.cache_data(ttl=300, show_spinner="Fetching FHIR resources...")
+def fetch_fhir_resources(resource_type, count):
+    resp = requests.get(f"{FHIR_BASE}/{resource_type}?_count={count}")
+    resp.raise_for_status()
+    bundle = resp.json()
+    return [entry["resource"] for entry in bundle.get("entry", [])]
+
+@st.cache_data(ttl=3600, show_spinner="Generating OMOP SQL with the LLM...")
+def generate_omop_sql(fhir_json_text, table):
+    return fhir_to_omop_sql(json.loads(fhir_json_text), table=table)
+
+def invalidate_data_caches():
+    """Drop cached query results after anything writes to the OMOP database."""
+    load_preview.clear()
+    load_page.clear()
+    count_rows.clear()
+    list_tables.clear()
+    get_cohort_engine.clear()
 
 # Load config at the very top so it's available for sidebar and all logic
-config = load_config()
+config = get_config()
 
 st.sidebar.header("Database Backend")
 default_backend = config['database']['backend']
@@ -34,71 +131,179 @@ else:
         'port': st.sidebar.text_input("PostgreSQL Port", value=str(pg_conf.get('port', '5432'))),
         'db': st.sidebar.text_input("PostgreSQL DB Name", value=pg_conf.get('db', 'clinical_demo')),
     }
+db_key = (db_type, db_path, tuple(sorted(pg_settings.items())) if pg_settings else None,
+          config['database'].get('sqlite_shards', 1) if db_type == "sqlite" else 1)
+# Background jobs run against the database selected here, not the config.yaml backend.
+# The PostgreSQL password is only stored with the job when it differs from the config one.
+if db_type == "sqlite":
+    job_overrides = {'database.backend': db_type, 'database.sqlite_path': db_path}
+else:
+    job_overrides = {'database.backend': db_type,
+                     **{f'database.postgresql.{k}': v for k, v in pg_settings.items()
+                        if k != 'password' or v != pg_conf.get('password')}}
+# One index per OMOP database (password left out, so changing it keeps the index)
+db_target = database_identity(db_type, db_path, pg_settings)
+fhir_index = get_resource_index(index_path(os.path.join(os.path.dirname(__file__), config['cache']['dir'],
+                                                        config['cache'].get('fhir_index', 'fhir_resource_index.sqlite')),
+                                           db_target))
+engine = get_engine(*db_key)
+orchestrator = get_orchestrator(config_path="config.yaml")
+client = get_llm_client()
+llm_cache = get_llm_cache(os.path.join(os.path.dirname(__file__), config['cache']['dir'],
+                                       config['cache'].get('llm_responses', 'llm_responses.sqlite')),
+                          config['cache'].get('llm_max_entries', 1000))
+job_queue = get_job_queue(os.path.join(os.path.dirname(os.path.abspath(__file__)), config['jobs']['db_path']), config['jobs']['workers'])
 
-# Load config and instantiate orchestrator
-config = load_config()
-orchestrator = MCPOrchestrator(config_path="config.yaml")
-
-import streamlit as st
-import streamlit.components.v1 as components
-import json
-import pandas as pd
-import sqlite3
-import requests
-from core.fhir_to_omop import fhir_to_omop_sql, client
-from core.qa_copilot import run_quality_checks
-from utils.db_utils import connect_omop_db
-from utils.fhir_utils import extract_patient_id
-from core.etl import run_etl, run_analytics
 st.header("ETL & Analytics Jobs")
-st.write("Run OMOP ETL and analytics directly from the app. Uses sample data and your selected backend (default: SQLite).")
+st.write("Run OMOP ETL and analytics directly from the app. Uses sample data and your selected backend (default: SQLite). Jobs run in background worker processes, so you can keep using the app (or close the browser) while they run.")
 
-col1, col2 = st.columns(2)
+col1, col2, col3 = st.columns(3)
 with col1:
     if st.button("Run ETL (Load Sample Data)"):
-        with st.spinner("Running ETL job..."):
-            try:
-                orchestrator.run_etl()
-                st.success("ETL complete: data loaded to OMOP tables.")
-            except Exception as e:
-                st.error(f"ETL failed: {e}")
+        job_id = job_queue.submit('etl', overrides=job_overrides)
+        st.info(f"ETL queued as job #{job_id}. See Background Jobs below.")
+with col3:
+    if st.button("Derive Observation Periods & Condition Eras"):
+        job_id = job_queue.submit('derived_tables', overrides=job_overrides)
+        st.info(f"Derived tables queued as job #{job_id}. See Background Jobs below.")
 with col2:
     if st.button("Run Analytics (Generate Charts)"):
-        with st.spinner("Running analytics job..."):
-            try:
-                orchestrator.run_analytics()
-                st.success("Analytics complete: charts saved to docs/.")
-                st.subheader("Analytics Results (Charts)")
-                chart_dir = os.path.join(os.path.dirname(__file__), "docs")
-                chart_files = [
-                    ("Persons by Gender", "persons_by_gender.png"),
-                    ("Age Distribution", "age_distribution.png"),
-                    ("Observations per Year", "observations_per_year.png")
-                ]
-                for title, fname in chart_files:
-                    fpath = os.path.join(chart_dir, fname)
-                    if os.path.exists(fpath):
-                        st.markdown(f"**{title}:**")
-                        st.image(fpath)
-                    else:
-                        st.info(f"Chart not found: {fname}")
-            except Exception as e:
-                st.error(f"Analytics failed: {e}")
+        job_id = job_queue.submit('analytics', overrides=job_overrides)
+        st.info(f"Analytics queued as job #{job_id}. See Background Jobs below.")
+
+def show_analytics_charts():
+    chart_dir = os.path.join(os.path.dirname(__file__), "docs")
+    chart_files = [
+        ("Persons by Gender", "persons_by_gender.png"),
+        ("Age Distribution", "age_distribution.png"),
+        ("Observations per Year", "observations_per_year.png")
+    ]
+    for title, fname in chart_files:
+        fpath = os.path.join(chart_dir, fname)
+        if os.path.exists(fpath):
+            st.markdown(f"**{title}:**")
+            st.image(fpath)
+        else:
+            st.info(f"Chart not found: {fname}")
+
+st.subheader("Background Jobs")
+st.button("Refresh job status")
+if 'jobs_seen_done' not in st.session_state:
+    st.session_state['jobs_seen_done'] = set()
+for job in job_queue.list_jobs(limit=10):
+    label = f"#{job['job_id']} {job['step']} — {job['status']}"
+    with st.expander(label, expanded=job['status'] in ('queued', 'running')):
+        if job['status'] in ('queued', 'running'):
+            st.progress(job['progress'], text=job['message'] or job['status'])
+            if st.button("Cancel", key=f"cancel_job_{job['job_id']}"):
+                job_queue.cancel(job['job_id'])
+        elif job['status'] == 'failed':
+            st.error(job['error'])
+        elif job['status'] == 'done':
+            result = job['result'] or {}
+            # Refresh cached previews once per finished job that wrote to the database
+            if job['job_id'] not in st.session_state['jobs_seen_done']:
+                st.session_state['jobs_seen_done'].add(job['job_id'])
+                if job['step'] in EXCLUSIVE_STEPS:
+                    invalidate_data_caches()
+            st.json(result)
+            if 'analytics' in result and st.checkbox("Show charts", key=f"charts_job_{job['job_id']}"):
+                show_analytics_charts()
+            if result.get('qa') and os.path.exists(result['qa']) and st.checkbox("Show QA report", key=f"qa_job_{job['job_id']}"):
+                with open(result['qa'], "r", encoding="utf-8") as f:
+                    components.html(f.read(), height=800, scrolling=True)
+
 # Always show OMOP data preview after ETL/analytics, regardless of which button was clicked
-engine = get_db_engine(db_type=db_type, db_path=db_path, pg_settings=pg_settings)
 st.subheader("Preview: person table")
 try:
-    df_person = pd.read_sql("SELECT * FROM person LIMIT 10", engine)
+    df_person = load_preview(db_key, "person")
     st.dataframe(df_person)
 except Exception as e:
     st.info(f"Could not load person table: {e}")
 st.subheader("Preview: observation table")
 try:
-    df_obs = pd.read_sql("SELECT * FROM observation LIMIT 10", engine)
+    df_obs = load_preview(db_key, "observation")
     st.dataframe(df_obs)
 except Exception as e:
     st.info(f"Could not load observation table: {e}")
 
+# --- Paginated OMOP table browser ---
+st.subheader("Browse OMOP Tables")
+try:
+    browse_tables = list_tables(db_key)
+except Exception as e:
+    browse_tables = []
+    st.info(f"Could not list OMOP tables: {e}")
+if browse_tables:
+    browse_table = st.selectbox("Table", browse_tables, key="browse_table")
+    browse_columns = get_table_browser(db_key).columns(browse_table)
+    bcol1, bcol2, bcol3 = st.columns(3)
+    with bcol1:
+        shown_columns = st.multiselect("Columns", browse_columns, default=browse_columns, key="browse_columns")
+        sort_column = st.selectbox("Sort by", ["(key)"] + browse_columns, key="browse_sort")
+        descending = st.checkbox("Descending", key="browse_desc")
+    with bcol2:
+        filter_column = st.selectbox("Filter column", ["(none)"] + browse_columns, key="browse_filter_col")
+        filter_op = st.selectbox("Operator", sorted(FILTER_OPS), index=sorted(FILTER_OPS).index('='), key="browse_filter_op")
+        filter_value = st.text_input("Value (comma-separated for 'in')", key="browse_filter_value")
+    with bcol3:
+        page_size = st.selectbox("Rows per page", [25, 50, 100, 500], index=1, key="browse_page_size")
+    filters = ()
+    if filter_column != "(none)":
+        if filter_op in ('is null', 'is not null'):
+            filters = ((filter_column, filter_op),)
+        elif filter_op == 'in':
+            filters = ((filter_column, filter_op, tuple(v.strip() for v in filter_value.split(",") if v.strip())),)
+        elif filter_value != "":
+            filters = ((filter_column, filter_op, filter_value),)
+    query = (browse_table, tuple(shown_columns), filters, None if sort_column == "(key)" else sort_column, descending, page_size)
+    # Cursor stack for Previous/Next; reset whenever the query changes
+    if st.session_state.get('browse_query') != query:
+        st.session_state['browse_query'] = query
+        st.session_state['browse_cursors'] = [None]
+    cursors = st.session_state['browse_cursors']
+    try:
+        page_df, next_cursor = load_page(db_key, browse_table, tuple(shown_columns), filters, query[3], descending, cursors[-1], page_size)
+        total, is_estimate = count_rows(db_key, browse_table, filters)
+        st.caption(f"Page {len(cursors)} · {'~' if is_estimate else ''}{total:,} rows")
+        st.dataframe(page_df)
+        nav1, nav2 = st.columns(2)
+        if nav1.button("Previous page", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+        if nav2.button("Next page", disabled=next_cursor is None):
+            cursors.append(next_cursor)
+            st.rerun()
+    except Exception as e:
+        st.error(f"Could not browse {browse_table}: {e}")
+
+# --- Cohort builder: criteria become cached person bitmaps, combined in memory ---
+st.subheader("Cohort Builder")
+ccol1, ccol2, ccol3 = st.columns(3)
+with ccol1:
+    cohort_concepts = st.text_input("Observation concept ids (comma-separated)", key="cohort_concepts")
+with ccol2:
+    cohort_min_age = st.number_input("Min age", min_value=0, max_value=130, value=0, key="cohort_min_age")
+    cohort_max_age = st.number_input("Max age", min_value=0, max_value=130, value=130, key="cohort_max_age")
+with ccol3:
+    cohort_window = st.selectbox("Observation in date window", ["(any)", "required", "excluded"], key="cohort_window")
+    cohort_start = st.date_input("Window start", value=pd.Timestamp("2022-01-01"), key="cohort_start")
+    cohort_end = st.date_input("Window end (exclusive)", value=pd.Timestamp("2023-01-01"), key="cohort_end")
+try:
+    cohort = AgeCriterion(cohort_min_age, cohort_max_age)
+    concept_ids = [c.strip() for c in cohort_concepts.split(",") if c.strip()]
+    if concept_ids:
+        cohort = cohort & ConceptCriterion(concept_ids)
+    if cohort_window != "(any)":
+        window = ObservationWindowCriterion(cohort_start, cohort_end)
+        cohort = cohort & (window if cohort_window == "required" else ~window)
+    cohort_engine = get_cohort_engine(db_key)
+    members = cohort_engine.evaluate(cohort)
+    st.caption(f"{len(members):,} of {len(cohort_engine.universe):,} persons · "
+               f"{cohort_engine.cached_criteria()} criteria cached")
+    st.dataframe(pd.DataFrame({'person_id': members.person_ids(limit=100)}))
+except Exception as e:
+    st.info(f"Could not evaluate cohort: {e}")
 
 # --- LLM Q&A Chat Box ---
 st.markdown("---")
@@ -108,12 +313,21 @@ chat_model = st.selectbox("Choose LLM model for chat", chat_models, index=0)
 user_question = st.text_area("Ask any question to the LLM", value="", height=80)
 if st.button("Ask LLM"):
     if user_question.strip():
-        st.info(f"Sending question to LLM model: {chat_model} ...")
-        response = client.generate(model=chat_model, prompt=user_question)
         st.subheader("LLM Answer")
-        st.write(response['response'])
+        hit = llm_cache.get(chat_model, user_question)
+        if hit:
+            st.write(hit.response)
+            st.caption("Answered from the response cache" + (f" (similar question, {hit.similarity:.0%} match)" if hit.kind == 'near' else ""))
+        else:
+            # Tokens are shown as they arrive instead of after the whole answer
+            answer = st.write_stream(stream_generate(chat_model, user_question, client=client))
+            llm_cache.put(chat_model, user_question, answer)
     else:
         st.warning("Please enter a question.")
+    cache_stats = llm_cache.stats()
+    st.caption(f"LLM response cache: {cache_stats['entries']} entries, {cache_stats['exact_hits']} exact and "
+               f"{cache_stats['near_hits']} similar-question hits, {cache_stats['misses']} misses "
+               f"({cache_stats['hit_rate']:.0%} hit rate)")
 st.markdown("---")
 
 st.header("LLM Mapping Prompt Playground")
@@ -132,9 +346,19 @@ if st.button("Run LLM Mapping"):
             fhir_json = json.loads(sample_data)
         except Exception:
             fhir_json = {"columns": sample_data}
-        sql = orchestrator.run_llm_mapping(fhir_json, table="person")
         st.subheader("LLM Output (OMOP SQL Suggestion)")
-        st.code(sql)
+        # Mapping output depends on the exact sample values, so only exact repeats are served from the cache
+        cache_prompt = f"person\n{json.dumps(fhir_json, sort_keys=True)}"
+        hit = llm_cache.get(mapping_model, cache_prompt, near=False)
+        if hit:
+            st.code(hit.response, language="sql")
+            st.caption("Answered from the response cache")
+        else:
+            output, sql = st.empty(), ""
+            for piece in orchestrator.run_llm_mapping(fhir_json, table="person", model=mapping_model, stream=True):
+                sql += piece
+                output.code(sql, language="sql")
+            llm_cache.put(mapping_model, cache_prompt, sql)
     except Exception as e:
         st.error(f"Error: {e}")
 
@@ -152,7 +376,6 @@ if oncology_source == "OncoKB":
     gene = st.text_input("Gene Symbol", value="TP53")
     uploaded_oncokb_csv = st.file_uploader("Upload OncoKB CSV File", type=["csv"])
     if uploaded_oncokb_csv is not None:
-        import pandas as pd
         df_oncokb = pd.read_csv(uploaded_oncokb_csv)
         st.write(df_oncokb.head())
     elif st.button("Load OncoKB Variants", key="oncokb_load") and api_token:
@@ -164,52 +387,67 @@ if oncology_source == "OncoKB":
             st.error(f"Failed to load OncoKB data: {e}")
     elif st.button("Load OncoKB Variants", key="oncokb_warn"):
         st.warning("Please enter your OncoKB API token or upload a CSV file.")
+    st.markdown("**Batch annotation** (one `GENE:ALTERATION` per line, e.g. `TP53:R248Q`). Uses the local cache and falls back to the CSV files in data/external when offline.")
+    batch_variants = st.text_area("Variants to annotate", value="TP53:R248Q\nTP53:R273H", height=100)
+    if st.button("Annotate Variants", key="oncokb_batch"):
+        try:
+            from integration.oncology.oncokb_loader import annotate_variants
+            pairs = [tuple(line.strip().split(":", 1)) for line in batch_variants.splitlines() if ":" in line]
+            df_annotated = annotate_variants(
+                pairs,
+                api_token=api_token or None,
+                cache_path=os.path.join(os.path.dirname(__file__), config['cache']['dir'], "oncokb.sqlite"),
+                offline_dir=os.path.join(os.path.dirname(__file__), config['data']['base_dir'], "external"),
+            )
+            st.dataframe(df_annotated)
+        except Exception as e:
+            st.error(f"Failed to annotate variants: {e}")
 
 elif oncology_source == "COSMIC":
     st.subheader("COSMIC Mutation Loader")
     st.write("Upload a COSMIC TSV file or enter a public COSMIC download URL (if available). Note: Most COSMIC data is distributed as files, not via API.")
     cosmic_file = st.file_uploader("Upload COSMIC TSV File", type=["tsv", "csv"])
     cosmic_url = st.text_input("Or enter COSMIC TSV URL (optional)")
+    cosmic_genes = st.text_input("Filter by gene(s), comma-separated (optional)", value="")
+    cosmic_genes = [g.strip() for g in cosmic_genes.split(",") if g.strip()] or None
     if cosmic_file is not None:
         try:
-            import pandas as pd
             from integration.oncology.cosmic_loader import load_cosmic_mutations
-            df_cosmic = load_cosmic_mutations(cosmic_file)
+            df_cosmic = load_cosmic_mutations(cosmic_file, genes=cosmic_genes)
             st.write(df_cosmic.head())
         except Exception as e:
             st.error(f"Failed to load COSMIC data: {e}")
     elif cosmic_url:
         try:
-            import pandas as pd
-            df_cosmic = pd.read_csv(cosmic_url, sep='\t')
+            from integration.oncology.cosmic_loader import load_cosmic_mutations
+            df_cosmic = load_cosmic_mutations(cosmic_url, genes=cosmic_genes)
             st.write(df_cosmic.head())
         except Exception as e:
             st.error(f"Failed to load COSMIC data from URL: {e}")
+    elif cosmic_genes and st.button("Query Local COSMIC Cache"):
+        try:
+            from integration.oncology.cosmic_loader import load_cosmic_mutations_cached
+            cosmic_path = os.path.join(os.path.dirname(__file__), config['oncology']['cosmic_file'])
+            cache_path = os.path.join(os.path.dirname(__file__), config['cache']['dir'], config['oncology']['cosmic_cache'])
+            df_cosmic = load_cosmic_mutations_cached(cosmic_path, cache_path, genes=cosmic_genes)
+            st.write(f"{len(df_cosmic)} mutations found.")
+            st.write(df_cosmic.head())
+        except Exception as e:
+            st.error(f"Failed to query COSMIC cache: {e}")
 
 elif oncology_source == "cBioPortal":
     st.subheader("cBioPortal Study Loader")
     st.write("You can use the API (study ID) or upload a CSV file (e.g., sample in data/external/cbioportal_brca_clinical.csv). You can also list and fetch other data types (mutation, copy number, etc.) for a study.")
     study_id = st.text_input("cBioPortal Study ID", value="brca_tcga")
     uploaded_cbio_csv = st.file_uploader("Upload cBioPortal CSV File", type=["csv"])
+    # API responses are cached on disk, so reruns and repeat browsing skip the network
+    cbio_client = get_cbioportal_client(os.path.join(os.path.dirname(__file__), config['cache']['dir'], "cbioportal"))
     if uploaded_cbio_csv is not None:
-        import pandas as pd
         df_cbio = pd.read_csv(uploaded_cbio_csv)
         st.write(df_cbio.head())
     elif st.button("Load cBioPortal Study from API"):
         try:
-            # import requests  # Removed unnecessary import
-            import pandas as pd
-            api_url = f"https://www.cbioportal.org/api/studies/{study_id}/clinical-data"
-            resp = requests.get(api_url)
-            resp.raise_for_status()
-            data = resp.json()
-            # cBioPortal API returns a list of dicts
-            if isinstance(data, list):
-                df_cbio = pd.DataFrame(data)
-            elif isinstance(data, dict) and 'clinicalData' in data:
-                df_cbio = pd.DataFrame(data['clinicalData'])
-            else:
-                raise ValueError("Unexpected cBioPortal API response format.")
+            df_cbio = cbio_client.clinical_data(study_id)
             st.write(df_cbio.head())
         except Exception as e:
             st.error(f"Failed to load cBioPortal data from API: {e}")
@@ -223,16 +461,11 @@ elif oncology_source == "cBioPortal":
 
     if st.button("List Available Data Types (Molecular Profiles)"):
         try:
-            # import requests  # Removed unnecessary import
-            profiles_url = f"https://www.cbioportal.org/api/studies/{study_id}/molecular-profiles"
-            resp = requests.get(profiles_url)
-            resp.raise_for_status()
-            profiles = resp.json()
-            if profiles:
+            profiles = cbio_client.molecular_profiles(study_id)
+            if not profiles.empty:
                 # Store both profileId and alterationType for endpoint selection
-                st.session_state['cbioportal_profiles_full'] = profiles
-                profile_ids = [p['molecularProfileId'] for p in profiles]
-                st.session_state['cbioportal_profiles'] = profile_ids
+                st.session_state['cbioportal_profiles_full'] = profiles[['molecularProfileId', 'molecularAlterationType']].astype(str).to_dict('records')
+                st.session_state['cbioportal_profiles'] = profiles['molecularProfileId'].astype(str).tolist()
                 st.success("Profiles loaded. Select a profile below.")
             else:
                 st.session_state['cbioportal_profiles'] = []
@@ -242,59 +475,34 @@ elif oncology_source == "cBioPortal":
             st.error(f"Failed to list molecular profiles: {e}")
 
     if st.session_state['cbioportal_profiles']:
-        selected_profile = st.selectbox(
-            "Select a molecular profile to fetch data",
+        selected_profiles = st.multiselect(
+            "Select molecular profiles to fetch data",
             st.session_state['cbioportal_profiles'],
             key="cbioportal_profile_select",
-            index=st.session_state['cbioportal_profiles'].index(st.session_state['cbioportal_selected_profile']) if st.session_state['cbioportal_selected_profile'] in st.session_state['cbioportal_profiles'] else 0
+            default=[st.session_state['cbioportal_selected_profile']] if st.session_state['cbioportal_selected_profile'] in st.session_state['cbioportal_profiles'] else st.session_state['cbioportal_profiles'][:1]
         )
-        st.session_state['cbioportal_selected_profile'] = selected_profile
-        if st.button("Fetch Data for Selected Profile"):
+        if selected_profiles:
+            st.session_state['cbioportal_selected_profile'] = selected_profiles[0]
+        if st.button("Fetch Data for Selected Profiles"):
             try:
-                # import requests  # Removed unnecessary import
-                # Find the selected profile's alteration type
-                profiles_full = st.session_state.get('cbioportal_profiles_full', [])
-                profile_info = next((p for p in profiles_full if p['molecularProfileId'] == selected_profile), None)
-                if not profile_info:
-                    st.error("Profile info not found.")
-                else:
-                    alteration_type = profile_info.get('molecularAlterationType', '').upper()
-                    # Get sample list
-                    sample_list_url = f"https://www.cbioportal.org/api/studies/{study_id}/sample-lists"
-                    sample_resp = requests.get(sample_list_url)
-                    sample_resp.raise_for_status()
-                    sample_lists = sample_resp.json()
-                    if sample_lists:
-                        sample_list_id = sample_lists[0]['sampleListId']
-                        # Choose endpoint based on alteration type
-                        if alteration_type == 'MUTATION_EXTENDED':
-                            endpoint = 'mutations'
-                        elif alteration_type == 'COPY_NUMBER_ALTERATION':
-                            endpoint = 'discrete-copy-number'
-                        elif alteration_type == 'MRNA_EXPRESSION':
-                            endpoint = 'mRNA-expr'
-                        else:
-                            endpoint = None
-                        if endpoint:
-                            data_url = f"https://www.cbioportal.org/api/molecular-profiles/{selected_profile}/{endpoint}?sampleListId={sample_list_id}"
-                            data_resp = requests.get(data_url)
-                            data_resp.raise_for_status()
-                            data = data_resp.json()
-                            st.write(f"Data for {selected_profile} ({alteration_type}, first 10 records):")
-                            st.write(data[:10] if isinstance(data, list) else data)
-                        else:
-                            st.info(f"No supported endpoint for alteration type: {alteration_type}")
-                    else:
-                        st.info("No sample lists found for this study.")
+                # Profiles are fetched concurrently; unsupported alteration types are skipped
+                frames = cbio_client.fetch_profiles_data(study_id, profile_ids=selected_profiles)
+                if not frames:
+                    st.info("No supported data found for the selected profiles.")
+                for profile_id, df_profile in frames.items():
+                    st.write(f"Data for {profile_id} ({len(df_profile)} records, first 10 shown):")
+                    st.dataframe(df_profile.head(10))
+                skipped = [p for p in selected_profiles if p not in frames]
+                if skipped:
+                    st.info(f"No supported endpoint for: {', '.join(skipped)}")
             except Exception as e:
-                st.error(f"Failed to fetch data for selected profile: {e}")
+                st.error(f"Failed to fetch data for selected profiles: {e}")
 
 
 st.title("FHIR → OMOP Agent + QA Copilot")
 
 # --- FHIR Resource Viewer ---
 st.header("View FHIR Resources from HAPI FHIR Server")
-FHIR_BASE = "https://hapi.fhir.org/baseR4"
 resource_types = [
     "Account", "ActivityDefinition", "AdverseEvent", "AllergyIntolerance", "Appointment", "AppointmentResponse", "AuditEvent", "Basic", "Binary", "BiologicallyDerivedProduct", "BodyStructure", "Bundle", "CapabilityStatement", "CarePlan", "CareTeam", "CatalogEntry", "ChargeItem", "ChargeItemDefinition", "Claim", "ClaimResponse", "ClinicalImpression", "CodeSystem", "Communication", "CommunicationRequest", "CompartmentDefinition", "Composition", "ConceptMap", "Condition", "Consent", "Contract", "Coverage", "CoverageEligibilityRequest", "CoverageEligibilityResponse", "DetectedIssue", "Device", "DeviceDefinition", "DeviceMetric", "DeviceRequest", "DeviceUseStatement", "DiagnosticReport", "DocumentManifest", "DocumentReference", "EffectEvidenceSynthesis", "Encounter", "Endpoint", "EnrollmentRequest", "EnrollmentResponse", "EpisodeOfCare", "EventDefinition", "Evidence", "EvidenceVariable", "ExampleScenario", "ExplanationOfBenefit", "FamilyMemberHistory", "Flag", "Goal", "GraphDefinition", "Group", "GuidanceResponse", "HealthcareService", "ImagingStudy", "Immunization", "ImmunizationEvaluation", "ImmunizationRecommendation", "ImplementationGuide", "InsurancePlan", "Invoice", "Library", "Linkage", "List", "Location", "Measure", "MeasureReport", "Media", "Medication", "MedicationAdministration", "MedicationDispense", "MedicationKnowledge", "MedicationRequest", "MedicationStatement", "MedicinalProduct", "MedicinalProductAuthorization", "MedicinalProductContraindication", "MedicinalProductIndication", "MedicinalProductIngredient", "MedicinalProductInteraction", "MedicinalProductManufactured", "MedicinalProductPackaged", "MedicinalProductPharmaceutical", "MedicinalProductUndesirableEffect", "MessageDefinition", "MessageHeader", "MolecularSequence", "NamingSystem", "NutritionOrder", "Observation", "ObservationDefinition", "OperationDefinition", "OperationOutcome", "Organization", "OrganizationAffiliation", "Parameters", "Patient", "PaymentNotice", "PaymentReconciliation", "Person", "PlanDefinition", "Practitioner", "PractitionerRole", "Procedure", "Provenance", "Questionnaire", "QuestionnaireResponse", "RelatedPerson", "RequestGroup", "ResearchDefinition", "ResearchElementDefinition", "ResearchStudy", "ResearchSubject", "RiskAssessment", "RiskEvidenceSynthesis", "Schedule", "SearchParameter", "ServiceRequest", "Slot", "Specimen", "SpecimenDefinition", "StructureDefinition", "StructureMap", "Subscription", "Substance", "SubstanceNucleicAcid", "SubstancePolymer", "SubstanceProtein", "SubstanceReferenceInformation", "SubstanceSourceMaterial", "SubstanceSpecification", "SupplyDelivery", "SupplyRequest", "Task", "TerminologyCapabilities", "TestReport", "TestScript", "ValueSet", "VerificationResult", "VisionPrescription"
 ]
@@ -306,12 +514,8 @@ if 'last_resource_type' not in st.session_state:
     st.session_state['last_resource_type'] = None
 
 if st.button("Fetch FHIR Resources"):
-    url = f"{FHIR_BASE}/{resource_type}?_count={num_rows}"
     try:
-        resp = requests.get(url)
-        resp.raise_for_status()
-        bundle = resp.json()
-        resources = [entry["resource"] for entry in bundle.get("entry", [])]
+        resources = fetch_fhir_resources(resource_type, num_rows)
         st.session_state['resources'] = resources
         st.session_state['last_resource_type'] = resource_type
     except Exception as e:
@@ -323,7 +527,6 @@ last_resource_type = st.session_state['last_resource_type']
 if resources:
     st.write(f"Showing {len(resources)} {last_resource_type} resources:")
     try:
-        import pandas as pd
         df = pd.json_normalize(resources)
         st.dataframe(df)
     except Exception as e:
@@ -332,188 +535,90 @@ if resources:
 
 # --- Map to OMOP ---
 
-# Hybrid mapping: try hard-coded, fallback to LLM if error
-def map_patient_to_person(resource):
-    try:
-        # Map FHIR Patient resource to OMOP person table (7 columns)
-        # Fallback to None if not present
-        def to_int(val):
-            try:
-                return int(val)
-            except (TypeError, ValueError):
-                return None
-
-        birth_date = resource.get('birthDate')
-        year = to_int(birth_date[:4]) if birth_date else None
-        month = to_int(birth_date[5:7]) if birth_date and len(birth_date) >= 7 else None
-        day = to_int(birth_date[8:10]) if birth_date and len(birth_date) >= 10 else None
-
-        # OMOP expects integer person_id, gender_concept_id, race_concept_id, ethnicity_concept_id
-        person_id = to_int(resource.get('id'))
-        gender_concept_id = None  # Could map from gender string if desired
-        race_concept_id = None
-        ethnicity_concept_id = None
-
-        return (
-            person_id,
-            gender_concept_id,
-            year,
-            month,
-            day,
-            race_concept_id,
-            ethnicity_concept_id
-        )
-    except Exception:
-        # Fallback: use LLM to generate SQL, parse values
-        sql = fhir_to_omop_sql(resource, 'person')
-        import re
-        m = re.search(r"VALUES ?\((.*?)\)", sql, re.DOTALL)
-        if m:
-            vals = [v.strip().strip("'\"") for v in m.group(1).split(',')]
-            # Pad/truncate to 7 values
-            vals = (vals + [None]*7)[:7]
-            return tuple(vals)
-        return (None, None, None, None, None, None, None)
-
-def map_condition_to_condition_occurrence(resource):
-    try:
-        subject = resource.get('subject', {})
-        code = resource.get('code', {})
-        coding = code.get('coding', [{}])[0]
-        return (
-            resource.get('id'),
-            subject.get('reference'),
-            coding.get('code'),
-            coding.get('system'),
-            resource.get('onsetDateTime'),
-            resource.get('recordedDate')
-        )
-    except Exception:
-        sql = fhir_to_omop_sql(resource, 'condition_occurrence')
-        import re
-        m = re.search(r"VALUES ?\((.*?)\)", sql, re.DOTALL)
-        if m:
-            vals = [v.strip().strip("'\"") for v in m.group(1).split(',')]
-            return tuple(vals)
-        return (None, None, None, None, None, None)
-
-def map_encounter_to_visit_occurrence(resource):
-    try:
-        subject = resource.get('subject', {})
-        period = resource.get('period', {})
-        type_list = resource.get('type', [{}])
-        coding = type_list[0].get('coding', [{}])[0]
-        return (
-            resource.get('id'),
-            subject.get('reference'),
-            period.get('start'),
-            period.get('end'),
-            coding.get('code')
-        )
-    except Exception:
-        sql = fhir_to_omop_sql(resource, 'visit_occurrence')
-        import re
-        m = re.search(r"VALUES ?\((.*?)\)", sql, re.DOTALL)
-        if m:
-            vals = [v.strip().strip("'\"") for v in m.group(1).split(',')]
-            return tuple(vals)
-        return (None, None, None, None, None)
-
-if resources and last_resource_type in ["Patient", "Condition", "Encounter"]:
+# Hybrid mapping (core/fhir_mappers.py): fast Python mappers in a worker pool (threads here, since
+# the Streamlit server is multi-threaded), LLM fallback for resources they cannot handle, batched
+# upserts through the selected backend
+if resources and last_resource_type in RESOURCE_MAPPERS:
+    remap = st.checkbox("Re-map resources that were already mapped", value=False)
     if st.button(f"Map {last_resource_type} to OMOP"):
-        conn = sqlite3.connect("omop_demo.db")
-        cur = conn.cursor()
-        if last_resource_type == "Patient":
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS person (
-                    person_id INTEGER PRIMARY KEY,
-                    gender_concept_id INTEGER,
-                    year_of_birth INTEGER,
-                    month_of_birth INTEGER,
-                    day_of_birth INTEGER,
-                    race_concept_id INTEGER,
-                    ethnicity_concept_id INTEGER
-                )
-            """)
-            rows = [map_patient_to_person(r) for r in resources]
-            cur.executemany("INSERT OR REPLACE INTO person VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
-            st.success(f"Inserted {len(rows)} Patient resources into OMOP person table.")
-        elif last_resource_type == "Condition":
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS condition_occurrence (
-                    condition_id TEXT PRIMARY KEY,
-                    person_ref TEXT,
-                    code TEXT,
-                    code_system TEXT,
-                    onset_date TEXT,
-                    recorded_date TEXT
-                )
-            """)
-            rows = [map_condition_to_condition_occurrence(r) for r in resources]
-            cur.executemany("INSERT OR REPLACE INTO condition_occurrence VALUES (?, ?, ?, ?, ?, ?)", rows)
-            st.success(f"Inserted {len(rows)} Condition resources into OMOP condition_occurrence table.")
-        elif last_resource_type == "Encounter":
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS visit_occurrence (
-                    visit_id TEXT PRIMARY KEY,
-                    person_ref TEXT,
-                    start_date TEXT,
-                    end_date TEXT,
-                    type_code TEXT
-                )
-            """)
-            rows = [map_encounter_to_visit_occurrence(r) for r in resources]
-            cur.executemany("INSERT OR REPLACE INTO visit_occurrence VALUES (?, ?, ?, ?, ?)", rows)
-            st.success(f"Inserted {len(rows)} Encounter resources into OMOP visit_occurrence table.")
-        conn.commit()
-        conn.close()
+        # Skip resources already mapped before any mapping or LLM fallback work
+        target_table = RESOURCE_MAPPERS[last_resource_type][0]
+        if remap:
+            new_resources, skipped = resources, 0
+        else:
+            new_resources, skipped = fhir_index.filter_new(resources, target_table)
+        if skipped:
+            st.info(f"Skipped {skipped} {last_resource_type} resources already mapped to {target_table}.")
+        if new_resources:
+            performance = config.get('performance', {})
+            with st.spinner(f"Mapping {len(new_resources)} {last_resource_type} resources..."):
+                stats = map_resources(last_resource_type, new_resources, engine,
+                                      workers=performance.get('workers', 4),
+                                      batch_size=performance.get('batch_size', 1000))
+            unmapped = {resource_fingerprint(r)[0] for r in stats['unmapped']}
+            fhir_index.mark_mapped([r for r in new_resources if resource_fingerprint(r)[0] not in unmapped], target_table)
+            invalidate_data_caches()
+            st.success(f"Inserted {stats['rows']} {last_resource_type} resources into OMOP {target_table} table "
+                       f"({stats['fast']} direct, {stats['llm']} via LLM).")
+            if stats['failed']:
+                st.warning(f"{stats['failed']} resources could not be mapped, even with the LLM.")
 
 st.markdown("---")
 
-uploaded_file = st.file_uploader("Upload FHIR JSON", type="json")
-
-if uploaded_file:
-    fhir_data = json.load(uploaded_file)
+uploaded_files = st.file_uploader("Upload FHIR JSON (resources or Bundles)", type="json", accept_multiple_files=True)
+
+if uploaded_files:
+    uploaded_resources = []
+    for uploaded_file in uploaded_files:
+        fhir_data = json.load(uploaded_file)
+        if fhir_data.get("resourceType") == "Bundle":
+            uploaded_resources.extend(entry["resource"] for entry in fhir_data.get("entry", []))
+        else:
+            uploaded_resources.append(fhir_data)
+    # Resources already loaded are skipped before any LLM call
+    new_uploads, skipped_uploads = fhir_index.filter_new(uploaded_resources, "condition_occurrence")
+    if skipped_uploads:
+        st.info(f"Skipped {skipped_uploads} uploaded resources already mapped to condition_occurrence.")
+if uploaded_files and new_uploads:
     st.subheader("Generated OMOP SQL")
-    sql_output = fhir_to_omop_sql(fhir_data, table="condition_occurrence")
-    st.code(sql_output, language="sql")
-
-    # Option to run SQL directly
-    st.subheader("Run SQL Insert into OMOP SQLite DB")
+    sql_outputs = [generate_omop_sql(json.dumps(r, sort_keys=True), "condition_occurrence") for r in new_uploads]
+    st.code(sql_outputs[0], language="sql")
+    if len(sql_outputs) > 1:
+        with st.expander(f"All {len(sql_outputs)} generated statements"):
+            st.code("\n\n".join(sql_outputs), language="sql")
+
+    # Generated SQL is parsed, checked against the OMOP schema and loaded as prepared batches in one transaction
+    st.subheader("Run SQL Insert into OMOP DB")
+    skip_invalid = st.checkbox("Skip statements that fail validation", value=True)
     if st.button("Run SQL Insert"):
         try:
-            conn = sqlite3.connect("omop_demo.db")
-            cur = conn.cursor()
-            cur.execute(sql_output)
-            conn.commit()
-            st.success("SQL executed and data inserted into omop_demo.db!")
+            written, skipped = load_llm_inserts(sql_outputs, engine, skip_invalid=skip_invalid)
+            skipped_indexes = {index for index, _ in skipped}
+            fhir_index.mark_mapped([r for i, r in enumerate(new_uploads) if i not in skipped_indexes],
+                                   "condition_occurrence")
+            invalidate_data_caches()
+            st.success(f"Inserted {sum(written.values())} rows: {written}")
+            for index, error in skipped:
+                st.warning(f"Skipped statement {index + 1}: {error}")
         except Exception as e:
             st.error(f"SQL execution failed: {e}")
-        finally:
-            conn.close()
 
 st.markdown("---")
 
-st.subheader("Run QA on OMOP Table (from SQLite DB)")
-conn = sqlite3.connect("omop_demo.db")
-tables = pd.read_sql_query("SELECT name FROM sqlite_master WHERE type='table';", conn)
-table_list = tables['name'].tolist()
+st.subheader("Run QA on OMOP Table")
+try:
+    table_list = list_tables(db_key)
+except Exception as e:
+    table_list = []
+    st.info(f"Could not list OMOP tables: {e}")
 if table_list:
     selected_table = st.selectbox("Select OMOP table", table_list)
     if st.button("Run QA Copilot on Table"):
-        df = pd.read_sql_query(f"SELECT * FROM {selected_table}", conn)
-        csv_path = f"{selected_table}.csv"
-        df.to_csv(csv_path, index=False)
-        output_path = f"qa_report_{selected_table}.html"
-        orchestrator.run_qa(csv_path, output_path)
-        st.success(f"QA Report generated: {output_path}")
-        with open(output_path, "r", encoding="utf-8") as f:
-            html_content = f.read()
-        components.html(html_content, height=800, scrolling=True)
+        job_id = job_queue.submit('qa', qa_table=selected_table, qa_csv=f"{selected_table}.csv", qa_html=f"qa_report_{selected_table}.html",
+                                  overrides=job_overrides)
+        st.info(f"QA queued as job #{job_id}. The report appears under Background Jobs when ready.")
 else:
-    st.info("No OMOP tables found in omop_demo.db.")
-
-conn.close()
+    st.info("No OMOP tables found in the selected database.")
 
 # --- Full MCP Pipeline Button ---
 st.markdown("---")
@@ -523,12 +628,13 @@ if st.button("Run Full MCP Pipeline"):
     fhir_json = {"resourceType": "Patient", "id": "123", "gender": "female", "birthDate": "1980-01-01"}
     qa_csv = "person.csv"
     qa_html = "qa_report_person.html"
-    results = orchestrator.orchestrate(
+    job_id = job_queue.submit(
+        'pipeline',
         steps=['etl', 'llm_mapping', 'qa', 'analytics'],
         fhir_json=fhir_json,
         table="person",
         qa_csv=qa_csv,
-        qa_html=qa_html
+        qa_html=qa_html,
+        overrides=job_overrides
     )
-    st.success("Full MCP pipeline complete!")
-    st.json(results)
+    st.success(f"Full MCP pipeline queued as job #{job_id}. Track its progress under Background Jobs.")
@@ -0,0 +1,101 @@
+"""
+Throughput benchmark for the OMOP → FHIR NDJSON bulk export.
+Builds a synthetic SQLite OMOP database (person, observation and
+condition_occurrence), exports it with core.fhir_export for each worker
+count and compression setting, and reports resources per second, output
+size and peak memory of the export processes.
+
+Usage: python benchmarks/export_throughput.py [--persons 200000] [--observations 1000000] [--workers 1,3] [--gzip]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a fresh interpreter so peak RSS (children included) belongs to this export only
+EXPORT_SCRIPT = """
+import json, os, resource, sys, time
+from core.fhir_export import export_fhir_ndjson
+db_path, output_dir, workers, compress = sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4] == '1'
+started = time.perf_counter()
+manifest = export_fhir_ndjson(db_type='sqlite', db_path=db_path, output_dir=output_dir, workers=workers, compress=compress)
+seconds = time.perf_counter() - started
+# VmHWM, not RUSAGE_SELF: ru_maxrss survives exec and would report the parent benchmark's peak
+own_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if os.path.exists('/proc/self/status'):
+    own_kb = next(int(line.split()[1]) for line in open('/proc/self/status') if line.startswith('VmHWM'))
+peak_kb = max(own_kb, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+print(json.dumps({'seconds': seconds, 'peak_rss_mb': peak_kb / 1024, 'output': manifest['output'], 'error': manifest['error']}))
+"""
+
+
+def build_database(path, persons, observations):
+    """Synthetic OMOP tables: one condition per five observations."""
+    import numpy as np
+    import pandas as pd
+    import sqlalchemy
+    rng = np.random.default_rng(0)
+    engine = sqlalchemy.create_engine(f'sqlite:///{path}')
+    person_ids = np.arange(1, persons + 1)
+    pd.DataFrame({
+        'person_id': person_ids,
+        'gender_concept_id': rng.choice([8507, 8532], persons),
+        'year_of_birth': rng.integers(1930, 2020, persons),
+        'month_of_birth': rng.integers(1, 13, persons),
+        'day_of_birth': rng.integers(1, 29, persons),
+    }).to_sql('person', engine, index=False, chunksize=100000)
+    days = np.datetime64('2015-01-01') + rng.integers(0, 3000, observations)
+    pd.DataFrame({
+        'observation_id': np.arange(1, observations + 1),
+        'person_id': rng.choice(person_ids, observations),
+        'observation_concept_id': rng.integers(3000000, 3000050, observations),
+        'observation_date': days.astype(str),
+        'value_as_number': np.round(rng.normal(100, 20, observations), 1),
+    }).to_sql('observation', engine, index=False, chunksize=100000)
+    conditions = observations // 5
+    pd.DataFrame({
+        'condition_occurrence_id': np.arange(1, conditions + 1),
+        'person_id': rng.choice(person_ids, conditions),
+        'condition_concept_id': rng.choice([31967, 201826, 432791, 313217, 457661], conditions),
+        'condition_start_date': days[:conditions].astype(str),
+    }).to_sql('condition_occurrence', engine, index=False, chunksize=100000)
+    engine.dispose()
+
+
+def run_export(db_path, output_dir, workers, compress):
+    proc = subprocess.run([sys.executable, '-c', EXPORT_SCRIPT, db_path, output_dir, str(workers), '1' if compress else '0'],
+                          cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"export failed:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--persons', type=int, default=200000)
+    parser.add_argument('--observations', type=int, default=1000000)
+    parser.add_argument('--workers', default='1,3', help="comma-separated worker counts to compare")
+    parser.add_argument('--gzip', action='store_true', help="also benchmark gzip-compressed output")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'omop_bench.db')
+        build_database(db_path, args.persons, args.observations)
+        for compress in ([False, True] if args.gzip else [False]):
+            for workers in (int(w) for w in args.workers.split(',')):
+                result = run_export(db_path, os.path.join(tmp, f'export_{workers}_{int(compress)}'), workers, compress)
+                if result['error']:
+                    sys.exit(f"export errors: {result['error']}")
+                count = sum(item['count'] for item in result['output'])
+                size_mb = sum(os.path.getsize(item['url']) for item in result['output']) / 1e6
+                print(f"workers={workers} gzip={'yes' if compress else 'no ':<3} {count:>10,} resources "
+                      f"{result['seconds']:7.2f} s {count / result['seconds']:>10,.0f} res/s "
+                      f"{size_mb:8.1f} MB  peak {result['peak_rss_mb']:6.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Cold-start import benchmark for the CLI/worker entry points.
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter for
+each entry module, reports the cumulative import time, and fails if a heavy
+dependency is imported eagerly or a module exceeds its time budget.
+
+Usage: python benchmarks/import_time.py [--budget-ms 300] [--repeat 3]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must stay cheap to import
+ENTRY_MODULES = [
+    'core.etl',
+    'core.fhir_to_omop',
+    'core.qa_copilot',
+    'core.orchestration.mcp_orchestrator',
+    'core.orchestration.job_queue',
+    'core.cli',
+]
+
+# Dependencies that must only be imported by the step that needs them
+HEAVY_MODULES = ['pandas', 'numpy', 'matplotlib', 'sqlalchemy', 'ydata_profiling', 'ollama']
+
+
+def measure(module):
+    """Return (cumulative import time in ms, set of top-level modules imported)."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr}")
+    imported, total_us = set(), 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        imported.add(name.split('.')[0])
+        if name == module:
+            total_us = int(cumulative)
+    return total_us / 1000.0, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=300.0, help="max cumulative import time per module")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per module; the fastest is reported")
+    args = parser.parse_args()
+    failures = []
+    for module in ENTRY_MODULES:
+        runs = [measure(module) for _ in range(args.repeat)]
+        best_ms = min(ms for ms, _ in runs)
+        heavy = sorted(set(HEAVY_MODULES) & runs[0][1])
+        status = 'ok'
+        if heavy:
+            status = f"FAIL eager import of {', '.join(heavy)}"
+        elif best_ms > args.budget_ms:
+            status = f"FAIL over budget ({args.budget_ms:.0f} ms)"
+        if status != 'ok':
+            failures.append(module)
+        print(f"{module:<40} {best_ms:8.1f} ms  {status}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Command-line pipeline runner for headless/scheduled runs.
+Runs orchestrator steps with config overrides for the backend and the
+performance knobs, and reports per-step timings as text or JSON.
+
+Usage: python -m core.cli run --steps etl,qa --workers 8 --chunk-size 500000 --backend postgresql --format json
+"""
+
+import argparse
+import contextlib
+import json
+import resource
+import sys
+import time
+import traceback
+
+from core.orchestration.mcp_orchestrator import MCPOrchestrator, PIPELINE_STEPS
+
+__all__ = ["run_steps", "main"]
+
+
+def _overrides(args):
+    """Map CLI flags onto dotted config paths (unset flags keep the config value)."""
+    return {
+        'database.backend': args.backend,
+        'database.sqlite_path': args.db_path,
+        'database.sqlite_shards': args.shards,
+        'cache.dir': args.cache_dir,
+        'performance.workers': args.workers,
+        'performance.chunk_size': args.chunk_size,
+        'performance.batch_size': args.batch_size,
+    }
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_steps(orchestrator, steps, keep_going=False, **step_args):
+    """
+    Run steps one at a time through the orchestrator, timing each.
+    Stops at the first failure unless keep_going is set.
+    Returns a report dict: {'steps': [...], 'total_seconds': ..., 'ok': ...}.
+    """
+    report = {'config': orchestrator.config_path, 'steps': [], 'ok': True}
+    started = time.perf_counter()
+    for step in steps:
+        entry = {'step': step, 'status': 'done'}
+        step_started = time.perf_counter()
+        try:
+            entry['result'] = orchestrator.orchestrate(steps=[step], **step_args).get(step)
+        except Exception as e:
+            entry['status'] = 'failed'
+            entry['error'] = f"{type(e).__name__}: {e}"
+            entry['traceback'] = traceback.format_exc()
+            report['ok'] = False
+        entry['seconds'] = round(time.perf_counter() - step_started, 3)
+        entry['peak_rss_mb'] = _peak_rss_mb()
+        report['steps'].append(entry)
+        if not report['ok'] and not keep_going:
+            break
+    report['total_seconds'] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def _print_text(report, out):
+    for entry in report['steps']:
+        line = f"{entry['step']:<12} {entry['status']:<7} {entry['seconds']:>9.3f}s  peak RSS {entry['peak_rss_mb']} MB"
+        if entry['status'] == 'failed':
+            line += f"\n  {entry['error']}"
+        print(line, file=out)
+    print(f"{'total':<12} {'ok' if report['ok'] else 'failed':<7} {report['total_seconds']:>9.3f}s", file=out)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m core.cli', description="FHIR → OMOP pipeline runner")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="run pipeline steps")
+    run.add_argument('--steps', default='etl,qa,analytics',
+                     help=f"comma-separated steps from: {', '.join(PIPELINE_STEPS)}")
+    run.add_argument('--config', default='config.yaml', help="config file (default: config.yaml)")
+    run.add_argument('--backend', choices=['sqlite', 'postgresql'], help="override database.backend")
+    run.add_argument('--db-path', help="override database.sqlite_path")
+    run.add_argument('--shards', type=int, help="override database.sqlite_shards")
+    run.add_argument('--cache-dir', help="override cache.dir")
+    run.add_argument('--workers', type=int, help="override performance.workers")
+    run.add_argument('--chunk-size', type=int, help="override performance.chunk_size")
+    run.add_argument('--batch-size', type=int, help="override performance.batch_size")
+    run.add_argument('--fhir-json', help="FHIR resource JSON file for the llm_mapping step")
+    run.add_argument('--table', help="target OMOP table for the llm_mapping step")
+    run.add_argument('--qa-table', help="OMOP table exported and profiled by the qa step")
+    run.add_argument('--qa-csv', help="CSV profiled by the qa step")
+    run.add_argument('--qa-html', help="QA report output path")
+    run.add_argument('--keep-going', action='store_true', help="run remaining steps after a failure")
+    run.add_argument('--format', choices=['text', 'json'], default='text', help="report format")
+    run.add_argument('--output', help="write the report to this file instead of stdout")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    steps = [s.strip() for s in args.steps.split(',') if s.strip()]
+    unknown = [s for s in steps if s not in PIPELINE_STEPS]
+    if unknown:
+        sys.exit(f"Unknown step(s): {', '.join(unknown)}. Choose from: {', '.join(PIPELINE_STEPS)}")
+    if 'llm_mapping' in steps and not (args.fhir_json and args.table):
+        sys.exit("The llm_mapping step needs --fhir-json and --table")
+    fhir_json = None
+    if args.fhir_json:
+        with open(args.fhir_json, 'r', encoding='utf-8') as f:
+            fhir_json = json.load(f)
+    orchestrator = MCPOrchestrator(config_path=args.config, overrides=_overrides(args))
+    # Keep stdout machine-readable: step progress messages go to stderr in JSON mode
+    quiet = args.format == 'json' and not args.output
+    with contextlib.redirect_stdout(sys.stderr) if quiet else contextlib.nullcontext():
+        report = run_steps(orchestrator, steps, keep_going=args.keep_going, fhir_json=fhir_json, table=args.table,
+                           qa_csv=args.qa_csv, qa_html=args.qa_html, qa_table=args.qa_table)
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        if args.format == 'json':
+            json.dump(report, out, indent=2, default=str)
+            out.write("\n")
+        else:
+            _print_text(report, out)
+    finally:
+        if args.output:
+            out.close()
+    return 0 if report['ok'] else 1
+
+
+# Script usage: python -m core.cli run --steps etl,analytics --format json
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""
+Cohort definitions over the OMOP tables loaded by run_etl.
+Each criterion (concept in a set, age range, observation in a date window)
+is evaluated once with a single SQL query into a PersonBitmap: one bit per
+person in the person table, packed 8 persons per byte. Bitmaps are cached
+per criterion, and cohorts combine them with &, | and ~ in memory, so
+refining a cohort re-runs no SQL and takes milliseconds even for tens of
+millions of persons.
+"""
+
+import datetime
+
+import numpy as np
+
+__all__ = [
+    "PersonUniverse", "PersonBitmap", "Criterion", "ConceptCriterion", "AgeCriterion",
+    "ObservationWindowCriterion", "CohortEngine",
+]
+
+# Rows fetched per round trip when reading person_id lists
+FETCH_SIZE = 100000
+# Bound parameters per IN (...) list
+MAX_IN_PARAMS = 500
+
+
+def _read_ids(engine, sql, params=None):
+    """person_id column of a query as a sorted, unique int64 array, read in batches."""
+    import itertools
+    import sqlalchemy
+    parts = []
+    query = sqlalchemy.text(f"SELECT person_id FROM ({sql}) AS ids WHERE person_id IS NOT NULL")
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(query, params or {})
+        # Plain DBAPI tuples: building SQLAlchemy Row objects would cost several times the fetch itself
+        while True:
+            rows = result.cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            parts.append(np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64, count=len(rows)))
+    return np.unique(np.concatenate(parts)) if parts else np.array([], dtype=np.int64)
+
+
+class PersonUniverse:
+    """All person_ids (sorted); bit i of every PersonBitmap stands for ids[i]."""
+
+    def __init__(self, ids):
+        self.ids = np.asarray(ids, dtype=np.int64)
+
+    @classmethod
+    def load(cls, engine):
+        return cls(_read_ids(engine, "SELECT person_id FROM person"))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def bitmap(self, person_ids):
+        """PersonBitmap with the given person_ids set (ids outside the universe are ignored)."""
+        person_ids = np.asarray(person_ids, dtype=np.int64)
+        pos = np.searchsorted(self.ids, person_ids)
+        inside = pos < len(self.ids)
+        pos = pos[inside]
+        bits = np.zeros(len(self.ids), dtype=bool)
+        bits[pos[self.ids[pos] == person_ids[inside]]] = True
+        return PersonBitmap(self, np.packbits(bits, bitorder='little'))
+
+
+class PersonBitmap:
+    """Packed set of persons from a PersonUniverse, combined with &, |, - and ~."""
+
+    def __init__(self, universe, packed):
+        self.universe = universe
+        self.packed = packed
+
+    def _check(self, other):
+        if other.universe is not self.universe:
+            raise ValueError("Bitmaps come from different person universes; re-evaluate after reloading")
+
+    def __and__(self, other):
+        self._check(other)
+        return PersonBitmap(self.universe, self.packed & other.packed)
+
+    def __or__(self, other):
+        self._check(other)
+        return PersonBitmap(self.universe, self.packed | other.packed)
+
+    def __sub__(self, other):
+        self._check(other)
+        return PersonBitmap(self.universe, self.packed & ~other.packed)
+
+    def __invert__(self):
+        packed = ~self.packed
+        # Clear the padding bits past the last person
+        tail = len(self.universe) % 8
+        if tail:
+            packed[-1] &= (1 << tail) - 1
+        return PersonBitmap(self.universe, packed)
+
+    def __len__(self):
+        return int(np.bitwise_count(self.packed).sum())
+
+    def person_ids(self, limit=None):
+        """Sorted person_ids in the set (the first `limit` only, if given)."""
+        bits = np.unpackbits(self.packed, count=len(self.universe), bitorder='little').view(bool)
+        ids = self.universe.ids[bits]
+        return ids[:limit] if limit is not None else ids
+
+    def nbytes(self):
+        return self.packed.nbytes
+
+
+class Criterion:
+    """
+    A cohort criterion: sql() returns a query selecting person_id plus its
+    parameters. Combine criteria with &, | and ~ into expressions for
+    CohortEngine.evaluate; key() identifies the criterion in the cache.
+    """
+
+    def sql(self):
+        raise NotImplementedError
+
+    def key(self):
+        sql, params = self.sql()
+        return sql, tuple(sorted(params.items()))
+
+    def __and__(self, other):
+        return _Combined('and', self, other)
+
+    def __or__(self, other):
+        return _Combined('or', self, other)
+
+    def __invert__(self):
+        return _Combined('not', self)
+
+
+class _Combined(Criterion):
+    def __init__(self, op, *parts):
+        self.op = op
+        self.parts = parts
+
+    def key(self):
+        return (self.op,) + tuple(part.key() for part in self.parts)
+
+
+def _in_clause(column, values, prefix):
+    values = sorted(set(values))
+    if not values:
+        return "1 = 0", {}
+    params = {f"{prefix}{i}": v for i, v in enumerate(values)}
+    # Long sets are split into several IN lists to stay under driver parameter limits
+    groups = [list(params)[i:i + MAX_IN_PARAMS] for i in range(0, len(params), MAX_IN_PARAMS)]
+    clause = " OR ".join(f"{column} IN ({', '.join(':' + name for name in group)})" for group in groups)
+    return f"({clause})", params
+
+
+class ConceptCriterion(Criterion):
+    """Persons with at least one row in `table` whose concept `column` is in concept_ids."""
+
+    def __init__(self, concept_ids, table='observation', column='observation_concept_id'):
+        self.concept_ids = tuple(sorted({int(c) for c in concept_ids}))
+        self.table = table
+        self.column = column
+
+    def sql(self):
+        clause, params = _in_clause(self.column, self.concept_ids, 'concept')
+        return f"SELECT person_id FROM {self.table} WHERE {clause}", params
+
+
+class AgeCriterion(Criterion):
+    """Persons aged min_age..max_age (inclusive, by year of birth) on as_of (default: today)."""
+
+    def __init__(self, min_age=None, max_age=None, as_of=None):
+        self.min_age = min_age
+        self.max_age = max_age
+        self.as_of = as_of or datetime.date.today()
+
+    def sql(self):
+        conditions, params = ["year_of_birth IS NOT NULL"], {}
+        if self.max_age is not None:
+            conditions.append("year_of_birth >= :min_year")
+            params['min_year'] = self.as_of.year - self.max_age
+        if self.min_age is not None:
+            conditions.append("year_of_birth <= :max_year")
+            params['max_year'] = self.as_of.year - self.min_age
+        return f"SELECT person_id FROM person WHERE {' AND '.join(conditions)}", params
+
+
+class ObservationWindowCriterion(Criterion):
+    """
+    Persons with an observation in [start_date, end_date) (either bound optional),
+    optionally restricted to concept_ids. Uses the observation_date index.
+    """
+
+    def __init__(self, start_date=None, end_date=None, concept_ids=None):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.concept_ids = tuple(sorted({int(c) for c in concept_ids})) if concept_ids else None
+
+    def sql(self):
+        conditions, params = [], {}
+        if self.start_date:
+            conditions.append("observation_date >= :start_date")
+            params['start_date'] = str(self.start_date)
+        if self.end_date:
+            conditions.append("observation_date < :end_date")
+            params['end_date'] = str(self.end_date)
+        if self.concept_ids:
+            clause, concept_params = _in_clause('observation_concept_id', self.concept_ids, 'concept')
+            conditions.append(clause)
+            params.update(concept_params)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return f"SELECT person_id FROM observation{where}", params
+
+
+class CohortEngine:
+    """
+    Evaluates criteria against one database. The person universe and each
+    leaf criterion's bitmap are computed once and cached; call clear() after
+    the OMOP tables change.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.clear()
+
+    def clear(self):
+        self._universe = None
+        self._bitmaps = {}
+
+    @property
+    def universe(self):
+        if self._universe is None:
+            self._universe = PersonUniverse.load(self.engine)
+        return self._universe
+
+    def evaluate(self, criterion):
+        """PersonBitmap for a criterion or an &/|/~ combination of criteria."""
+        if isinstance(criterion, _Combined):
+            bitmaps = [self.evaluate(part) for part in criterion.parts]
+            if criterion.op == 'not':
+                return ~bitmaps[0]
+            return bitmaps[0] & bitmaps[1] if criterion.op == 'and' else bitmaps[0] | bitmaps[1]
+        key = criterion.key()
+        if key not in self._bitmaps:
+            sql, params = criterion.sql()
+            self._bitmaps[key] = self.universe.bitmap(_read_ids(self.engine, sql, params))
+        return self._bitmaps[key]
+
+    def count(self, criterion):
+        return len(self.evaluate(criterion))
+
+    def cached_criteria(self):
+        return len(self._bitmaps)
+
+
+# Script usage:
+#   from utils.db_utils import get_db_engine
+#   cohorts = CohortEngine(get_db_engine("sqlite", db_path="omop_demo.db"))
+#   cohort = AgeCriterion(40, 65) & ConceptCriterion([3000008]) & ~ObservationWindowCriterion("2022-06-01", "2023-01-01")
+#   print(cohorts.count(cohort), cohorts.evaluate(cohort).person_ids(limit=10))
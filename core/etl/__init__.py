@@ -1,3 +1,19 @@
 # ETL module init
-from .etl_load import run_etl
-from .analytics_visualization import run_analytics
+# Step entry points are resolved lazily so `import core.etl` does not pull in
+# pandas, SQLAlchemy or matplotlib until a step is actually used.
+import importlib
+
+_EXPORTS = {
+    'run_etl': '.etl_load',
+    'run_analytics': '.analytics_visualization',
+    'run_genomic_etl': '.genomic_etl',
+    'run_derived_tables': '.derived_tables',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
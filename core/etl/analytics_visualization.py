@@ -1,29 +1,47 @@
 
 import pandas as pd
-import matplotlib.pyplot as plt
 import os
-from utils.db_utils import get_db_engine
+import sqlalchemy
+from utils.db_utils import get_db_engine, year_expression
 from utils.config_utils import load_config
+from utils.sharded_sqlite import ShardedSQLite
 
 __all__ = ["run_analytics"]
 
-def run_analytics(db_type=None, db_path=None, pg_settings=None, config_path="config.yaml"):
+def run_analytics(db_type=None, db_path=None, pg_settings=None, config_path="config.yaml", start_date=None, end_date=None,
+                  shards=None):
     """
     Analytics and visualization for OMOP CDM tables
     Refactored for MCP orchestrator compatibility.
+    start_date/end_date: optional 'YYYY-MM-DD' bounds (end exclusive) for the observation charts
+    shards: SQLite shard count (defaults to config database.sqlite_shards); sharded
+            aggregates run on every shard in parallel and the counts are merged
     """
+    import matplotlib
+    matplotlib.use('Agg')  # charts are written to files; no display needed
+    import matplotlib.pyplot as plt
     config = load_config(config_path)
     db_type = db_type or config['database']['backend']
     if db_type == 'sqlite':
         db_path = db_path or config['database']['sqlite_path']
-        engine = get_db_engine(db_type=db_type, db_path=db_path)
+        shards = shards or config['database'].get('sqlite_shards', 1)
+        engine = get_db_engine(db_type=db_type, db_path=db_path, shards=shards)
     else:
+        shards = 1
         pg_settings = pg_settings or config['database']['postgresql']
         engine = get_db_engine(db_type=db_type, pg_settings=pg_settings)
+    sharded = ShardedSQLite(db_path, shards, workers=config.get('performance', {}).get('workers')) if shards > 1 else None
+
+    def count_by(sql, keys, params=None):
+        # GROUP BY ... COUNT(*) AS count, fanned out over the shards when sharded
+        if sharded is not None:
+            return sharded.aggregate(sql, keys, {'count': 'sum'}, params).sort_values(keys, ignore_index=True)
+        return pd.read_sql(sqlalchemy.text(sql), engine, params=params)
+
     base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     docs_dir = os.path.join(base_dir, config['docs']['output_dir'])
     # Persons by gender
-    gender_df = pd.read_sql("SELECT gender_concept_id, COUNT(*) as count FROM person GROUP BY gender_concept_id", engine)
+    gender_df = count_by("SELECT gender_concept_id, COUNT(*) AS count FROM person GROUP BY gender_concept_id", ['gender_concept_id'])
     plt.figure()
     gender_df.plot.bar(x='gender_concept_id', y='count', legend=False)
     plt.title('Number of Persons by Gender Concept ID')
@@ -32,17 +50,29 @@ def run_analytics(db_type=None, db_path=None, pg_settings=None, config_path="con
     plt.tight_layout()
     plt.savefig(os.path.join(docs_dir, 'persons_by_gender.png'))
     # Age distribution
-    age_df = pd.read_sql("SELECT year_of_birth FROM person", engine)
+    # Counted per birth year in the database; the histogram weights each year by its count
+    age_df = count_by("SELECT year_of_birth, COUNT(*) AS count FROM person WHERE year_of_birth IS NOT NULL GROUP BY year_of_birth",
+                      ['year_of_birth'])
     age_df['age'] = pd.Timestamp.now().year - age_df['year_of_birth']
     plt.figure()
-    age_df['age'].plot.hist(bins=10)
+    age_df['age'].plot.hist(bins=10, weights=age_df['count'])
     plt.title('Age Distribution')
     plt.xlabel('Age')
     plt.ylabel('Number of Persons')
     plt.tight_layout()
     plt.savefig(os.path.join(docs_dir, 'age_distribution.png'))
     # Observations per year
-    obs_year_df = pd.read_sql("SELECT strftime('%Y', observation_date) AS year, COUNT(*) as count FROM observation GROUP BY year ORDER BY year", engine)
+    # Plain comparisons on the DATE column (no function on it) so the observation_date index is used
+    conditions, params = [], {}
+    if start_date:
+        conditions.append("observation_date >= :start_date")
+        params['start_date'] = str(start_date)
+    if end_date:
+        conditions.append("observation_date < :end_date")
+        params['end_date'] = str(end_date)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    year = year_expression(engine, 'observation_date')
+    obs_year_df = count_by(f"SELECT {year} AS year, COUNT(*) AS count FROM observation{where} GROUP BY 1 ORDER BY 1", ['year'], params)
     plt.figure()
     obs_year_df.plot.bar(x='year', y='count', legend=False)
     plt.title('Observations per Year')
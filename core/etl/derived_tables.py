@@ -0,0 +1,251 @@
+"""
+Derived OMOP tables: observation_period and condition_era.
+Events are read one person partition at a time (ranges of person_id taken
+from the person table) and merged into intervals with a vectorized
+sort-and-scan over NumPy arrays: sort by (group, start), take a segmented
+running maximum of the end dates, and start a new interval wherever the
+next start lies beyond the running end plus the allowed gap.
+"""
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from utils.db_utils import get_db_engine, bulk_insert_frame
+from utils.config_utils import load_config
+from core.fhir_dates import parse_fhir_dates
+
+__all__ = ["run_derived_tables", "merge_intervals", "person_partitions"]
+
+EHR_PERIOD_TYPE_CONCEPT_ID = 32817   # Type Concept: EHR
+CONDITION_PERSISTENCE_DAYS = 30      # OMOP condition_era persistence window
+
+OBSERVATION_PERIOD_DDL = """
+CREATE TABLE observation_period (
+    observation_period_id BIGINT PRIMARY KEY,
+    person_id BIGINT NOT NULL,
+    observation_period_start_date DATE NOT NULL,
+    observation_period_end_date DATE NOT NULL,
+    period_type_concept_id INTEGER NOT NULL
+)
+"""
+
+CONDITION_ERA_DDL = """
+CREATE TABLE condition_era (
+    condition_era_id BIGINT PRIMARY KEY,
+    person_id BIGINT NOT NULL,
+    condition_concept_id INTEGER NOT NULL,
+    condition_era_start_date DATE NOT NULL,
+    condition_era_end_date DATE NOT NULL,
+    condition_occurrence_count INTEGER NOT NULL
+)
+"""
+
+# Event tables that count towards a person's observation period: table → (start column, end column)
+EVENT_DATES = {
+    'observation': ('observation_date', None),
+    'condition_occurrence': ('condition_start_date', 'condition_end_date'),
+    'visit_occurrence': ('visit_start_date', 'visit_end_date'),
+    'measurement': ('measurement_date', None),
+    'drug_exposure': ('drug_exposure_start_date', 'drug_exposure_end_date'),
+    'procedure_occurrence': ('procedure_date', None),
+}
+
+
+def _sort_order(keys, start):
+    """Order by (keys..., start). Packs everything into one int64 key when the value ranges allow (several times faster than lexsort)."""
+    columns = keys + [start]
+    spans = [int(c.max()) - int(c.min()) + 1 for c in columns]
+    if np.prod([float(span) for span in spans]) < 2 ** 62:
+        packed = np.zeros(len(start), dtype=np.int64)
+        for column, span in zip(columns, spans):
+            packed = packed * span + (column - column.min())
+        # Rows equal on every key and start may come out in any order; merging does not depend on it
+        return np.argsort(packed)
+    return np.lexsort((start, *reversed(keys)))
+
+
+def merge_intervals(groups, start, end, gap_days=0):
+    """
+    Merge [start, end] day-number intervals within each group.
+    groups: list of equal-length int64 key arrays (e.g. [person_id] or
+    [person_id, concept_id]); intervals whose start is more than gap_days after
+    the running end of their group open a new interval (gap_days=None merges
+    everything in a group into one interval).
+    Returns (group key arrays, start, end, count) with one entry per merged interval.
+    """
+    start = np.asarray(start, dtype=np.int64)
+    end = np.maximum(np.asarray(end, dtype=np.int64), start)
+    if not len(start):
+        return [np.asarray(g, dtype=np.int64)[:0] for g in groups], start, end, np.zeros(0, dtype=np.int64)
+    keys = [np.asarray(g, dtype=np.int64) for g in groups]
+    order = _sort_order(keys, start)
+    keys = [key[order] for key in keys]
+    start, end = start[order], end[order]
+    new_group = np.zeros(len(start), dtype=bool)
+    new_group[0] = True
+    for key in keys:
+        new_group[1:] |= key[1:] != key[:-1]
+    # Segmented running max: lift each group above the previous one so one global accumulate never crosses groups
+    group_index = np.cumsum(new_group) - 1
+    lift = int(end.max() - start.min()) + 2
+    running_end = np.maximum.accumulate(end - start.min() + group_index * lift) - group_index * lift + start.min()
+    new_interval = new_group.copy()
+    if gap_days is not None:
+        new_interval[1:] |= start[1:] > running_end[:-1] + gap_days
+    firsts = np.flatnonzero(new_interval)
+    lasts = np.append(firsts[1:] - 1, len(start) - 1)
+    return [key[firsts] for key in keys], start[firsts], running_end[lasts], lasts - firsts + 1
+
+
+def _day_numbers(values):
+    return parse_fhir_dates(values).to_numpy().astype('datetime64[D]').astype(np.int64)
+
+
+def _dates(days):
+    return pd.Series(np.asarray(days, dtype='int64').astype('datetime64[D]')).dt.date
+
+
+def person_partitions(engine, partition_size):
+    """
+    (low, high) person_id bounds (high exclusive, None = unbounded) covering
+    partition_size persons each. Only one boundary per partition is kept in memory.
+    """
+    boundaries = []
+    inspector = sqlalchemy.inspect(engine)
+    if inspector.has_table('person'):
+        for chunk in pd.read_sql("SELECT person_id FROM person WHERE person_id IS NOT NULL ORDER BY person_id",
+                                 engine, chunksize=partition_size):
+            boundaries.append(int(chunk['person_id'].iloc[0]))
+    # Events for persons outside the person table still land in the first or last partition
+    bounds = [None] + boundaries[1:] + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _partition_where(low, high):
+    conditions, params = ["person_id IS NOT NULL"], {}
+    if low is not None:
+        conditions.append("person_id >= :low")
+        params['low'] = low
+    if high is not None:
+        conditions.append("person_id < :high")
+        params['high'] = high
+    return " AND ".join(conditions), params
+
+
+def _read_events(engine, table, columns, where, params):
+    query = sqlalchemy.text(f"SELECT {', '.join(columns)} FROM {table} WHERE {where}")
+    return pd.read_sql(query, engine, params=params)
+
+
+def run_derived_tables(db_type=None, db_path=None, pg_settings=None, config_path="config.yaml",
+                       partition_size=None, persistence_days=CONDITION_PERSISTENCE_DAYS, chunk_size=None, shards=None):
+    """
+    Rebuild observation_period (one period per person, spanning all their
+    events) and condition_era (per person and condition concept, merging
+    occurrences less than persistence_days apart) from the loaded OMOP tables.
+    partition_size: persons per partition (defaults to config performance.chunk_size)
+    shards: SQLite shard count (defaults to config database.sqlite_shards)
+    Event tables whose schema lacks the expected columns (e.g. the app
+    mapper's condition_occurrence with person_ref/onset_date) are skipped
+    and reported.
+    Returns {'observation_period': rows, 'condition_era': rows, 'skipped': {table: missing columns}}.
+    """
+    config = load_config(config_path)
+    performance = config.get('performance', {})
+    partition_size = partition_size or performance.get('chunk_size') or 100000
+    chunk_size = chunk_size or performance.get('chunk_size') or 50000
+    db_type = db_type or config['database']['backend']
+    if db_type == 'sqlite':
+        db_path = db_path or config['database']['sqlite_path']
+        # Sharded SQLite: person-keyed tables are read through attached views; these outputs land in the main file
+        shards = shards or config['database'].get('sqlite_shards', 1)
+        engine = get_db_engine(db_type=db_type, db_path=db_path, shards=shards)
+    else:
+        pg_settings = pg_settings or config['database']['postgresql']
+        engine = get_db_engine(db_type=db_type, pg_settings=pg_settings)
+
+    inspector = sqlalchemy.inspect(engine)
+    sources, skipped = {}, {}
+    for table, (start_col, end_col) in EVENT_DATES.items():
+        if not inspector.has_table(table):
+            continue
+        columns = {c['name'] for c in inspector.get_columns(table)}
+        missing = [c for c in ('person_id', start_col) if c not in columns]
+        if missing:
+            skipped[table] = missing
+            print(f"Skipping {table}: no {', '.join(missing)} column (not an OMOP CDM schema).")
+            continue
+        sources[table] = (start_col, end_col if end_col in columns else None)
+    conditions = sources.get('condition_occurrence')
+    if conditions and 'condition_concept_id' not in {c['name'] for c in inspector.get_columns('condition_occurrence')}:
+        conditions = None
+        skipped.setdefault('condition_occurrence', ['condition_concept_id'])
+    if conditions is None and inspector.has_table('condition_occurrence'):
+        print("condition_occurrence is missing OMOP columns; condition_era is left empty.")
+
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text("DROP TABLE IF EXISTS observation_period"))
+        conn.execute(sqlalchemy.text("DROP TABLE IF EXISTS condition_era"))
+        conn.execute(sqlalchemy.text(OBSERVATION_PERIOD_DDL))
+        conn.execute(sqlalchemy.text(CONDITION_ERA_DDL))
+
+    counts = {'observation_period': 0, 'condition_era': 0, 'skipped': skipped}
+    for low, high in person_partitions(engine, partition_size):
+        where, params = _partition_where(low, high)
+        persons, starts, ends = [], [], []
+        for table, (start_col, end_col) in sources.items():
+            events = _read_events(engine, table, ['person_id', start_col] + ([end_col] if end_col else []), where, params)
+            start = _day_numbers(events[start_col])
+            end = _day_numbers(events[end_col]) if end_col else start
+            end = np.where(end < start, start, end)  # NaT (very negative) or inverted end dates
+            valid = start > np.iinfo(np.int64).min
+            persons.append(events['person_id'].to_numpy(dtype=np.int64)[valid])
+            starts.append(start[valid])
+            ends.append(end[valid])
+        if persons:
+            (person,), start, end, _ = merge_intervals([np.concatenate(persons)], np.concatenate(starts),
+                                                       np.concatenate(ends), gap_days=None)
+            periods = pd.DataFrame({
+                'observation_period_id': np.arange(len(person), dtype=np.int64) + counts['observation_period'] + 1,
+                'person_id': person,
+                'observation_period_start_date': _dates(start),
+                'observation_period_end_date': _dates(end),
+                'period_type_concept_id': EHR_PERIOD_TYPE_CONCEPT_ID,
+            })
+            counts['observation_period'] += bulk_insert_frame(periods, 'observation_period', engine, chunk_size)
+
+        if conditions:
+            start_col, end_col = conditions
+            events = _read_events(engine, 'condition_occurrence',
+                                  ['person_id', 'condition_concept_id', start_col] + ([end_col] if end_col else []),
+                                  where + " AND condition_concept_id IS NOT NULL", params)
+            start = _day_numbers(events[start_col])
+            # OMOP era logic: a missing end date means the condition lasted one day
+            end = _day_numbers(events[end_col]) if end_col else np.full(len(start), np.iinfo(np.int64).min)
+            end = np.where(end < start, start + 1, end)
+            valid = start > np.iinfo(np.int64).min
+            (person, concept), start, end, occurrences = merge_intervals(
+                [events['person_id'].to_numpy(dtype=np.int64)[valid],
+                 events['condition_concept_id'].to_numpy(dtype=np.int64)[valid]],
+                start[valid], end[valid], gap_days=persistence_days)
+            eras = pd.DataFrame({
+                'condition_era_id': np.arange(len(person), dtype=np.int64) + counts['condition_era'] + 1,
+                'person_id': person,
+                'condition_concept_id': concept,
+                'condition_era_start_date': _dates(start),
+                'condition_era_end_date': _dates(end),
+                'condition_occurrence_count': occurrences,
+            })
+            counts['condition_era'] += bulk_insert_frame(eras, 'condition_era', engine, chunk_size)
+
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text("CREATE INDEX IF NOT EXISTS idx_observation_period_person ON observation_period (person_id)"))
+        conn.execute(sqlalchemy.text("CREATE INDEX IF NOT EXISTS idx_condition_era_person ON condition_era (person_id)"))
+    print(f"Derived tables complete: {counts['observation_period']} observation_period and "
+          f"{counts['condition_era']} condition_era rows loaded.")
+    return counts
+
+
+# Script usage: python -m core.etl.derived_tables
+if __name__ == "__main__":
+    run_derived_tables()
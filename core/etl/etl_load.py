@@ -3,15 +3,46 @@ ETL script for OMOP CDM using both PostgreSQL and SQLite
 Refactored for MCP orchestrator compatibility.
 """
 
+import numpy as np
 import pandas as pd
 import os
 import sqlalchemy
 from sqlalchemy import create_engine
 from utils.db_utils import get_db_engine
+from utils.sharded_sqlite import ShardedSQLite
 from utils.config_utils import load_config
+from core.etl.integrity import IntegrityChecker, frame_chunks
+from core.etl.checkpoint import RunManifest, source_fingerprint, chunk_checksum, quarantine_reasons
+from core.fhir_dates import parse_fhir_dates
+from core.fhir_dedup import database_identity, forget_mapped
 
 __all__ = ["run_etl"]
 
+PERSON_DDL = """
+CREATE TABLE person (
+    person_id INTEGER PRIMARY KEY,
+    gender_concept_id INTEGER,
+    year_of_birth INTEGER,
+    month_of_birth INTEGER,
+    day_of_birth INTEGER,
+    race_concept_id INTEGER,
+    ethnicity_concept_id INTEGER
+)
+"""
+
+OBSERVATION_DDL = """
+CREATE TABLE observation (
+    observation_id INTEGER PRIMARY KEY,
+    person_id INTEGER,
+    observation_concept_id INTEGER,
+    observation_date DATE,
+    value_as_number REAL,
+    value_as_string TEXT
+)
+"""
+
+OBSERVATION_DATE_INDEX = "CREATE INDEX IF NOT EXISTS idx_observation_date ON observation (observation_date)"
+
 def load_omop_schema(engine, schema_path):
     with open(schema_path, 'r', encoding='utf-8') as f:
         schema_sql = f.read()
@@ -20,19 +51,31 @@ def load_omop_schema(engine, schema_path):
             if stmt.strip():
                 conn.execute(sqlalchemy.text(stmt))
 
-def run_etl(db_type=None, db_path=None, pg_settings=None, config_path="config.yaml"):
+def run_etl(db_type=None, db_path=None, pg_settings=None, config_path="config.yaml", chunk_size=None, shards=None):
     """
     db_type: 'sqlite' or 'postgresql' (overrides config if set)
     db_path: path to SQLite DB (if used, overrides config)
     pg_settings: dict for PostgreSQL (overrides config)
     config_path: path to config.yaml
+    chunk_size: rows per INSERT batch (defaults to config performance.chunk_size)
+    shards: SQLite shard count (defaults to config database.sqlite_shards); above 1,
+            person and observation are split by person_id hash and the shards are written in parallel
+    Chunks are checkpointed in etl_chunks as they load, so rerunning after a crash
+    resumes at the first unfinished chunk; rows failing data-quality checks go to
+    etl_quarantine instead of aborting the load.
+    Returns {'run_id', 'resumed', 'skipped_chunks', 'loaded', 'quarantined'}.
     """
     config = load_config(config_path)
+    chunk_size = chunk_size or config.get('performance', {}).get('chunk_size')
     # Determine DB settings
     db_type = db_type or config['database']['backend']
+    sharded = None
     if db_type == 'sqlite':
         db_path = db_path or config['database']['sqlite_path']
-        engine = get_db_engine(db_type=db_type, db_path=db_path)
+        shards = shards or config['database'].get('sqlite_shards', 1)
+        if shards > 1:
+            sharded = ShardedSQLite(db_path, shards, workers=config.get('performance', {}).get('workers'))
+        engine = get_db_engine(db_type=db_type, db_path=db_path, shards=shards)
     else:
         pg_settings = pg_settings or config['database']['postgresql']
         engine = get_db_engine(db_type=db_type, pg_settings=pg_settings)
@@ -51,64 +94,108 @@ def run_etl(db_type=None, db_path=None, pg_settings=None, config_path="config.ya
             except:
                 return int(obs_map[val]) if val in obs_map else None
         observation_df['observation_concept_id'] = observation_df['observation_concept_id'].apply(map_concept_id)
+    # Dates are stored natively (DATE) so range filters can use the observation_date index
+    observation_dates = parse_fhir_dates(observation_df['observation_date'])
+    invalid_dates = observation_df['observation_date'].notna() & observation_dates.isna()
+    # Unparseable values keep their source text: those rows are quarantined, never loaded
+    observation_df['observation_date'] = observation_dates.dt.date.where(~invalid_dates, observation_df['observation_date'])
+
+    # Run manifest: a crashed run with the same inputs is resumed instead of reloaded from scratch
+    chunk_size = chunk_size or 50000
+    manifest = RunManifest(engine)
+    source_paths = [os.path.join(data_dir, config['data'][name])
+                    for name in ('person_sample', 'observation_sample', 'code_mapping_sample')]
+    run_id, resumed = manifest.start(source_fingerprint(source_paths, chunk_size=chunk_size, db_type=db_type,
+                                                        shards=shards if db_type == 'sqlite' else None))
 
     # --- Automatic OMOP table creation for SQLite ---
-    if db_type == 'sqlite':
+    if db_type == 'sqlite' and not resumed:
         import sqlite3
         conn = sqlite3.connect(db_path)
         cur = conn.cursor()
-        # Drop and recreate person table with all columns from sample data
+        # Drop and recreate person and observation tables with all columns from sample data
         cur.execute("DROP TABLE IF EXISTS person;")
-        cur.execute("""
-        CREATE TABLE person (
-            person_id INTEGER PRIMARY KEY,
-            gender_concept_id INTEGER,
-            year_of_birth INTEGER,
-            month_of_birth INTEGER,
-            day_of_birth INTEGER,
-            race_concept_id INTEGER,
-            ethnicity_concept_id INTEGER
-        )
-        """)
-        # Drop and recreate observation table with all columns from sample data
         cur.execute("DROP TABLE IF EXISTS observation;")
-        cur.execute("""
-        CREATE TABLE observation (
-            observation_id INTEGER PRIMARY KEY,
-            person_id INTEGER,
-            observation_concept_id INTEGER,
-            observation_date TEXT,
-            value_as_number REAL,
-            value_as_string TEXT
-        )
-        """)
+        if sharded is None:
+            cur.execute(PERSON_DDL)
+            cur.execute(OBSERVATION_DDL)
         conn.commit()
         conn.close()
-    # Data quality checks (as before)
-    errors = []
-    if not person_df['person_id'].notnull().all():
-        errors.append("Missing person_id in person data")
-    if not observation_df['person_id'].notnull().all():
-        errors.append("Missing person_id in observation data")
-    if person_df['person_id'].duplicated().any():
-        errors.append("Duplicate person_id found in person data")
+        if sharded is not None:
+            # The main file keeps no copy; every shard gets the same schema
+            sharded.execute(["DROP TABLE IF EXISTS person", "DROP TABLE IF EXISTS observation", PERSON_DDL, OBSERVATION_DDL])
+        # FHIR resources mapped into the dropped tables must be mapped again
+        cache = config.get('cache', {})
+        forget_mapped(os.path.join(base_dir, cache.get('dir', '.cache'), cache.get('fhir_index', 'fhir_resource_index.sqlite')),
+                      database_identity(db_type, db_path), ['person', 'observation'])
+    # Data quality checks: failing rows are quarantined (etl_quarantine) rather than aborting the load
+    # Keys are checked chunk by chunk against compact id indexes (IntegrityChecker)
     from datetime import datetime
     current_year = datetime.now().year
-    if (person_df['year_of_birth'] > current_year).any():
-        errors.append("year_of_birth in the future found in person data")
-    if not observation_df['person_id'].isin(person_df['person_id']).all():
-        errors.append("Observation references person_id not in person table")
-    if observation_df['observation_concept_id'].isnull().any():
-        errors.append("Unmapped observation_concept_id found in observation data")
-    if errors:
-        print("Data Quality Issues Found:")
-        for err in errors:
-            print(f"- {err}")
-        raise ValueError("Data quality checks failed. See errors above.")
-    # Load data into database
-    person_df.to_sql('person', engine, if_exists='append', index=False)
-    observation_df.to_sql('observation', engine, if_exists='append', index=False)
+    checker = IntegrityChecker()
+
+    def duplicate_rows(table, df, column):
+        checker.index_table(table, column, frame_chunks(df, chunk_size))
+        return np.concatenate([np.zeros(0, dtype=bool), *checker.duplicate_rows(table, column, frame_chunks(df, chunk_size))])
+
+    person_reasons = quarantine_reasons(person_df, [
+        ("missing person_id", person_df['person_id'].isna()),
+        ("duplicate person_id", duplicate_rows('person', person_df, 'person_id')),
+        ("year_of_birth in the future", person_df['year_of_birth'] > current_year),
+    ])
+    # Foreign keys resolve against the persons that are actually loaded
+    checker.index_table('loaded_person', 'person_id', frame_chunks(person_df[person_reasons.isna()], chunk_size))
+    observation_reasons = quarantine_reasons(observation_df, [
+        ("missing person_id", observation_df['person_id'].isna()),
+        ("unknown person_id", checker.foreign_key_rows('loaded_person', observation_df['person_id'])),
+        ("duplicate observation_id", duplicate_rows('observation', observation_df, 'observation_id')),
+        ("unmapped observation_concept_id", observation_df['observation_concept_id'].isna()),
+        ("invalid observation_date", invalid_dates),
+    ])
+    # Load data into database, one checkpointed chunk at a time
+    skipped = 0
+    for table, df, reasons in (('person', person_df, person_reasons), ('observation', observation_df, observation_reasons)):
+        done = manifest.completed_chunks(run_id, table)
+        for chunk_index, start in enumerate(range(0, len(df), chunk_size)):
+            chunk = df.iloc[start:start + chunk_size]
+            checksum = chunk_checksum(chunk)
+            if chunk_index in done:
+                if done[chunk_index] != checksum:
+                    raise ValueError(f"{table} chunk {chunk_index} differs from the one loaded by run {run_id}; "
+                                     "the source changed without changing size or mtime")
+                skipped += 1
+                continue
+            chunk_reasons = reasons.iloc[start:start + chunk_size]
+            quarantined = chunk_reasons[chunk_reasons.notna()]
+            rows = chunk[chunk_reasons.isna().to_numpy()]
+            if sharded is not None:
+                # Shards are separate files, so the chunk cannot commit atomically with the manifest;
+                # upserts make re-writing a chunk interrupted between the two harmless
+                sharded.write_frames({table: rows}, chunk_size=chunk_size, upsert=True)
+                with engine.begin() as conn:
+                    manifest.record_chunk(conn, run_id, table, chunk_index, start, chunk, quarantined, checksum)
+            else:
+                with engine.begin() as conn:
+                    rows.to_sql(table, conn, if_exists='append', index=False)
+                    manifest.record_chunk(conn, run_id, table, chunk_index, start, chunk, quarantined, checksum)
+    if sharded is not None:
+        sharded.execute(OBSERVATION_DATE_INDEX)
+    else:
+        with engine.begin() as conn:
+            conn.execute(sqlalchemy.text(OBSERVATION_DATE_INDEX))
+    manifest.finish(run_id)
+    summary = manifest.summary(run_id)
+    quarantined = {table: counts['quarantined'] for table, counts in summary.items() if counts['quarantined']}
+    if quarantined:
+        print("Data Quality Issues Found (rows quarantined in etl_quarantine):")
+        for table, reasons in (('person', person_reasons), ('observation', observation_reasons)):
+            for reason, count in reasons.dropna().str.split('; ').explode().value_counts().items():
+                print(f"- {table}: {count} rows with {reason}")
+    if resumed:
+        print(f"Resumed ETL run {run_id}: {skipped} chunks were already loaded.")
     print("ETL complete: data loaded to OMOP tables.")
+    return {'run_id': run_id, 'resumed': resumed, 'skipped_chunks': skipped,
+            'loaded': {table: counts['loaded'] for table, counts in summary.items()}, 'quarantined': quarantined}
 
 
 # Script usage: python etl_load.py
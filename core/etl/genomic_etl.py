@@ -0,0 +1,265 @@
+"""
+Genomic ETL: COSMIC / cBioPortal mutations (+ OncoKB annotations) → OMOP
+measurement and specimen, following the OMOP Genomic conventions.
+All transforms are vectorized over chunks and loaded through bulk_insert_frame.
+"""
+
+import os
+import pandas as pd
+import sqlalchemy
+from utils.db_utils import get_db_engine, bulk_insert_frame
+from utils.config_utils import load_config
+
+__all__ = ["run_genomic_etl", "VocabularyCache", "mutations_to_omop"]
+
+# OMOP concept ids used for genomic records
+LAB_TYPE_CONCEPT_ID = 32856          # Type Concept: Lab
+SPECIMEN_ID_FIELD_CONCEPT_ID = 1147049  # CDM Field: specimen.specimen_id
+NO_MATCHING_CONCEPT_ID = 0
+
+MEASUREMENT_DDL = """
+CREATE TABLE IF NOT EXISTS measurement (
+    measurement_id BIGINT PRIMARY KEY,
+    person_id BIGINT NOT NULL,
+    measurement_concept_id INTEGER NOT NULL,
+    measurement_date DATE NOT NULL,
+    measurement_type_concept_id INTEGER NOT NULL,
+    value_as_concept_id INTEGER,
+    measurement_source_value VARCHAR(255),
+    value_source_value VARCHAR(255),
+    measurement_event_id BIGINT,
+    meas_event_field_concept_id INTEGER
+)
+"""
+
+SPECIMEN_DDL = """
+CREATE TABLE IF NOT EXISTS specimen (
+    specimen_id BIGINT PRIMARY KEY,
+    person_id BIGINT NOT NULL,
+    specimen_concept_id INTEGER NOT NULL,
+    specimen_type_concept_id INTEGER NOT NULL,
+    specimen_date DATE NOT NULL,
+    specimen_source_id VARCHAR(255),
+    specimen_source_value VARCHAR(255),
+    anatomic_site_source_value VARCHAR(255)
+)
+"""
+
+# Source column → normalized mutation column
+COSMIC_COLUMNS = {
+    'Gene name': 'hugo_symbol',
+    'Accession Number': 'transcript',
+    'Mutation AA': 'alteration',
+    'Mutation CDS': 'hgvs_c',
+    'Mutation Description': 'mutation_type',
+    'Sample name': 'sample_id',
+    'ID_tumour': 'patient_id',
+    'Primary site': 'anatomic_site',
+}
+CBIOPORTAL_COLUMNS = {
+    'gene.hugoGeneSymbol': 'hugo_symbol',
+    'hugoGeneSymbol': 'hugo_symbol',
+    'proteinChange': 'alteration',
+    'mutationType': 'mutation_type',
+    'sampleId': 'sample_id',
+    'patientId': 'patient_id',
+}
+MUTATION_COLUMNS = ['hugo_symbol', 'transcript', 'alteration', 'hgvs_c', 'mutation_type', 'sample_id', 'patient_id', 'anatomic_site']
+
+
+class VocabularyCache:
+    """
+    In-memory source code → standard concept id lookup, loaded once and applied
+    to whole columns with Series.map.
+    """
+
+    def __init__(self, mapping=None):
+        self.mapping = pd.Series(mapping or {}, dtype='Int64')
+
+    @classmethod
+    def from_csv(cls, path):
+        df = pd.read_csv(path, dtype={'source_code': 'string'})
+        return cls(dict(zip(df['source_code'], df['standard_concept_id'])))
+
+    @classmethod
+    def from_concept_table(cls, engine, vocabulary_ids=('OMOP Genomic',)):
+        if not sqlalchemy.inspect(engine).has_table('concept'):
+            return cls()
+        params = {f"v{i}": v for i, v in enumerate(vocabulary_ids)}
+        placeholders = ", ".join(f":{k}" for k in params)
+        df = pd.read_sql(sqlalchemy.text(
+            f"SELECT concept_code, concept_id FROM concept WHERE vocabulary_id IN ({placeholders})"), engine, params=params)
+        return cls(dict(zip(df['concept_code'], df['concept_id'])))
+
+    def merge(self, other):
+        merged = VocabularyCache()
+        merged.mapping = pd.concat([other.mapping, self.mapping])
+        merged.mapping = merged.mapping[~merged.mapping.index.duplicated(keep='last')]
+        return merged
+
+    def lookup(self, codes, *fallbacks):
+        """Map codes to concept ids, trying each fallback code column in turn; unmapped → 0."""
+        result = codes.map(self.mapping).astype('Int64')
+        for fallback in fallbacks:
+            result = result.fillna(fallback.map(self.mapping).astype('Int64'))
+        return result.fillna(NO_MATCHING_CONCEPT_ID).astype('int64')
+
+
+def _stable_id(*columns):
+    """Deterministic positive 63-bit id from one or more string columns."""
+    key = columns[0].astype('string').fillna('')
+    for col in columns[1:]:
+        key = key + '|' + col.astype('string').fillna('')
+    hashed = pd.util.hash_pandas_object(key, index=False).to_numpy()
+    return pd.Series((hashed & 0x7FFF_FFFF_FFFF_FFFF).astype('int64'), index=columns[0].index)
+
+
+def normalize_cosmic(chunk):
+    df = chunk.rename(columns=COSMIC_COLUMNS)
+    if 'sample_id' not in df.columns and 'ID_sample' in chunk.columns:
+        df['sample_id'] = chunk['ID_sample']
+    return _normalized(df, 'cosmic')
+
+
+def normalize_cbioportal(df):
+    df = df.rename(columns={c: n for c, n in CBIOPORTAL_COLUMNS.items() if c in df.columns})
+    df = df.loc[:, ~df.columns.duplicated()]
+    return _normalized(df, 'cbioportal')
+
+
+def _normalized(df, source):
+    out = pd.DataFrame(index=df.index)
+    for col in MUTATION_COLUMNS:
+        out[col] = df[col].astype('string') if col in df.columns else pd.Series(pd.NA, index=df.index, dtype='string')
+    out['alteration'] = out['alteration'].str.replace(r'^p\.', '', regex=True)
+    out['patient_id'] = out['patient_id'].fillna(out['sample_id'])
+    out['source'] = source
+    # Rows without a sample cannot be tied to a person or specimen
+    return out[out['sample_id'].notna() & out['hugo_symbol'].notna()]
+
+
+def mutations_to_omop(mutations, vocab, annotations=None, person_ids=None, measurement_date=None):
+    """
+    Map normalized mutation rows to (measurement, specimen) DataFrames.
+    annotations: OncoKB annotation table (variant_key, oncogenic, ...)
+    person_ids: optional Series mapping source patient id → OMOP person_id;
+        otherwise person_id is a stable hash of the patient id
+    """
+    measurement_date = pd.Timestamp(measurement_date or pd.Timestamp.today()).date()
+    variant_key = mutations['hugo_symbol'] + ':' + mutations['alteration'].fillna('')
+    if person_ids is not None:
+        person_id = mutations['patient_id'].map(person_ids).astype('Int64')
+        person_id = person_id.fillna(_stable_id(mutations['patient_id'])).astype('int64')
+    else:
+        person_id = _stable_id(mutations['patient_id'])
+    specimen_id = _stable_id(mutations['source'], mutations['sample_id'])
+    oncogenic = pd.Series(pd.NA, index=mutations.index, dtype='string')
+    if annotations is not None and not annotations.empty:
+        lookup = annotations.drop_duplicates('variant_key').set_index('variant_key')['oncogenic']
+        oncogenic = variant_key.map(lookup).astype('string')
+    measurement = pd.DataFrame({
+        'measurement_id': _stable_id(mutations['source'], mutations['sample_id'], variant_key,
+                                    mutations['transcript'], mutations['hgvs_c']),
+        'person_id': person_id,
+        'measurement_concept_id': vocab.lookup(variant_key, mutations['hugo_symbol']),
+        'measurement_date': measurement_date,
+        'measurement_type_concept_id': LAB_TYPE_CONCEPT_ID,
+        'value_as_concept_id': vocab.lookup(oncogenic),
+        'measurement_source_value': variant_key,
+        'value_source_value': oncogenic.fillna(mutations['hgvs_c']).fillna(mutations['mutation_type']),
+        'measurement_event_id': specimen_id,
+        'meas_event_field_concept_id': SPECIMEN_ID_FIELD_CONCEPT_ID,
+    }).drop_duplicates('measurement_id')
+    specimen = pd.DataFrame({
+        'specimen_id': specimen_id,
+        'person_id': person_id,
+        'specimen_concept_id': NO_MATCHING_CONCEPT_ID,
+        'specimen_type_concept_id': LAB_TYPE_CONCEPT_ID,
+        'specimen_date': measurement_date,
+        'specimen_source_id': mutations['sample_id'],
+        'specimen_source_value': mutations['sample_id'],
+        'anatomic_site_source_value': mutations['anatomic_site'],
+    }).drop_duplicates('specimen_id')
+    return measurement, specimen
+
+
+def _iter_mutation_chunks(cosmic_path, cbioportal_study, chunk_size, cache_dir, workers=4):
+    if cosmic_path:
+        from integration.oncology.cosmic_loader import iter_cosmic_mutations
+        for chunk in iter_cosmic_mutations(cosmic_path, chunk_size=chunk_size):
+            yield normalize_cosmic(chunk)
+    if cbioportal_study:
+        from integration.oncology.cbioportal_loader import CBioPortalClient
+        client = CBioPortalClient(cache_dir=os.path.join(cache_dir, 'cbioportal') if cache_dir else None,
+                                  max_workers=workers)
+        for df in client.fetch_profiles_data(cbioportal_study, alteration_types=['MUTATION_EXTENDED']).values():
+            for start in range(0, len(df), chunk_size):
+                yield normalize_cbioportal(df.iloc[start:start + chunk_size])
+
+
+def run_genomic_etl(db_type=None, db_path=None, pg_settings=None, config_path="config.yaml",
+                    cosmic_path=None, cbioportal_study=None, oncokb_token=None, person_ids=None,
+                    chunk_size=500000, replace=True, cache_dir=None, workers=4, batch_size=100, shards=None):
+    """
+    Load genomic variants into OMOP measurement/specimen.
+    cosmic_path: COSMIC TSV (defaults to config oncology.cosmic_file)
+    cbioportal_study: cBioPortal study id whose mutation profiles are loaded
+    oncokb_token: OncoKB API token; without it cached/offline annotations are used
+    replace: drop and recreate measurement/specimen first (like run_etl)
+    cache_dir: HTTP/annotation cache directory (defaults to config cache.dir)
+    workers, batch_size: concurrent requests and variants per OncoKB request
+    shards: SQLite shard count (defaults to config database.sqlite_shards)
+    Returns row counts per table.
+    """
+    config = load_config(config_path)
+    db_type = db_type or config['database']['backend']
+    if db_type == 'sqlite':
+        db_path = db_path or config['database']['sqlite_path']
+        # Sharded SQLite: person-keyed tables are read through attached views; these outputs land in the main file
+        shards = shards or config['database'].get('sqlite_shards', 1)
+        engine = get_db_engine(db_type=db_type, db_path=db_path, shards=shards)
+    else:
+        pg_settings = pg_settings or config['database']['postgresql']
+        engine = get_db_engine(db_type=db_type, pg_settings=pg_settings)
+    base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    data_dir = os.path.join(base_dir, config['data']['base_dir'])
+    oncology = config.get('oncology', {})
+    cache_dir = os.path.join(base_dir, cache_dir or config.get('cache', {}).get('dir', '.cache'))
+    if cosmic_path is None and oncology.get('cosmic_file'):
+        cosmic_path = os.path.join(base_dir, oncology['cosmic_file'])
+    cbioportal_study = cbioportal_study or oncology.get('cbioportal_study')
+
+    vocab = VocabularyCache()
+    mapping_path = os.path.join(data_dir, config['data']['code_mapping_sample'])
+    if os.path.exists(mapping_path):
+        vocab = VocabularyCache.from_csv(mapping_path)
+    vocab = vocab.merge(VocabularyCache.from_concept_table(engine))
+
+    with engine.begin() as conn:
+        if replace:
+            conn.execute(sqlalchemy.text("DROP TABLE IF EXISTS measurement"))
+            conn.execute(sqlalchemy.text("DROP TABLE IF EXISTS specimen"))
+        conn.execute(sqlalchemy.text(MEASUREMENT_DDL))
+        conn.execute(sqlalchemy.text(SPECIMEN_DDL))
+
+    from integration.oncology.oncokb_loader import annotate_variants
+    counts = {'measurement': 0, 'specimen': 0}
+    for mutations in _iter_mutation_chunks(cosmic_path, cbioportal_study, chunk_size, cache_dir, workers):
+        if mutations.empty:
+            continue
+        variants = mutations[['hugo_symbol', 'alteration']].dropna().drop_duplicates()
+        annotations = annotate_variants(variants, api_token=oncokb_token,
+                                        cache_path=os.path.join(cache_dir, 'oncokb.sqlite'),
+                                        offline_dir=os.path.join(data_dir, 'external'),
+                                        batch_size=batch_size, max_workers=workers)
+        measurement, specimen = mutations_to_omop(mutations, vocab, annotations, person_ids)
+        # The same sample/variant can recur in later chunks: rows whose id is already loaded are skipped
+        counts['measurement'] += bulk_insert_frame(measurement, 'measurement', engine, chunk_size, ignore_conflicts=True)
+        counts['specimen'] += bulk_insert_frame(specimen, 'specimen', engine, chunk_size, ignore_conflicts=True)
+    print(f"Genomic ETL complete: {counts['measurement']} measurement and {counts['specimen']} specimen rows loaded.")
+    return counts
+
+
+# Script usage: python genomic_etl.py
+if __name__ == "__main__":
+    run_genomic_etl()
@@ -0,0 +1,221 @@
+"""
+Referential-integrity checks for OMOP tables, chunk by chunk.
+Parent keys are held in a compact NumPy index (IdIndex): a bitmap for dense
+integer ids, otherwise a sorted array searched with binary search. Child
+tables are streamed in chunks and their foreign keys looked up in the index,
+so memory is bounded by the key index rather than by full frames.
+"""
+
+import numpy as np
+import pandas as pd
+
+__all__ = ["IdIndex", "IntegrityChecker", "frame_chunks"]
+
+
+def _key_array(values):
+    """
+    Non-null key values as an int64 array when every value is integral (1 and 1.0
+    alike), as float64 for other numbers (1.5 must not truncate to 1), else as strings.
+    """
+    series = pd.Series(values).dropna()
+    try:
+        keys = series.to_numpy(dtype=np.int64)
+    except (TypeError, ValueError, OverflowError):
+        return series.astype(str).to_numpy(dtype=str)
+    if series.dtype.kind not in 'iu':
+        floats = pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64)
+        if np.isnan(floats).any():
+            return series.astype(str).to_numpy(dtype=str)
+        if not (keys == floats).all():
+            return floats
+    return keys
+
+
+def _dedupe_sorted(keys):
+    """Split a sorted array into (unique values, values that occur more than once)."""
+    same = keys[1:] == keys[:-1]
+    return keys[np.concatenate(([True], ~same))], keys[1:][same]
+
+
+# Use a bitmap when the id range is at most this many times the number of ids
+# (one byte per slot, so it never takes more memory than the int64 array)
+BITMAP_DENSITY = 8
+
+
+class IdIndex:
+    """
+    Unique ids with fast membership: a bitmap over [min, max] for dense integer
+    ids (O(1) lookups), otherwise a sorted array with searchsorted (O(log n)).
+    """
+
+    def __init__(self, ids):
+        self._set_ids(np.unique(_key_array(ids)))
+
+    def _set_ids(self, ids):
+        self.ids = ids
+        self.bitmap = None
+        if ids.dtype.kind == 'i' and len(ids) and int(ids[-1]) - int(ids[0]) < BITMAP_DENSITY * len(ids):
+            self.bitmap = np.zeros(int(ids[-1]) - int(ids[0]) + 1, dtype=bool)
+            self.bitmap[ids - ids[0]] = True
+
+    @classmethod
+    def from_chunks(cls, chunks, column):
+        """Build from chunks of a table; returns (index, sorted array of duplicated ids)."""
+        parts, duplicates = [], []
+        for chunk in chunks:
+            keys, repeated = _dedupe_sorted(np.sort(_key_array(chunk[column])))
+            parts.append(keys)
+            duplicates.append(repeated)
+        index = cls([])
+        if parts:
+            # Ids unique inside each chunk but repeated across chunks
+            ids, repeated = _dedupe_sorted(np.sort(np.concatenate(parts)))
+            duplicates.append(repeated)
+            index._set_ids(ids)
+        duplicates = np.unique(np.concatenate(duplicates)) if duplicates else np.array([], dtype=np.int64)
+        return index, duplicates
+
+    def __len__(self):
+        return len(self.ids)
+
+    def contains(self, values):
+        """Boolean mask: which values are in the index (nulls are False)."""
+        values = pd.Series(values)
+        mask = np.zeros(len(values), dtype=bool)
+        present = values.notna().to_numpy()
+        keys = _key_array(values)
+        if len(keys) and len(self.ids):
+            mask[present] = self._lookup(keys)
+        return mask
+
+    def _lookup(self, keys):
+        if keys.dtype.kind != self.ids.dtype.kind and {keys.dtype.kind, self.ids.dtype.kind} == {'i', 'f'}:
+            keys, ids = keys.astype(np.float64), self.ids.astype(np.float64)
+        elif keys.dtype.kind != self.ids.dtype.kind:
+            keys, ids = keys.astype(str), self.ids.astype(str)
+        elif self.bitmap is not None:
+            offsets = keys - self.ids[0]
+            in_range = (offsets >= 0) & (offsets < len(self.bitmap))
+            found = np.zeros(len(keys), dtype=bool)
+            found[in_range] = self.bitmap[offsets[in_range]]
+            return found
+        else:
+            ids = self.ids
+        # Searching with sorted keys walks the index in order (far fewer cache misses)
+        order = np.argsort(keys, kind='stable')
+        pos = np.searchsorted(ids, keys[order])
+        pos[pos == len(ids)] = 0
+        found = np.empty(len(keys), dtype=bool)
+        found[order] = ids[pos] == keys[order]
+        return found
+
+
+def frame_chunks(df, chunk_size):
+    """Split an in-memory frame into chunks (for sources that are not already chunked)."""
+    chunk_size = chunk_size or len(df) or 1
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size]
+
+
+class IntegrityChecker:
+    """
+    Collect integrity issues for several tables. Index parent tables first with
+    index_table, then check child tables against them with check_table.
+    Each issue: {'table', 'column', 'check', 'count', 'sample'} where sample is a
+    list of up to sample_size offending rows (or duplicated ids).
+    duplicate_rows / foreign_key_rows give the same checks as per-row masks,
+    for callers that quarantine rows instead of reporting them.
+    """
+
+    def __init__(self, sample_size=5):
+        self.sample_size = sample_size
+        self.indexes = {}
+        self.duplicates = {}
+        self.issues = []
+
+    def _issue(self, table, column, check, count, sample):
+        self.issues.append({'table': table, 'column': column, 'check': check, 'count': int(count), 'sample': sample})
+
+    def index_table(self, table, column, chunks):
+        """Index a table's primary key, recording null and duplicate keys. Returns the IdIndex."""
+        nulls = {'count': 0, 'sample': []}
+
+        def counted(chunks):
+            for chunk in chunks:
+                missing = chunk[chunk[column].isna()]
+                nulls['count'] += len(missing)
+                nulls['sample'].extend(missing.head(self.sample_size - len(nulls['sample'])).to_dict('records'))
+                yield chunk
+
+        index, duplicates = IdIndex.from_chunks(counted(chunks), column)
+        if nulls['count']:
+            self._issue(table, column, 'not_null', nulls['count'], nulls['sample'])
+        if len(duplicates):
+            self._issue(table, column, 'unique', len(duplicates), duplicates[:self.sample_size].tolist())
+        self.indexes[table] = index
+        self.duplicates[table] = duplicates
+        return index
+
+    def duplicate_rows(self, table, column, chunks):
+        """
+        Stream an indexed table again, yielding per chunk a boolean mask of the rows
+        that repeat an earlier row's key (the first occurrence is not marked).
+        Only the duplicated ids found by index_table are tracked across chunks.
+        """
+        repeated = IdIndex(self.duplicates[table])
+        seen = set()
+        for chunk in chunks:
+            mask = np.zeros(len(chunk), dtype=bool)
+            candidates = repeated.contains(chunk[column])
+            if candidates.any():
+                keys = chunk[column][candidates]
+                mask[candidates] = (keys.duplicated() | keys.isin(seen)).to_numpy()
+                seen.update(keys.tolist())
+            yield mask
+
+    def foreign_key_rows(self, parent, values):
+        """Boolean mask of the non-null values that are not keys of the indexed parent table."""
+        return pd.Series(values).notna().to_numpy() & ~self.indexes[parent].contains(values)
+
+    def check_table(self, table, chunks, foreign_keys, not_null=()):
+        """
+        Stream a child table once, checking foreign_keys ({column: parent_table})
+        against indexed parents and that not_null columns have values.
+        """
+        counts = {}
+        samples = {}
+        for chunk in chunks:
+            checks = [(col, 'not_null', chunk[col].isna().to_numpy()) for col in not_null]
+            for col, parent in foreign_keys.items():
+                # Null foreign keys are the not_null check's business
+                checks.append((col, 'foreign_key', self.foreign_key_rows(parent, chunk[col])))
+            for col, check, bad in checks:
+                if bad.any():
+                    key = (col, check)
+                    counts[key] = counts.get(key, 0) + int(bad.sum())
+                    sample = samples.setdefault(key, [])
+                    sample.extend(chunk[bad].head(self.sample_size - len(sample)).to_dict('records'))
+        for (col, check), count in counts.items():
+            self._issue(table, col, check, count, samples[(col, check)])
+        return [i for i in self.issues if i['table'] == table]
+
+    def ok(self):
+        return not self.issues
+
+    def messages(self):
+        """Human-readable one-line summaries of the issues found."""
+        lines = []
+        for issue in self.issues:
+            if issue['check'] == 'unique':
+                lines.append(f"{issue['table']}: {issue['count']} duplicated {issue['column']} values, e.g. {issue['sample']}")
+            else:
+                what = 'missing' if issue['check'] == 'not_null' else 'unknown'
+                lines.append(f"{issue['table']}: {issue['count']} rows with {what} {issue['column']}, e.g. {issue['sample']}")
+        return lines
+
+
+# Script usage:
+#   checker = IntegrityChecker()
+#   checker.index_table('person', 'person_id', pd.read_csv('person.csv', chunksize=500000))
+#   checker.check_table('observation', pd.read_csv('observation.csv', chunksize=500000), {'person_id': 'person'})
+#   print("\n".join(checker.messages()))
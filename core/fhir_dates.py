@@ -0,0 +1,125 @@
+"""
+FHIR date/dateTime parsing for the FHIR → OMOP path.
+Handles the FHIR partial forms (YYYY, YYYY-MM, YYYY-MM-DD) and full
+timestamps with a timezone (YYYY-MM-DDThh:mm:ss[.sss](Z|+hh:mm)).
+parse_fhir_dates converts a whole batch at once with vectorized NumPy
+arithmetic on the fixed-position date part; parse_fhir_date handles a single value.
+"""
+
+import datetime
+import re
+from functools import lru_cache
+
+__all__ = ["FHIR_DATE_PATTERN", "parse_fhir_date", "parse_fhir_dates", "parse_fhir_datetimes"]
+
+# Time and timezone that may follow a full date
+_TIME_SUFFIX = r'(?:[T ](?P<time>\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)(?P<tz>Z|[+-]\d{2}:?\d{2})?)?'
+FHIR_DATE_PATTERN = r'^\s*(?P<year>\d{4})(?:-(?P<month>\d{2})(?:-(?P<day>\d{2})' + _TIME_SUFFIX + r')?)?\s*$'
+_DATE_RE = re.compile(FHIR_DATE_PATTERN)
+_SUFFIX_RE = re.compile(_TIME_SUFFIX + r'$')
+
+
+@lru_cache(maxsize=65536)
+def parse_fhir_date(value):
+    """
+    Split one FHIR date/dateTime into (year, month, day); missing parts of a
+    partial date are None. Returns (None, None, None) if the value is not a FHIR date.
+    """
+    match = _DATE_RE.match(value) if isinstance(value, str) else None
+    if match is None:
+        return None, None, None
+    year, month, day = (int(part) if part else None for part in match.group('year', 'month', 'day'))
+    try:
+        datetime.date(year, month or 1, day or 1)
+    except ValueError:
+        return None, None, None
+    return year, month, day
+
+
+@lru_cache(maxsize=65536)
+def _valid_suffix(suffix):
+    # Batches repeat a handful of times/timezones, so each distinct suffix is matched once
+    return _SUFFIX_RE.match(suffix) is not None
+
+
+def _extract(values):
+    import pandas as pd
+    series = values if isinstance(values, pd.Series) else pd.Series(list(values), dtype='object')
+    return series.astype('string').str.extract(FHIR_DATE_PATTERN)
+
+
+def _date_parts(values):
+    """
+    (year, month, day, valid) arrays from the fixed-position date part of each value
+    (YYYY, YYYY-MM or YYYY-MM-DD; a full date may be followed by a FHIR time and
+    timezone). Surrounding whitespace is ignored, as in parse_fhir_date. Month/day
+    default to 1 for partial dates. The date part is parsed on the characters as
+    a numpy code-point matrix; only the suffix of dateTime values is matched per value.
+    """
+    import numpy as np
+    # date/datetime objects (e.g. DATE columns read from PostgreSQL) go through their ISO form
+    texts = [v.strip() if isinstance(v, str) else v.isoformat() if isinstance(v, datetime.date) else ''
+             for v in values]
+    chars = np.array(texts, dtype='U10')
+    codes = chars.view(np.uint32).reshape(len(chars), 10).astype(np.int64)
+    digits = codes - ord('0')
+    is_digit = (digits >= 0) & (digits <= 9)
+    length = (codes != 0).sum(axis=1)
+
+    def number(start, stop):
+        value = np.zeros(len(codes), dtype=np.int64)
+        for i in range(start, stop):
+            value = value * 10 + digits[:, i]
+        return value
+
+    has_year = is_digit[:, 0:4].all(axis=1)
+    has_month = (length >= 7) & (codes[:, 4] == ord('-')) & is_digit[:, 5:7].all(axis=1)
+    has_day = (length >= 10) & has_month & (codes[:, 7] == ord('-')) & is_digit[:, 8:10].all(axis=1)
+    # Anything after the date part must be a time/timezone ('2020-01-01garbage' is rejected)
+    suffix_ok = np.fromiter((len(t) <= 10 or _valid_suffix(t[10:]) for t in texts), dtype=bool, count=len(texts))
+    valid = has_year & ((length == 4) | ((length == 7) & has_month) | (has_day & suffix_ok))
+    month = np.where(has_month, number(5, 7), 1)
+    day = np.where(has_day, number(8, 10), 1)
+    return number(0, 4), month, day, valid
+
+
+def parse_fhir_dates(values):
+    """
+    Vectorized FHIR date/dateTime → datetime64 dates (the calendar date as
+    written, time and timezone dropped). Partial dates fall on the first day of
+    the year/month; unparsable values become NaT. Returns a pandas Series.
+    """
+    import numpy as np
+    import pandas as pd
+    index = values.index if isinstance(values, pd.Series) else None
+    year, month, day, valid = _date_parts(values)
+    valid &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+    months = np.where(valid, (year - 1970) * 12 + month - 1, 0).astype('datetime64[M]')
+    dates = months.astype('datetime64[D]') + np.where(valid, day - 1, 0)
+    # Reject days past the end of the month (e.g. 2021-02-30) instead of rolling over
+    valid &= dates.astype('datetime64[M]') == months
+    dates = dates.astype('datetime64[s]')
+    dates[~valid] = np.datetime64('NaT')
+    return pd.Series(dates, index=index)
+
+
+def parse_fhir_datetimes(values):
+    """
+    Vectorized FHIR dateTime → UTC timestamps (datetime64). Values without a
+    timezone are taken as UTC; partial dates fall on midnight of their first day.
+    """
+    import pandas as pd
+    parts = _extract(values)
+    dates = parse_fhir_dates(values)
+    time = pd.to_timedelta(parts['time'].fillna('00:00').where(parts['time'].str.count(':') != 1,
+                                                               parts['time'] + ':00'), errors='coerce')
+    tz = parts['tz'].fillna('Z').str.replace(':', '', regex=False)
+    sign = tz.str[0].map({'+': 1, '-': -1}).fillna(0)
+    offset = pd.to_timedelta(sign * (pd.to_numeric(tz.str[1:3], errors='coerce').fillna(0) * 60
+                                     + pd.to_numeric(tz.str[3:5], errors='coerce').fillna(0)), unit='min')
+    return (dates + time.fillna(pd.Timedelta(0)) - offset).astype('datetime64[s]')
+
+
+# Script usage:
+#   parse_fhir_dates(["2020", "2020-05", "2020-05-01T10:00:00+02:00", "bad"])
+#   -> 2020-01-01, 2020-05-01, 2020-05-01, NaT
@@ -0,0 +1,210 @@
+"""
+De-duplication of FHIR resources before OMOP mapping.
+A persistent SQLite index records every resource already mapped into an OMOP
+table, keyed by a fingerprint (resourceType, id and versionId, or a content
+hash when the server gives no version). An in-memory Bloom filter in front of
+the index answers most "not seen yet" checks without touching the database,
+so re-fetched or re-uploaded overlapping exports skip mapping and LLM calls.
+"""
+
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+__all__ = ["resource_fingerprint", "database_identity", "index_path", "forget_mapped", "BloomFilter", "ResourceIndex"]
+
+INDEX_DDL = """
+CREATE TABLE IF NOT EXISTS fhir_resource_index (
+    fingerprint TEXT NOT NULL,
+    target_table TEXT NOT NULL,
+    resource_type TEXT,
+    resource_id TEXT,
+    version TEXT,
+    content_hash TEXT NOT NULL,
+    mapped_at REAL NOT NULL,
+    PRIMARY KEY (fingerprint, target_table)
+)
+"""
+
+
+def content_hash(resource):
+    """SHA-256 of the canonical JSON of a resource, ignoring meta (lastUpdated etc. change on re-export)."""
+    body = {k: v for k, v in resource.items() if k != 'meta'}
+    canonical = json.dumps(body, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def resource_fingerprint(resource):
+    """
+    Identity of one version of a resource: 'Type/id/_history/versionId' when the
+    server supplies a versionId, otherwise 'Type/id#content-hash'.
+    Returns (fingerprint, resource_type, resource_id, version, content_hash).
+    """
+    resource_type = resource.get('resourceType')
+    resource_id = resource.get('id')
+    version = (resource.get('meta') or {}).get('versionId')
+    digest = content_hash(resource)
+    if resource_id and version:
+        fingerprint = f"{resource_type}/{resource_id}/_history/{version}"
+    else:
+        fingerprint = f"{resource_type}/{resource_id or ''}#{digest}"
+    return fingerprint, resource_type, resource_id, version, digest
+
+
+def database_identity(db_type, db_path=None, pg_settings=None):
+    """Target of index_path: the absolute SQLite path, or the PostgreSQL URL without password."""
+    if db_type == 'sqlite':
+        return os.path.abspath(db_path)
+    return f"postgresql://{pg_settings['user']}@{pg_settings['host']}:{pg_settings['port']}/{pg_settings['db']}"
+
+
+def index_path(base_path, target):
+    """
+    Index file for one OMOP database: target identifies the database (e.g. the
+    SQLite path or a PostgreSQL URL without password), so resources mapped into
+    one database are not skipped when loading another.
+    .cache/fhir_resource_index.sqlite -> .cache/fhir_resource_index.<hash>.sqlite
+    """
+    stem, ext = os.path.splitext(base_path)
+    return f"{stem}.{hashlib.sha256(str(target).encode('utf-8')).hexdigest()[:12]}{ext}"
+
+
+def forget_mapped(base_path, target, tables):
+    """
+    Drop the index entries of `tables` in one database, for steps that drop and
+    recreate those tables (otherwise re-mapped resources would be skipped as
+    already mapped). Works without a ResourceIndex instance, e.g. in a job
+    worker: an open index only keeps stale Bloom bits, which filter_new
+    confirms against the table and discards.
+    """
+    path = index_path(base_path, target)
+    if not os.path.exists(path):
+        return 0
+    with sqlite3.connect(path, timeout=30) as conn:
+        before = conn.total_changes
+        conn.executemany("DELETE FROM fhir_resource_index WHERE target_table = ?", [(t,) for t in tables])
+        return conn.total_changes - before
+
+
+class BloomFilter:
+    """Pure-Python Bloom filter (no false negatives; about error_rate false positives at capacity)."""
+
+    def __init__(self, capacity=100000, error_rate=0.001):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.num_bits = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.num_hashes = max(int(round(self.num_bits / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: h1 + i*h2 from one 128-bit digest
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class ResourceIndex:
+    """
+    Persistent index of FHIR resources already mapped to OMOP tables.
+    The Bloom filter is loaded from the table on start and rebuilt larger when
+    it fills up.
+    """
+
+    def __init__(self, db_path, capacity=100000, error_rate=0.001):
+        self.db_path = db_path
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(INDEX_DDL)
+        self._rebuild(capacity)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _rebuild(self, capacity):
+        """Reload the Bloom filter from the index, sized for at least twice the current rows."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM fhir_resource_index").fetchone()[0]
+            bloom = BloomFilter(max(capacity, rows * 2), self.error_rate)
+            for fingerprint, target_table in conn.execute("SELECT fingerprint, target_table FROM fhir_resource_index"):
+                bloom.add(f"{target_table}|{fingerprint}")
+        bloom.count = rows
+        self.bloom = bloom
+
+    def filter_new(self, resources, target_table):
+        """
+        Drop resources already mapped to target_table (and duplicates within the batch).
+        Returns (new_resources, skipped_count).
+        """
+        fingerprints = [resource_fingerprint(r)[0] for r in resources]
+        with self._lock:
+            maybe_seen = {fp for fp in fingerprints if f"{target_table}|{fp}" in self.bloom}
+        seen = set()
+        if maybe_seen:
+            # Confirm Bloom positives against the index (rules out false positives)
+            candidates = sorted(maybe_seen)
+            with self._connect() as conn:
+                for start in range(0, len(candidates), 500):
+                    chunk = candidates[start:start + 500]
+                    seen.update(row[0] for row in conn.execute(
+                        f"SELECT fingerprint FROM fhir_resource_index WHERE target_table = ? "
+                        f"AND fingerprint IN ({', '.join('?' * len(chunk))})", (target_table, *chunk)))
+        new_resources, batch = [], set()
+        for resource, fp in zip(resources, fingerprints):
+            if fp in seen or fp in batch:
+                continue
+            batch.add(fp)
+            new_resources.append(resource)
+        return new_resources, len(resources) - len(new_resources)
+
+    def mark_mapped(self, resources, target_table):
+        """Record resources as mapped into target_table. Returns the number of index rows added."""
+        now = time.time()
+        rows = [(fp, target_table, rtype, rid, version, digest, now)
+                for fp, rtype, rid, version, digest in map(resource_fingerprint, resources)]
+        with self._connect() as conn:
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO fhir_resource_index VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            added = conn.total_changes - before
+        with self._lock:
+            for row in rows:
+                self.bloom.add(f"{target_table}|{row[0]}")
+            if self.bloom.count > self.bloom.capacity:
+                self._rebuild(self.bloom.capacity * 2)
+        return added
+
+    def clear(self, target_table=None):
+        """Forget mapped resources (all, or one table's), e.g. after the OMOP tables were rebuilt."""
+        with self._connect() as conn:
+            if target_table:
+                conn.execute("DELETE FROM fhir_resource_index WHERE target_table = ?", (target_table,))
+            else:
+                conn.execute("DELETE FROM fhir_resource_index")
+        with self._lock:
+            self._rebuild(self.bloom.capacity)
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM fhir_resource_index").fetchone()[0]
+
+
+# Script usage:
+#   index = ResourceIndex(index_path(".cache/fhir_resource_index.sqlite", os.path.abspath("omop_demo.db")))
+#   new, skipped = index.filter_new(resources, "person")
+#   ... map and load `new` ...
+#   index.mark_mapped(new, "person")
@@ -0,0 +1,232 @@
+"""
+OMOP → FHIR bulk export as NDJSON ($export style).
+Each resource type (Patient from person, Observation from observation,
+Condition from condition_occurrence) is exported by its own worker process:
+rows are streamed from the table with a server-side cursor, turned into FHIR
+resources, serialized with orjson when it is installed (json otherwise) and
+appended to <Type>.ndjson (optionally gzipped) one batch at a time, so
+memory use does not grow with the table size.
+"""
+
+import datetime
+import decimal
+import gzip
+import json
+import os
+import time
+from functools import lru_cache
+from utils.parallel import process_pool
+
+__all__ = ["EXPORT_TYPES", "row_to_resource", "export_resource_type", "export_fhir_ndjson"]
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+OMOP_CONCEPT_SYSTEM = "https://fhir-terminology.ohdsi.org"
+GENDER_CONCEPTS = {8507: 'male', 8532: 'female', 8551: 'unknown', 8521: 'other'}
+
+# FHIR resource type → OMOP source table
+EXPORT_TYPES = {
+    'Patient': 'person',
+    'Observation': 'observation',
+    'Condition': 'condition_occurrence',
+}
+
+
+def _date(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value[:10]
+    return value.isoformat()[:10]
+
+
+@lru_cache(maxsize=100000)
+def _concept(concept_id):
+    # Shared (never mutated) CodeableConcept per concept id
+    return {'coding': [{'system': OMOP_CONCEPT_SYSTEM, 'code': str(concept_id)}]}
+
+
+def _id(row, columns, number):
+    # First id column present with a value; the row's position otherwise
+    for column in columns:
+        value = row.get(column)
+        if value is not None:
+            return str(value)
+    return str(number)
+
+
+def _set(resource, key, value):
+    if value is not None:
+        resource[key] = value
+
+
+def _patient(row, _):
+    resource = {'resourceType': 'Patient', 'id': str(row['person_id'])}
+    gender = row.get('gender_concept_id')
+    if gender is not None:
+        resource['gender'] = GENDER_CONCEPTS.get(gender, 'unknown')
+    year, month, day = row.get('year_of_birth'), row.get('month_of_birth'), row.get('day_of_birth')
+    if year:
+        # Partial birth dates stay partial (YYYY or YYYY-MM), as FHIR allows
+        birth_date = f"{int(year):04d}"
+        if month:
+            birth_date += f"-{int(month):02d}" + (f"-{int(day):02d}" if day else "")
+        resource['birthDate'] = birth_date
+    return resource
+
+
+def _observation(row, number):
+    resource = {'resourceType': 'Observation', 'id': _id(row, ('observation_id',), number), 'status': 'final'}
+    concept = row.get('observation_concept_id')
+    if concept is not None:
+        resource['code'] = _concept(concept)
+    if row.get('person_id') is not None:
+        resource['subject'] = {'reference': f"Patient/{row['person_id']}"}
+    _set(resource, 'effectiveDateTime', _date(row.get('observation_date')))
+    if row.get('value_as_number') is not None:
+        resource['valueQuantity'] = {'value': row['value_as_number']}
+    elif row.get('value_as_string') is not None:
+        resource['valueString'] = row['value_as_string']
+    return resource
+
+
+def _condition(row, number):
+    # Both the OMOP CDM layout and the app's FHIR-mapped layout (condition_id, person_ref, code, ...) are supported
+    resource = {'resourceType': 'Condition', 'id': _id(row, ('condition_occurrence_id', 'condition_id'), number)}
+    if row.get('condition_concept_id') is not None:
+        resource['code'] = _concept(row['condition_concept_id'])
+    elif row.get('code') is not None:
+        coding = {'code': str(row['code'])}
+        _set(coding, 'system', row.get('code_system'))
+        resource['code'] = {'coding': [coding]}
+    subject = row.get('person_ref') or (f"Patient/{row['person_id']}" if row.get('person_id') is not None else None)
+    if subject:
+        resource['subject'] = {'reference': subject}
+    _set(resource, 'onsetDateTime', _date(row.get('condition_start_date') or row.get('onset_date')))
+    _set(resource, 'abatementDateTime', _date(row.get('condition_end_date')))
+    _set(resource, 'recordedDate', _date(row.get('recorded_date')))
+    return resource
+
+
+_BUILDERS = {'Patient': _patient, 'Observation': _observation, 'Condition': _condition}
+
+
+def row_to_resource(resource_type, row, number=0):
+    """FHIR resource (dict) for one OMOP row (a column → value mapping); number is the row's position, used when the table has no id column."""
+    return _BUILDERS[resource_type](row, number)
+
+
+def _default(value):
+    # NUMERIC columns come back as Decimal on PostgreSQL
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _dumps(resource):
+    if orjson is not None:
+        return orjson.dumps(resource, default=_default)
+    return json.dumps(resource, separators=(',', ':'), ensure_ascii=False, default=_default).encode('utf-8')
+
+
+def export_resource_type(resource_type, db_settings, output_dir, compress=False, batch_size=5000):
+    """
+    Stream one OMOP table to <output_dir>/<resource_type>.ndjson[.gz].
+    Runs in a worker process, so it opens its own engine from db_settings
+    ({'db_type', 'db_path', 'pg_settings', 'shards'}). Returns {'type', 'url', 'count'},
+    or None when the table is missing or empty (no file is written, as in $export).
+    """
+    import sqlalchemy
+    from utils.db_utils import get_db_engine
+    engine = get_db_engine(**db_settings)
+    table = EXPORT_TYPES[resource_type]
+    path = os.path.join(output_dir, f"{resource_type}.ndjson" + (".gz" if compress else ""))
+    partial = path + ".part"
+    count = 0
+    builder = _BUILDERS[resource_type]
+    opener = (lambda p: gzip.open(p, 'wb', compresslevel=5)) if compress else (lambda p: open(p, 'wb'))
+    try:
+        with opener(partial) as out, engine.connect() as conn:
+            if sqlalchemy.inspect(conn).has_table(table):
+                # stream_results: a server-side cursor on PostgreSQL, so rows are fetched batch by batch
+                result = conn.execution_options(stream_results=True).execute(sqlalchemy.text(f"SELECT * FROM {table}"))
+                columns = list(result.keys())
+                while True:
+                    # Plain DBAPI tuples: SQLAlchemy Row objects would cost more than building the resources
+                    rows = result.cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    lines = [_dumps(builder(dict(zip(columns, row)), count + i)) for i, row in enumerate(rows, 1)]
+                    count += len(rows)
+                    out.write(b"\n".join(lines) + b"\n")
+        if count:
+            # Readers never see a half-written file
+            os.replace(partial, path)
+        elif os.path.exists(path):
+            # A file left by an earlier export would no longer match the manifest
+            os.remove(path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+        engine.dispose()
+    return {'type': resource_type, 'url': os.path.abspath(path), 'count': count} if count else None
+
+
+def export_fhir_ndjson(db_type=None, db_path=None, pg_settings=None, config_path="config.yaml",
+                       output_dir=None, types=None, workers=None, compress=None, batch_size=5000, shards=None):
+    """
+    Export OMOP tables as FHIR NDJSON, one file per resource type, written in parallel.
+    types: resource types to export (default: all of EXPORT_TYPES)
+    output_dir, compress, workers: default to config export.output_dir, export.gzip and performance.workers
+    shards: SQLite shard count (defaults to config database.sqlite_shards)
+    Returns a $export-style manifest, also saved as <output_dir>/manifest.json.
+    """
+    from utils.config_utils import load_config
+    config = load_config(config_path)
+    export_config = config.get('export', {})
+    db_type = db_type or config['database']['backend']
+    if db_type == 'sqlite':
+        db_settings = {'db_type': db_type, 'db_path': db_path or config['database']['sqlite_path'],
+                       'shards': shards or config['database'].get('sqlite_shards', 1)}
+    else:
+        db_settings = {'db_type': db_type, 'pg_settings': pg_settings or config['database']['postgresql']}
+    output_dir = output_dir or export_config.get('output_dir', 'exports')
+    compress = export_config.get('gzip', False) if compress is None else compress
+    types = list(types or EXPORT_TYPES)
+    unknown = [t for t in types if t not in EXPORT_TYPES]
+    if unknown:
+        raise ValueError(f"Unsupported resource types: {', '.join(unknown)}")
+    workers = max(1, min(workers or config.get('performance', {}).get('workers', 4), len(types)))
+    os.makedirs(output_dir, exist_ok=True)
+
+    started = time.time()
+    manifest = {
+        'transactionTime': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'requiresAccessToken': False,
+        'output': [],
+        'error': [],
+    }
+    with process_pool(workers) as pool:
+        futures = [pool.submit(export_resource_type, t, db_settings, output_dir, compress, batch_size) for t in types]
+        for resource_type, future in zip(types, futures):
+            try:
+                item = future.result()
+            except Exception as e:
+                manifest['error'].append({'type': resource_type, 'message': str(e)})
+                continue
+            if item is not None:
+                manifest['output'].append(item)
+    manifest['seconds'] = round(time.time() - started, 3)
+    with open(os.path.join(output_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    total = sum(item['count'] for item in manifest['output'])
+    print(f"FHIR export complete: {total} resources in {len(manifest['output'])} files under {output_dir}/.")
+    return manifest
+
+
+# Script usage: python -m core.fhir_export
+if __name__ == "__main__":
+    export_fhir_ndjson()
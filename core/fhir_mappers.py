@@ -0,0 +1,254 @@
+"""
+FHIR resource → OMOP row mappers used by the app's "Map to OMOP" flow.
+Each resource type has a fast, pure-Python mapper; resources it cannot map
+fall back to the LLM. map_resources runs the fast mappers in a process pool,
+appending rows to compact typed RecordBatches, streams them to batched
+upserts through the configured engine, and runs the (rare) LLM fallbacks
+concurrently in a thread pool so a slow LLM call never holds up the load.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from core.fhir_dates import parse_fhir_date
+from core.omop_records import OMOP_TABLES, RecordBatch
+from utils.parallel import process_pool
+
+__all__ = [
+    "OMOP_TABLES", "RESOURCE_MAPPERS", "map_patient_to_person", "map_condition_to_condition_occurrence",
+    "map_encounter_to_visit_occurrence", "map_resources",
+]
+
+# Below this many resources the pool start-up costs more than it saves
+MIN_PARALLEL_RESOURCES = 2000
+
+
+def _to_int(val):
+    try:
+        return int(val)
+    except (TypeError, ValueError):
+        return None
+
+
+# Fast-path mappers: raise on resources they cannot handle
+
+def patient_to_person(resource):
+    # Map FHIR Patient resource to OMOP person table (7 columns); birthDate may be partial (YYYY, YYYY-MM)
+    year, month, day = parse_fhir_date(resource.get('birthDate'))
+    # OMOP expects integer person_id; concept ids could be mapped from gender/race extensions
+    return (_to_int(resource.get('id')), None, year, month, day, None, None)
+
+
+def condition_to_condition_occurrence(resource):
+    subject = resource.get('subject', {})
+    coding = resource.get('code', {}).get('coding', [{}])[0]
+    return (
+        resource.get('id'),
+        subject.get('reference'),
+        coding.get('code'),
+        coding.get('system'),
+        resource.get('onsetDateTime'),
+        resource.get('recordedDate'),
+    )
+
+
+def encounter_to_visit_occurrence(resource):
+    subject = resource.get('subject', {})
+    period = resource.get('period', {})
+    coding = resource.get('type', [{}])[0].get('coding', [{}])[0]
+    return (
+        resource.get('id'),
+        subject.get('reference'),
+        period.get('start'),
+        period.get('end'),
+        coding.get('code'),
+    )
+
+
+RESOURCE_MAPPERS = {
+    'Patient': ('person', patient_to_person),
+    'Condition': ('condition_occurrence', condition_to_condition_occurrence),
+    'Encounter': ('visit_occurrence', encounter_to_visit_occurrence),
+}
+
+
+def llm_map(resource, table):
+    """Map one resource with the LLM; returns a row tuple for `table`, or None if no usable INSERT came back."""
+    from core.fhir_to_omop import fhir_to_omop_sql
+    from utils.sql_inserts import parse_inserts, SQLInsertError
+
+    columns = [name for name, _ in OMOP_TABLES[table]]
+    try:
+        statements = parse_inserts(fhir_to_omop_sql(resource, table))
+    except SQLInsertError:
+        return None
+    if not statements or not statements[0].rows:
+        return None
+    statement = statements[0]
+    values = statement.rows[0]
+    if statement.columns and set(c.lower() for c in statement.columns) & set(columns):
+        by_name = dict(zip((c.lower() for c in statement.columns), values))
+        return tuple(by_name.get(c) for c in columns)
+    return tuple((list(values) + [None] * len(columns))[:len(columns)])
+
+
+def _hybrid(resource_type):
+    table, fast = RESOURCE_MAPPERS[resource_type]
+
+    def mapper(resource):
+        try:
+            return fast(resource)
+        except Exception:
+            return llm_map(resource, table)
+    mapper.__name__ = f"map_{resource_type.lower()}"
+    return mapper
+
+
+# Hybrid mappers: fast path, LLM fallback (one resource at a time)
+map_patient_to_person = _hybrid('Patient')
+map_condition_to_condition_occurrence = _hybrid('Condition')
+map_encounter_to_visit_occurrence = _hybrid('Encounter')
+
+
+def _map_chunk(resource_type, resources):
+    """Process-pool task: fast-map a chunk; returns (RecordBatch, resources that need the LLM)."""
+    table, fast = RESOURCE_MAPPERS[resource_type]
+    rows, fallbacks = [], []
+    for resource in resources:
+        try:
+            rows.append(fast(resource))
+        except Exception:
+            fallbacks.append(resource)
+    batch = RecordBatch(table)
+    batch.extend_rows(rows)
+    return batch, fallbacks
+
+
+def _omop_table(table):
+    import sqlalchemy
+    types = {
+        # BIGINT keys stay INTEGER PRIMARY KEY (the rowid alias) on SQLite
+        'BIGINT': sqlalchemy.BigInteger().with_variant(sqlalchemy.Integer(), 'sqlite'),
+        'INTEGER': sqlalchemy.Integer, 'TEXT': sqlalchemy.Text, 'DATE': sqlalchemy.Date,
+    }
+    (key, key_type), *rest = OMOP_TABLES[table]
+    return sqlalchemy.Table(table, sqlalchemy.MetaData(),
+                            sqlalchemy.Column(key, types[key_type], primary_key=True),
+                            *(sqlalchemy.Column(name, types[sql_type]) for name, sql_type in rest))
+
+
+class _UpsertWriter:
+    """
+    Buffer RecordBatch rows and write them as INSERT ... ON CONFLICT upserts in batches.
+    On sharded SQLite, tables stored in the shards (read through views) are
+    upserted into the shards by person_id instead.
+    """
+
+    def __init__(self, engine, table, batch_size):
+        from utils.sharded_sqlite import sharded_of
+        self.engine = engine
+        self.table = _omop_table(table)
+        self.sharded = sharded_of(engine)
+        if self.sharded is not None and table not in self.sharded.tables():
+            self.sharded = None
+        if self.sharded is None:
+            self.table.metadata.create_all(engine)
+        self.columns = [c.name for c in self.table.columns]
+        self.batch_size = batch_size
+        self.buffer = []
+        self.written = 0
+
+    def add(self, batch):
+        # Python values are materialized one write batch at a time
+        for start in range(0, len(batch), self.batch_size):
+            self.buffer.extend(batch.rows(start, start + self.batch_size))
+            while len(self.buffer) >= self.batch_size:
+                self._write(self.buffer[:self.batch_size])
+                self.buffer = self.buffer[self.batch_size:]
+
+    def flush(self):
+        if self.buffer:
+            self._write(self.buffer)
+            self.buffer = []
+        return self.written
+
+    def _write(self, rows):
+        if self.sharded is not None:
+            import pandas as pd
+            frame = pd.DataFrame(rows, columns=self.columns)
+            self.sharded.write_frames({self.table.name: frame}, chunk_size=self.batch_size, upsert=True)
+            self.written += len(rows)
+            return
+        dialect = self.engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            raise ValueError(f"Unsupported backend for upserts: {dialect}")
+        stmt = insert(self.table)
+        key = self.columns[0]
+        stmt = stmt.on_conflict_do_update(index_elements=[key],
+                                          set_={c: stmt.excluded[c] for c in self.columns[1:]})
+        # One row per key: PostgreSQL rejects a multi-row upsert that touches a key twice
+        latest = {}
+        for i, row in enumerate(rows):
+            latest[row[0] if row[0] is not None else ('row', i)] = row
+        params = [dict(zip(self.columns, row)) for row in latest.values()]
+        with self.engine.begin() as conn:
+            conn.execute(stmt, params)
+        self.written += len(rows)
+
+
+def map_resources(resource_type, resources, engine, workers=4, batch_size=1000, llm_workers=2):
+    """
+    Map FHIR resources of one type into their OMOP table through `engine`.
+    workers: processes for the fast mappers (threads when called from a multi-threaded
+    process such as the app); llm_workers: concurrent LLM fallbacks.
+    Rows are upserted on the table's primary key in batches of batch_size.
+    Returns {'table', 'rows', 'fast', 'llm', 'failed'} counts, plus 'unmapped': the
+    resources neither path could map.
+    """
+    table, _ = RESOURCE_MAPPERS[resource_type]
+    writer = _UpsertWriter(engine, table, batch_size)
+    stats = {'table': table, 'rows': 0, 'fast': 0, 'llm': 0, 'failed': 0, 'unmapped': []}
+    try:
+        with ThreadPoolExecutor(max(llm_workers, 1)) as llm_pool:
+            llm_futures = {}
+
+            def consume(batch, fallbacks):
+                stats['fast'] += len(batch)
+                writer.add(batch)
+                llm_futures.update((llm_pool.submit(llm_map, r, table), r) for r in fallbacks)
+
+            if workers > 1 and len(resources) >= MIN_PARALLEL_RESOURCES:
+                chunk = max(100, -(-len(resources) // (workers * 4)))
+                with process_pool(workers) as pool:
+                    futures = [pool.submit(_map_chunk, resource_type, resources[i:i + chunk])
+                               for i in range(0, len(resources), chunk)]
+                    for future in as_completed(futures):
+                        consume(*future.result())
+            else:
+                consume(*_map_chunk(resource_type, resources))
+            for future in as_completed(llm_futures):
+                # An LLM error (Ollama down, prompt build, bad values) fails only that resource
+                try:
+                    row = future.result()
+                    if row is not None:
+                        llm_batch = RecordBatch(table)
+                        llm_batch.append(row)
+                except Exception:
+                    row = None
+                if row is None:
+                    stats['failed'] += 1
+                    stats['unmapped'].append(llm_futures[future])
+                else:
+                    stats['llm'] += 1
+                    writer.add(llm_batch)
+    finally:
+        # Rows mapped before an error are still written
+        stats['rows'] = writer.flush()
+    return stats
+
+
+# Script usage:
+#   from utils.db_utils import get_db_engine
+#   stats = map_resources("Patient", patients, get_db_engine("sqlite", db_path="omop_demo.db"), workers=8)
@@ -1,20 +1,29 @@
-import json
-from ollama import Client
+_client = None
 
-client = Client()
+def get_client():
+    """Return the shared Ollama client, creating it on first use."""
+    global _client
+    if _client is None:
+        from ollama import Client
+        _client = Client()
+    return _client
 
-def fhir_to_omop_sql(fhir_json: dict, table: str):
+def __getattr__(name):
+    # Backwards compatibility for `from core.fhir_to_omop import client`
+    if name == 'client':
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def fhir_to_omop_sql(fhir_json: dict, table: str, model: str = 'llama2'):
     """
     Maps FHIR JSON resource to OMOP SQL INSERT statement using Llama 2 via Ollama.
+    The prompt is pruned to fit the model's token budget and generation stops
+    once a complete INSERT has been produced.
     """
-    prompt = f"""
-    You are a biomedical data engineer.
-    Map the following FHIR resource to an OMOP {table} INSERT statement.
-    Use OMOP CDM v5.3 fields. If a field is missing, insert NULL.
-
-    FHIR resource:
-    {json.dumps(fhir_json, indent=2)}
-    """
-    response = client.generate(model='llama2', prompt=prompt)
-    return response['response']
+    from core.llm_prompts import build_mapping_prompt, generate_text
+    return generate_text(model, build_mapping_prompt(fhir_json, table, model), stop_at_insert=True, client=get_client())
 
+def fhir_to_omop_sql_stream(fhir_json: dict, table: str, model: str = 'llama2'):
+    """Like fhir_to_omop_sql, but yields the SQL text as it is generated."""
+    from core.llm_prompts import build_mapping_prompt, stream_generate
+    return stream_generate(model, build_mapping_prompt(fhir_json, table, model), stop_at_insert=True, client=get_client())
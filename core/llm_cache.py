@@ -0,0 +1,214 @@
+"""
+Local cache of LLM responses for the chat and mapping playground.
+Entries are keyed by model and prompt (whitespace collapsed) in a SQLite
+table. A MinHash signature of each normalized prompt is indexed in memory
+with LSH banding, so a near-identical question (different casing,
+punctuation or a word changed) is answered from the cache too, provided it
+has the same numbers, negations and logical/comparison words. The table is
+bounded by max_entries with least-recently-used eviction; hit/miss counters
+are kept per process.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+__all__ = ["CacheHit", "prompt_key", "normalize_prompt", "minhash_signature", "LLMResponseCache"]
+
+CACHE_DDL = """
+CREATE TABLE IF NOT EXISTS llm_response_cache (
+    id INTEGER PRIMARY KEY,
+    model TEXT NOT NULL,
+    prompt_key TEXT NOT NULL,
+    response TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (model, prompt_key)
+)
+"""
+
+# MinHash: NUM_PERM hash functions split into BANDS bands; prompts sharing any band are candidates
+NUM_PERM = 64
+BANDS = 16
+SHINGLE = 4
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(42)
+_PERM_A = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.int64)
+_PERM_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.int64)
+
+CacheHit = namedtuple('CacheHit', ['response', 'kind', 'similarity'])
+
+
+# Terms that change a question's meaning however similar the rest is:
+# numbers, negations, logical operators and comparisons
+_GUARD_TERM = re.compile(r"-?\d+(?:\.\d+)?|[<>]=?|!=|=|[a-z]+n't|[a-z]+", re.IGNORECASE)
+GUARD_WORDS = {
+    'not', 'no', 'never', 'none', 'nor', 'neither', 'without', 'except', 'excluding', 'exclude', 'non',
+    'and', 'or', 'all', 'any', 'only', 'both', 'either',
+    'more', 'less', 'fewer', 'greater', 'most', 'least', 'over', 'under', 'above', 'below',
+    'before', 'after', 'between', 'min', 'max', 'minimum', 'maximum',
+}
+
+
+def prompt_key(prompt):
+    """Exact-match key of a prompt: whitespace runs collapsed, case and punctuation kept."""
+    return re.sub(r'\s+', ' ', prompt).strip()
+
+
+def normalize_prompt(prompt):
+    """Lower-case, punctuation-insensitive, whitespace-collapsed form of a prompt (MinHash shingles only)."""
+    return re.sub(r'\s+', ' ', re.sub(r'[^\w\s]', ' ', prompt.lower())).strip()
+
+
+def _guard_terms(prompt):
+    # Near matches must agree on these, in order: {"value": -5} is not {"value": 5},
+    # "do not have diabetes and hypertension" is not "have diabetes or hypertension"
+    terms = []
+    for term in _GUARD_TERM.findall(prompt.lower()):
+        if term.endswith("n't"):
+            terms.append('not')
+        elif not term.isalpha() or term in GUARD_WORDS:
+            terms.append(term)
+    return tuple(terms)
+
+
+def minhash_signature(text):
+    """MinHash signature (NUM_PERM int64 values) of the character SHINGLE-grams of a normalized prompt."""
+    text = text if len(text) >= SHINGLE else text.ljust(SHINGLE)
+    shingles = {text[i:i + SHINGLE] for i in range(len(text) - SHINGLE + 1)}
+    hashes = np.array([int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'little')
+                       for s in shingles], dtype=np.int64) % _PRIME
+    return ((np.outer(hashes, _PERM_A) + _PERM_B) % _PRIME).min(axis=0)
+
+
+def _bands(model, signature):
+    rows = NUM_PERM // BANDS
+    return [(model, band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(BANDS)]
+
+
+class LLMResponseCache:
+    """
+    Persistent LLM response cache. get() returns a CacheHit for an exact
+    match (prompt_key) or, with near=True, the most similar cached prompt with the
+    same numbers, negations and operator words (GUARD_WORDS) whose estimated
+    Jaccard similarity is at least `similarity`; put() stores a response.
+    """
+
+    def __init__(self, db_path, max_entries=1000, similarity=0.85):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.metrics = {'exact_hits': 0, 'near_hits': 0, 'misses': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(CACHE_DDL)
+        self._load()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _load(self):
+        """Rebuild the in-memory LSH index from the stored signatures."""
+        self.buckets = {}
+        self.signatures = {}
+        with self._connect() as conn:
+            for entry_id, model, key, blob in conn.execute("SELECT id, model, prompt_key, signature FROM llm_response_cache"):
+                self._index(entry_id, model, np.frombuffer(blob, dtype=np.int64), _guard_terms(key))
+
+    def _index(self, entry_id, model, signature, terms):
+        self.signatures[entry_id] = (model, signature, terms)
+        for key in _bands(model, signature):
+            self.buckets.setdefault(key, set()).add(entry_id)
+
+    def _unindex(self, entry_id):
+        model, signature, _ = self.signatures.pop(entry_id, (None, None, None))
+        if signature is not None:
+            for key in _bands(model, signature):
+                self.buckets.get(key, set()).discard(entry_id)
+
+    def _nearest(self, model, signature, terms):
+        candidates = set()
+        for key in _bands(model, signature):
+            candidates |= self.buckets.get(key, set())
+        best, best_score = None, 0.0
+        for entry_id in candidates:
+            _, candidate, candidate_terms = self.signatures[entry_id]
+            if candidate_terms != terms:
+                continue
+            score = float((candidate == signature).mean())
+            if score > best_score:
+                best, best_score = entry_id, score
+        return best, best_score
+
+    def get(self, model, prompt, near=True):
+        """CacheHit(response, 'exact' | 'near', similarity) or None (counted as a miss)."""
+        key = prompt_key(prompt)
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT id, response FROM llm_response_cache WHERE model = ? AND prompt_key = ?",
+                               (model, key)).fetchone()
+            hit = CacheHit(row[1], 'exact', 1.0) if row else None
+            if row is None and near:
+                entry_id, score = self._nearest(model, minhash_signature(normalize_prompt(prompt)), _guard_terms(key))
+                if entry_id is not None and score >= self.similarity:
+                    row = conn.execute("SELECT id, response FROM llm_response_cache WHERE id = ?", (entry_id,)).fetchone()
+                    hit = CacheHit(row[1], 'near', score) if row else None
+            if hit is None:
+                self.metrics['misses'] += 1
+                return None
+            self.metrics[f'{hit.kind}_hits'] += 1
+            conn.execute("UPDATE llm_response_cache SET last_used = ?, hits = hits + 1 WHERE id = ?", (time.time(), row[0]))
+        return hit
+
+    def put(self, model, prompt, response):
+        """Store a response (replacing any entry for the same prompt_key) and evict past max_entries."""
+        key = prompt_key(prompt)
+        signature = minhash_signature(normalize_prompt(prompt))
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            old = conn.execute("SELECT id FROM llm_response_cache WHERE model = ? AND prompt_key = ?", (model, key)).fetchone()
+            if old:
+                self._unindex(old[0])
+                conn.execute("DELETE FROM llm_response_cache WHERE id = ?", old)
+            entry_id = conn.execute(
+                "INSERT INTO llm_response_cache (model, prompt_key, response, signature, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (model, key, response, signature.tobytes(), now, now)).lastrowid
+            self._index(entry_id, model, signature, _guard_terms(key))
+            excess = conn.execute("SELECT COUNT(*) FROM llm_response_cache").fetchone()[0] - self.max_entries
+            if excess > 0:
+                stale = [r[0] for r in conn.execute(
+                    "SELECT id FROM llm_response_cache ORDER BY last_used LIMIT ?", (excess,))]
+                conn.executemany("DELETE FROM llm_response_cache WHERE id = ?", [(i,) for i in stale])
+                for stale_id in stale:
+                    self._unindex(stale_id)
+                self.metrics['evictions'] += len(stale)
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM llm_response_cache")
+            self.buckets, self.signatures = {}, {}
+
+    def stats(self):
+        """Counters since start plus current size and hit rate."""
+        lookups = self.metrics['exact_hits'] + self.metrics['near_hits'] + self.metrics['misses']
+        hits = lookups - self.metrics['misses']
+        return dict(self.metrics, entries=len(self), hit_rate=hits / lookups if lookups else 0.0)
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM llm_response_cache").fetchone()[0]
+
+
+# Script usage:
+#   cache = LLMResponseCache(".cache/llm_responses.sqlite")
+#   hit = cache.get("mistral", question)
+#   answer = hit.response if hit else client.generate(model="mistral", prompt=question)['response']
+#   if not hit: cache.put("mistral", question, answer)
@@ -0,0 +1,128 @@
+"""
+Prompt building and streaming generation for the Ollama-hosted LLMs.
+FHIR resources are pruned of elements that never map to OMOP (narrative,
+meta, extensions), serialized as compact JSON and shrunk until the prompt
+fits the model's token budget. Generation is streamed so callers (and the
+Streamlit UI) see tokens as they arrive, and mapping requests stop as soon
+as a complete INSERT statement has been produced.
+"""
+
+import json
+import math
+
+__all__ = [
+    "MODEL_CONTEXT", "estimate_tokens", "prune_resource", "compact_json", "build_mapping_prompt",
+    "stream_generate", "generate_text",
+]
+
+# Context window (tokens) requested from Ollama per model; prompts must leave room for MAX_OUTPUT_TOKENS
+MODEL_CONTEXT = {'llama2': 4096, 'mistral': 4096, 'tinyllama': 2048}
+DEFAULT_CONTEXT = 2048
+MAX_OUTPUT_TOKENS = 512
+
+# Elements with no OMOP counterpart: narrative/metadata, plus extensions (too verbose to be worth the tokens)
+PRUNED_ELEMENTS = {'meta', 'extension', 'modifierExtension', 'implicitRules', 'language'}
+
+# (max list items, max string length) tried in turn until the resource fits the budget
+_SHRINK_STEPS = [(None, None), (10, 200), (3, 80), (1, 40)]
+
+
+def estimate_tokens(text):
+    """Rough token count (about 3 characters per token for JSON/SQL with Llama-style tokenizers)."""
+    return math.ceil(len(text) / 3)
+
+
+def prune_resource(value, max_items=None, max_chars=None):
+    """
+    Copy of a FHIR resource without narrative (text.div), meta, extensions and
+    primitive-extension (_field) elements; empty containers are dropped.
+    max_items/max_chars optionally truncate lists and long strings.
+    """
+    if isinstance(value, dict):
+        pruned = {}
+        for key, item in value.items():
+            # A dict-valued 'text' is the Narrative; CodeableConcept.text is a plain string and is kept
+            if key in PRUNED_ELEMENTS or key.startswith('_') or (key == 'text' and isinstance(item, dict)):
+                continue
+            item = prune_resource(item, max_items, max_chars)
+            if item not in (None, '', [], {}):
+                pruned[key] = item
+        return pruned
+    if isinstance(value, list):
+        items = value[:max_items] if max_items else value
+        return [p for p in (prune_resource(i, max_items, max_chars) for i in items) if p not in (None, '', [], {})]
+    if isinstance(value, str) and max_chars and len(value) > max_chars:
+        return value[:max_chars]
+    return value
+
+
+def compact_json(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+def _mapping_template(resource_type, table):
+    from core.omop_records import OMOP_TABLES
+    columns = [name for name, _ in OMOP_TABLES.get(table, [])]
+    target = f"INSERT INTO {table} ({', '.join(columns)}) VALUES (...);" if columns else f"INSERT INTO {table} (...) VALUES (...);"
+    return (
+        f"You are a biomedical data engineer. Map this FHIR {resource_type or ''} resource to one OMOP CDM v5.3 "
+        f"{table} row. Reply with exactly one SQL statement of the form {target} "
+        "Use NULL for missing fields. No explanation.\n"
+        "FHIR: {resource}"
+    )
+
+
+def build_mapping_prompt(fhir_json, table, model='llama2'):
+    """
+    FHIR → OMOP INSERT prompt that fits the model's budget
+    (MODEL_CONTEXT minus MAX_OUTPUT_TOKENS). Raises ValueError if even the
+    most aggressively shrunk resource does not fit.
+    """
+    if not isinstance(fhir_json, dict):
+        fhir_json = {'data': fhir_json}
+    template = _mapping_template(fhir_json.get('resourceType'), table)
+    budget = MODEL_CONTEXT.get(model, DEFAULT_CONTEXT) - MAX_OUTPUT_TOKENS
+    for max_items, max_chars in _SHRINK_STEPS:
+        prompt = template.format(resource=compact_json(prune_resource(fhir_json, max_items, max_chars)))
+        if estimate_tokens(prompt) <= budget:
+            return prompt
+    raise ValueError(f"FHIR resource too large for {model}: about {estimate_tokens(prompt)} tokens, budget {budget}")
+
+
+def stream_generate(model, prompt, stop_at_insert=False, client=None, max_tokens=MAX_OUTPUT_TOKENS):
+    """
+    Yield the response text of an Ollama generation chunk by chunk.
+    With stop_at_insert the stream is closed (ending generation on the server)
+    as soon as the text holds a complete INSERT statement.
+    """
+    from utils.sql_inserts import insert_complete
+    if client is None:
+        from core.fhir_to_omop import get_client
+        client = get_client()
+    options = {'num_ctx': MODEL_CONTEXT.get(model, DEFAULT_CONTEXT), 'num_predict': max_tokens}
+    stream = client.generate(model=model, prompt=prompt, stream=True, options=options)
+    text = ''
+    try:
+        for chunk in stream:
+            piece = chunk['response']
+            if piece:
+                text += piece
+                yield piece
+            # Only re-check when a statement terminator arrives
+            if stop_at_insert and ';' in piece and insert_complete(text):
+                break
+    finally:
+        close = getattr(stream, 'close', None)
+        if close:
+            close()
+
+
+def generate_text(model, prompt, stop_at_insert=False, client=None, max_tokens=MAX_OUTPUT_TOKENS):
+    """Whole response of a (streamed) generation as one string."""
+    return ''.join(stream_generate(model, prompt, stop_at_insert, client, max_tokens))
+
+
+# Script usage:
+#   prompt = build_mapping_prompt(patient_json, "person", model="llama2")
+#   for piece in stream_generate("llama2", prompt, stop_at_insert=True):
+#       print(piece, end="", flush=True)
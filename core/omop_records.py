@@ -0,0 +1,238 @@
+"""
+Memory-compact record batches for the OMOP tables written by the mapping flow.
+Columns are typed builders over the `array` module: int64/int32 values with a
+null mask, dates as int32 day numbers and dictionary-encoded strings, so a
+mapped row costs a few bytes per column instead of a tuple of boxed objects.
+Batches pickle cheaply between processes and convert to pandas or DB rows
+without going through object-dtype columns.
+"""
+
+import datetime
+from array import array
+
+__all__ = ["OMOP_TABLES", "RecordBatch", "IntColumn", "DateColumn", "StringColumn", "day_number", "from_day_number"]
+
+# OMOP tables written by the mapping flow: (column, type) pairs, first column is the primary key.
+# BIGINT/INTEGER are int64/int32, DATE is a calendar date, TEXT is a dictionary-encoded string.
+OMOP_TABLES = {
+    'person': [
+        ('person_id', 'BIGINT'), ('gender_concept_id', 'INTEGER'), ('year_of_birth', 'INTEGER'),
+        ('month_of_birth', 'INTEGER'), ('day_of_birth', 'INTEGER'), ('race_concept_id', 'INTEGER'),
+        ('ethnicity_concept_id', 'INTEGER'),
+    ],
+    'condition_occurrence': [
+        ('condition_id', 'TEXT'), ('person_ref', 'TEXT'), ('code', 'TEXT'), ('code_system', 'TEXT'),
+        ('onset_date', 'DATE'), ('recorded_date', 'DATE'),
+    ],
+    'visit_occurrence': [
+        ('visit_id', 'TEXT'), ('person_ref', 'TEXT'), ('start_date', 'DATE'), ('end_date', 'DATE'),
+        ('type_code', 'TEXT'),
+    ],
+}
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+def day_number(value):
+    """Days since 1970-01-01 for a date/datetime or FHIR date string (YYYY, YYYY-MM, YYYY-MM-DD...); None if unparsable."""
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    if isinstance(value, datetime.date):
+        return value.toordinal() - EPOCH_ORDINAL
+    text = str(value)
+    try:
+        # Partial dates fall on the first day of the year/month
+        year = int(text[:4])
+        month = int(text[5:7]) if len(text) >= 7 else 1
+        day = int(text[8:10]) if len(text) >= 10 else 1
+        return datetime.date(year, month, day).toordinal() - EPOCH_ORDINAL
+    except ValueError:
+        return None
+
+
+def from_day_number(days):
+    return datetime.date.fromordinal(EPOCH_ORDINAL + days)
+
+
+class IntColumn:
+    """Fixed-width integer column ('q' = int64, 'i' = int32) with a null mask; out-of-range values become null."""
+
+    def __init__(self, typecode='q'):
+        self.values = array(typecode)
+        self.nulls = bytearray()
+        self.max_value = (1 << (self.values.itemsize * 8 - 1)) - 1
+
+    def __len__(self):
+        return len(self.values)
+
+    def _convert(self, value):
+        try:
+            value = int(value)
+        except (TypeError, ValueError, OverflowError):
+            return None
+        # array.append would raise on these after earlier columns of the row were appended
+        return value if -self.max_value - 1 <= value <= self.max_value else None
+
+    def append(self, value):
+        value = self._convert(value)
+        if value is None:
+            self.values.append(0)
+            self.nulls.append(1)
+        else:
+            self.values.append(value)
+            self.nulls.append(0)
+
+    def extend(self, other):
+        self.values.extend(other.values)
+        self.nulls.extend(other.nulls)
+
+    def extend_values(self, values):
+        for value in values:
+            self.append(value)
+
+    def nbytes(self):
+        return len(self.values) * self.values.itemsize + len(self.nulls)
+
+    def to_pylist(self, start=0, stop=None):
+        values, nulls = self.values[start:stop], self.nulls[start:stop]
+        return [None if null else v for v, null in zip(values, nulls)]
+
+    def to_pandas(self):
+        import numpy as np
+        import pandas as pd
+        values = np.frombuffer(self.values, dtype=np.int64 if self.values.typecode == 'q' else np.int32)
+        return pd.arrays.IntegerArray(values.copy(), np.frombuffer(self.nulls, dtype=bool).copy())
+
+
+class DateColumn(IntColumn):
+    """Dates stored as int32 days since 1970-01-01."""
+
+    def __init__(self):
+        super().__init__('i')
+
+    def _convert(self, value):
+        return day_number(value)
+
+    def extend_values(self, values):
+        """Parse a whole column of FHIR date strings at once (see core.fhir_dates)."""
+        import numpy as np
+        from core.fhir_dates import parse_fhir_dates
+        dates = parse_fhir_dates(values).to_numpy().astype('datetime64[D]')
+        nulls = np.isnat(dates)
+        self.values.frombytes(np.where(nulls, 0, dates.astype(np.int64)).astype(np.int32).tobytes())
+        self.nulls.extend(nulls.astype(np.uint8).tobytes())
+
+    def to_pylist(self, start=0, stop=None):
+        return [None if days is None else from_day_number(days) for days in super().to_pylist(start, stop)]
+
+    def to_pandas(self):
+        import numpy as np
+        import pandas as pd
+        days = np.frombuffer(self.values, dtype=np.int32).astype('datetime64[D]').astype('datetime64[s]')
+        days[np.frombuffer(self.nulls, dtype=bool)] = np.datetime64('NaT')
+        return pd.array(days)
+
+
+class StringColumn:
+    """Dictionary-encoded strings: int32 codes into a list of distinct values (-1 = null)."""
+
+    def __init__(self):
+        self.codes = array('i')
+        self.categories = []
+        self._lookup = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getstate__(self):
+        # The lookup dict is rebuilt on unpickling, so batches cross process boundaries at half the size
+        return self.codes, self.categories
+
+    def __setstate__(self, state):
+        self.codes, self.categories = state
+        self._lookup = {value: code for code, value in enumerate(self.categories)}
+
+    def _code(self, value):
+        code = self._lookup.get(value)
+        if code is None:
+            code = self._lookup[value] = len(self.categories)
+            self.categories.append(value)
+        return code
+
+    def append(self, value):
+        self.codes.append(-1 if value is None else self._code(str(value)))
+
+    def extend_values(self, values):
+        code = self._code
+        self.codes.extend(-1 if value is None else code(str(value)) for value in values)
+
+    def extend(self, other):
+        remap = [self._code(value) for value in other.categories]
+        self.codes.extend(-1 if code < 0 else remap[code] for code in other.codes)
+
+    def nbytes(self):
+        return len(self.codes) * self.codes.itemsize + sum(len(c) for c in self.categories)
+
+    def to_pylist(self, start=0, stop=None):
+        categories = self.categories
+        return [None if code < 0 else categories[code] for code in self.codes[start:stop]]
+
+    def to_pandas(self):
+        import numpy as np
+        import pandas as pd
+        return pd.Categorical.from_codes(np.frombuffer(self.codes, dtype=np.int32), categories=self.categories)
+
+
+_COLUMN_BUILDERS = {
+    'BIGINT': lambda: IntColumn('q'),
+    'INTEGER': lambda: IntColumn('i'),
+    'DATE': DateColumn,
+    'TEXT': StringColumn,
+}
+
+
+class RecordBatch:
+    """Typed, columnar rows for one OMOP table (see OMOP_TABLES)."""
+
+    def __init__(self, table):
+        self.table = table
+        self.names = [name for name, _ in OMOP_TABLES[table]]
+        self.columns = [_COLUMN_BUILDERS[kind]() for _, kind in OMOP_TABLES[table]]
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def append(self, row):
+        """Append one row (a tuple in column order); values are coerced, unparsable ones become null."""
+        for column, value in zip(self.columns, row):
+            column.append(value)
+
+    def extend_rows(self, rows):
+        """Append many row tuples column by column (date columns are parsed in one vectorized pass)."""
+        if rows:
+            for column, values in zip(self.columns, zip(*rows)):
+                column.extend_values(values)
+
+    def extend(self, other):
+        for column, other_column in zip(self.columns, other.columns):
+            column.extend(other_column)
+
+    def nbytes(self):
+        return sum(column.nbytes() for column in self.columns)
+
+    def rows(self, start=0, stop=None):
+        """Rows as tuples of Python values (int, datetime.date, str or None), e.g. for executemany."""
+        return list(zip(*(column.to_pylist(start, stop) for column in self.columns)))
+
+    def to_frame(self):
+        """pandas DataFrame with nullable Int64/Int32, datetime64 and categorical columns."""
+        import pandas as pd
+        return pd.DataFrame({name: column.to_pandas() for name, column in zip(self.names, self.columns)})
+
+
+# Script usage:
+#   batch = RecordBatch('person')
+#   batch.append((1, 8507, 1980, 5, 12, None, None))
+#   print(batch.to_frame().dtypes, batch.nbytes())
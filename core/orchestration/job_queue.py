@@ -0,0 +1,327 @@
+"""
+Local background job queue for orchestrator steps.
+Jobs live in a SQLite table and are executed by a pool of worker processes,
+so long ETL/QA/analytics runs do not block the Streamlit server and survive
+browser disconnects. No external broker is required.
+"""
+
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+import traceback
+
+# Job states
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+
+# Steps that rewrite OMOP tables; only one of these runs at a time
+EXCLUSIVE_STEPS = ('etl', 'genomic_etl', 'derived_tables', 'pipeline')
+
+JOBS_DDL = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    step TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+)
+"""
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job when cancellation was requested."""
+
+
+class JobQueue:
+    """SQLite-backed job table shared by the app and the worker processes."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(JOBS_DDL)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, job_id)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def submit(self, step, **params):
+        """
+        Queue an orchestrator step ('etl', 'analytics', 'qa', 'pipeline', ...). Returns the job id.
+        params go to MCPOrchestrator.orchestrate, except overrides: dotted-path config
+        overrides for the job's orchestrator (e.g. the database selected in the app).
+        """
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO jobs (step, params, status, created_at) VALUES (?, ?, ?, ?)",
+                (step, json.dumps(params), QUEUED, time.time()))
+            return cur.lastrowid
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return _job_dict(row) if row else None
+
+    def list_jobs(self, limit=20):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY job_id DESC LIMIT ?", (limit,)).fetchall()
+        return [_job_dict(r) for r in rows]
+
+    def cancel(self, job_id):
+        """Cancel a queued job immediately; a running job is stopped by its worker (see execute_job)."""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = ?, finished_at = ? WHERE job_id = ? AND status = ?",
+                         (CANCELLED, time.time(), job_id, QUEUED))
+            conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status = ?",
+                         (job_id, RUNNING))
+
+    def claim_next(self, worker):
+        """Atomically move the oldest runnable queued job to running and return it."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            exclusive = ", ".join("?" * len(EXCLUSIVE_STEPS))
+            row = conn.execute(
+                f"SELECT * FROM jobs WHERE status = ? AND (step NOT IN ({exclusive}) OR NOT EXISTS "
+                f"(SELECT 1 FROM jobs WHERE status = ? AND step IN ({exclusive}))) ORDER BY job_id LIMIT 1",
+                (QUEUED, *EXCLUSIVE_STEPS, RUNNING, *EXCLUSIVE_STEPS)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute("UPDATE jobs SET status = ?, worker = ?, started_at = ? WHERE job_id = ?",
+                         (RUNNING, worker, time.time(), row['job_id']))
+            conn.execute("COMMIT")
+            job = _job_dict(row)
+            job['status'], job['worker'] = RUNNING, worker
+            return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def cancel_requested(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row['cancel_requested'])
+
+    def report_progress(self, job_id, progress, message=None):
+        """Record progress (0..1); raises JobCancelled if the job should stop."""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET progress = ?, message = ? WHERE job_id = ?", (progress, message, job_id))
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row and row['cancel_requested']:
+            raise JobCancelled(f"Job {job_id} cancelled")
+
+    def finish(self, job_id, status, result=None, error=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, message = ?, result = ?, error = ?, finished_at = ?, "
+                "progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END WHERE job_id = ?",
+                (status, status.capitalize(), json.dumps(result, default=str) if result is not None else None,
+                 error, time.time(), status, job_id))
+
+    def requeue_orphans(self):
+        """Put running jobs whose worker process on this host has died back in the queue."""
+        host = socket.gethostname()
+        with self._connect() as conn:
+            rows = conn.execute("SELECT job_id, worker FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+            for row in rows:
+                worker_host, _, pid = (row['worker'] or '').rpartition(':')
+                if worker_host == host and pid.isdigit() and not _pid_alive(int(pid)):
+                    conn.execute("UPDATE jobs SET status = ?, worker = NULL, started_at = NULL WHERE job_id = ?",
+                                 (QUEUED, row['job_id']))
+
+
+def _job_dict(row):
+    job = dict(row)
+    job['params'] = json.loads(job['params']) if job['params'] else {}
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _run_steps(queue, job, config_path):
+    """Run a job's steps through the orchestrator; returns (status, result or error)."""
+    from core.orchestration.mcp_orchestrator import MCPOrchestrator
+
+    job_id = job['job_id']
+    params = dict(job['params'])
+    steps = params.pop('steps', None) if job['step'] == 'pipeline' else [job['step']]
+    overrides = params.pop('overrides', None)
+
+    def on_progress(step, index, total):
+        queue.report_progress(job_id, index / total, f"Running {step} ({index + 1}/{total})")
+
+    try:
+        queue.report_progress(job_id, 0.0, "Starting")
+        orchestrator = MCPOrchestrator(config_path=config_path, overrides=overrides)
+        result = orchestrator.orchestrate(steps=steps, progress_callback=on_progress, **params)
+        # A cancel that arrived during the last step still wins
+        return (CANCELLED, None) if queue.cancel_requested(job_id) else (DONE, result)
+    except JobCancelled:
+        return CANCELLED, None
+    except Exception:
+        return FAILED, traceback.format_exc()
+
+
+def _job_process(conn, queue, job, config_path):
+    # Own process group, so cancelling also stops the step's process pools
+    os.setpgrp()
+    status, payload = _run_steps(queue, job, config_path)
+    conn.send((status, json.loads(json.dumps(payload, default=str)) if status == DONE else payload))
+    conn.close()
+
+
+def execute_job(queue, job, config_path="config.yaml", poll_interval=1.0):
+    """
+    Run one claimed job and record its outcome. Where fork is available the
+    job runs in a child process that is killed as soon as cancellation is
+    requested, so single long steps (etl, qa, analytics) can be cancelled
+    mid-run; otherwise the cancel flag is checked between steps and before finishing.
+    """
+    job_id = job['job_id']
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        status, payload = _run_steps(queue, job, config_path)
+    else:
+        context = multiprocessing.get_context('fork')
+        reader, writer = context.Pipe(duplex=False)
+        proc = context.Process(target=_job_process, args=(writer, queue, job, config_path), daemon=False)
+        proc.start()
+        writer.close()
+        while True:
+            if reader.poll(poll_interval):
+                status, payload = reader.recv()
+                break
+            if not proc.is_alive():
+                status, payload = FAILED, f"Job process exited unexpectedly (exit code {proc.exitcode})"
+                break
+            if queue.cancel_requested(job_id):
+                try:
+                    os.killpg(proc.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+                status, payload = CANCELLED, None
+                break
+        proc.join()
+        reader.close()
+    if status == DONE:
+        queue.finish(job_id, DONE, result=payload)
+    elif status == FAILED:
+        queue.finish(job_id, FAILED, error=payload)
+    else:
+        queue.finish(job_id, CANCELLED)
+
+
+def run_worker(db_path, config_path="config.yaml", poll_interval=1.0, max_jobs=None, parent_pid=None):
+    """
+    Worker process loop: claim queued jobs and execute them one at a time.
+    parent_pid: exit once this process is no longer the parent (the launching server died)
+    """
+    queue = JobQueue(db_path)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    done = 0
+    while max_jobs is None or done < max_jobs:
+        if parent_pid and os.getppid() != parent_pid:
+            break
+        job = queue.claim_next(worker)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        execute_job(queue, job, config_path, poll_interval)
+        done += 1
+
+
+class JobWorkerPool:
+    """
+    A fixed number of worker processes polling one job queue.
+    Workers are started as separate `python -m core.orchestration.job_queue --worker`
+    processes rather than multiprocessing children, so they do not re-import
+    the launching script (Streamlit runs app.py as __main__).
+    """
+
+    def __init__(self, db_path, config_path="config.yaml", workers=2, poll_interval=1.0):
+        self.db_path = os.path.abspath(db_path)
+        self.config_path = config_path
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.processes = []
+
+    def start(self):
+        JobQueue(self.db_path).requeue_orphans()
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        cmd = [sys.executable, '-m', 'core.orchestration.job_queue', '--worker',
+               '--db-path', self.db_path, '--config', self.config_path, '--poll-interval', str(self.poll_interval),
+               '--parent-pid', str(os.getpid())]
+        for _ in range(self.workers):
+            self.processes.append(subprocess.Popen(cmd, cwd=root))
+        return self
+
+    def alive(self):
+        return sum(p.poll() is None for p in self.processes)
+
+    def stop(self, timeout=5):
+        for proc in self.processes:
+            proc.terminate()
+        for proc in self.processes:
+            try:
+                proc.wait(timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        self.processes = []
+
+
+# Script usage:
+#   python -m core.orchestration.job_queue --workers 4   (start a worker pool)
+#   python -m core.orchestration.job_queue --worker      (run a single worker)
+if __name__ == '__main__':
+    import argparse
+    from utils.config_utils import load_config
+
+    jobs_config = load_config().get('jobs', {})
+    parser = argparse.ArgumentParser(description="Background job workers for the MCP orchestrator")
+    parser.add_argument('--db-path', default=jobs_config.get('db_path', '.cache/jobs.sqlite'))
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--workers', type=int, default=jobs_config.get('workers', 2))
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--worker', action='store_true', help="run a single worker loop in this process")
+    parser.add_argument('--parent-pid', type=int, help="exit when this process is no longer the worker's parent")
+    args = parser.parse_args()
+    if args.worker:
+        try:
+            run_worker(args.db_path, args.config, args.poll_interval, parent_pid=args.parent_pid)
+        except KeyboardInterrupt:
+            pass
+    else:
+        pool = JobWorkerPool(args.db_path, args.config, workers=args.workers, poll_interval=args.poll_interval).start()
+        print(f"Started {args.workers} job workers. Press Ctrl+C to stop.")
+        try:
+            while pool.alive():
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pool.stop()
@@ -6,44 +6,113 @@ Option 2: In-process, extensible Python orchestrator class.
 
 
 import os
-from core.etl import etl_load
-from core.etl import analytics_visualization
-from core.fhir_to_omop import fhir_to_omop_sql
-from core.qa_copilot import run_quality_checks
 from utils import config_utils
-from utils import db_utils
+
+# Steps understood by MCPOrchestrator.orchestrate, in pipeline order
+PIPELINE_STEPS = ('etl', 'genomic_etl', 'derived_tables', 'llm_mapping', 'qa', 'analytics', 'fhir_export')
+
+# Step implementations (pandas, SQLAlchemy, matplotlib, ydata-profiling, ollama)
+# are imported inside the methods that run them, so constructing the
+# orchestrator or running a single step only pays for what that step uses.
 
 
 class MCPOrchestrator:
-    def __init__(self, config_path='config.yaml'):
-        self.config = config_utils.load_config(config_path)
-        # For DB, use SQLAlchemy engine for compatibility
-        db_type = self.config['database']['backend']
-        if db_type == 'sqlite':
-            db_path = self.config['database']['sqlite_path']
-            self.db_engine = db_utils.get_db_engine(db_type=db_type, db_path=db_path)
-        else:
-            pg_settings = self.config['database']['postgresql']
-            self.db_engine = db_utils.get_db_engine(db_type=db_type, pg_settings=pg_settings)
+    def __init__(self, config_path='config.yaml', overrides=None):
+        """
+        config_path: config.yaml used by every step
+        overrides: dotted-path config overrides, e.g. {'database.backend': 'postgresql'}
+        """
+        self.config_path = config_path
+        self.config = config_utils.apply_overrides(config_utils.load_config(config_path), overrides)
+        self.performance = self.config.get('performance') or {}
+        self._db_engine = None
+
+    @property
+    def db_engine(self):
+        # For DB, use SQLAlchemy engine for compatibility (created on first use)
+        if self._db_engine is None:
+            from utils import db_utils
+            db_type = self.config['database']['backend']
+            if db_type == 'sqlite':
+                db_path = self.config['database']['sqlite_path']
+                shards = self.config['database'].get('sqlite_shards', 1)
+                self._db_engine = db_utils.get_db_engine(db_type=db_type, db_path=db_path, shards=shards)
+            else:
+                pg_settings = self.config['database']['postgresql']
+                self._db_engine = db_utils.get_db_engine(db_type=db_type, pg_settings=pg_settings)
+        return self._db_engine
+
+    def _db_settings(self):
+        """Database arguments for the step functions, taken from the (overridden) config."""
+        db = self.config['database']
+        return {'db_type': db['backend'], 'db_path': db.get('sqlite_path'), 'pg_settings': db.get('postgresql'),
+                'shards': db.get('sqlite_shards', 1)}
 
     def run_etl(self):
-        """Run ETL pipeline: FHIR/Oncology → OMOP."""
-        etl_load.run_etl(config_path="config.yaml")
+        """Run ETL pipeline: FHIR/Oncology → OMOP (resumes an interrupted run; bad rows are quarantined)."""
+        from core.etl import etl_load
+        return etl_load.run_etl(config_path=self.config_path, chunk_size=self.performance.get('chunk_size'),
+                         **self._db_settings())
+
+    def run_genomic_etl(self, cosmic_path=None, cbioportal_study=None):
+        """Run genomic ETL: COSMIC/cBioPortal/OncoKB → OMOP measurement + specimen."""
+        from core.etl import genomic_etl
+        return genomic_etl.run_genomic_etl(config_path=self.config_path, cosmic_path=cosmic_path,
+                                           cbioportal_study=cbioportal_study,
+                                           oncokb_token=os.getenv('ONCOKB_API_TOKEN'),
+                                           cache_dir=self.config.get('cache', {}).get('dir'),
+                                           chunk_size=self.performance.get('chunk_size', 500000),
+                                           workers=self.performance.get('workers', 4),
+                                           batch_size=self.performance.get('batch_size', 100),
+                                           **self._db_settings())
+
+    def run_derived_tables(self):
+        """Derive observation_period and condition_era from the loaded OMOP event tables."""
+        from core.etl import derived_tables
+        return derived_tables.run_derived_tables(config_path=self.config_path,
+                                                 partition_size=self.performance.get('chunk_size'),
+                                                 chunk_size=self.performance.get('chunk_size'),
+                                                 **self._db_settings())
+
+    def run_fhir_export(self):
+        """Export person/observation/condition_occurrence as FHIR NDJSON (one file per resource type)."""
+        from core.fhir_export import export_fhir_ndjson
+        manifest = export_fhir_ndjson(config_path=self.config_path, workers=self.performance.get('workers'),
+                                      **self._db_settings())
+        return {item['type']: item['count'] for item in manifest['output']}
 
     def run_analytics(self):
         """Run analytics and visualization on OMOP data."""
-        analytics_visualization.run_analytics(config_path="config.yaml")
+        from core.etl import analytics_visualization
+        analytics_visualization.run_analytics(config_path=self.config_path, **self._db_settings())
 
-    def run_llm_mapping(self, fhir_json, table):
-        """Run LLM mapping: FHIR JSON to OMOP SQL using Llama 2 via Ollama."""
-        return fhir_to_omop_sql(fhir_json, table)
+    def run_llm_mapping(self, fhir_json, table, model='llama2', stream=False):
+        """Run LLM mapping: FHIR JSON to OMOP SQL using Llama 2 via Ollama (stream=True yields text chunks)."""
+        from core.fhir_to_omop import fhir_to_omop_sql, fhir_to_omop_sql_stream
+        if stream:
+            return fhir_to_omop_sql_stream(fhir_json, table, model)
+        return fhir_to_omop_sql(fhir_json, table, model)
 
     def run_qa(self, csv_path, output_html):
         """Run QA profiling on OMOP table using ydata-profiling."""
+        from core.qa_copilot import run_quality_checks
         return run_quality_checks(csv_path, output_html)
 
-    def orchestrate(self, steps=None, fhir_json=None, table=None, qa_csv=None, qa_html=None):
-        """Run a sequence of pipeline steps. Steps: [etl, llm_mapping, qa, analytics]"""
+    def export_table_csv(self, table, csv_path):
+        """Stream an OMOP table (sampled if larger than qa.max_rows) to CSV for QA."""
+        from utils.table_browser import sample_table_to_csv
+        max_rows = self.config.get('qa', {}).get('max_rows', 100000)
+        sample_table_to_csv(self.db_engine, table, csv_path, max_rows=max_rows)
+        return csv_path
+
+    def orchestrate(self, steps=None, fhir_json=None, table=None, qa_csv=None, qa_html=None, qa_table=None,
+                    progress_callback=None):
+        """
+        Run a sequence of pipeline steps. Steps: [etl, genomic_etl, derived_tables, llm_mapping, qa, analytics, fhir_export]
+        qa_table: if set, this OMOP table is exported to qa_csv before profiling.
+        progress_callback(step, index, total) is called before each step; it may
+        raise to abort the run (used by the background job queue for cancellation).
+        """
         steps = steps or ['etl', 'llm_mapping', 'qa', 'analytics']
         results = {}
         # Get data and docs paths from config
@@ -54,17 +123,26 @@ class MCPOrchestrator:
             qa_csv = os.path.join(data_dir, self.config['data']['person_sample'])
         if qa_html is None:
             qa_html = os.path.join(docs_dir, 'person_profile_report.html')
-        for step in steps:
+        for index, step in enumerate(steps):
+            if progress_callback:
+                progress_callback(step, index, len(steps))
             if step == 'etl':
-                self.run_etl()
-                results['etl'] = 'complete'
+                results['etl'] = self.run_etl()
+            elif step == 'genomic_etl':
+                results['genomic_etl'] = self.run_genomic_etl()
+            elif step == 'derived_tables':
+                results['derived_tables'] = self.run_derived_tables()
             elif step == 'llm_mapping' and fhir_json and table:
                 results['llm_mapping'] = self.run_llm_mapping(fhir_json, table)
             elif step == 'qa' and qa_csv and qa_html:
+                if qa_table:
+                    self.export_table_csv(qa_table, qa_csv)
                 results['qa'] = self.run_qa(qa_csv, qa_html)
             elif step == 'analytics':
                 self.run_analytics()
                 results['analytics'] = 'complete'
+            elif step == 'fhir_export':
+                results['fhir_export'] = self.run_fhir_export()
         return results
 
 # Example usage (script mode):
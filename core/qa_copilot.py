@@ -1,12 +1,19 @@
-import pandas as pd
-from ydata_profiling import ProfileReport
-
 def run_quality_checks(csv_path: str, output_html: str):
     """
     Runs basic data profiling QA checks on OMOP-style dataset.
     """
+    # ydata-profiling is slow to import; only load it when a QA run happens
+    import pandas as pd
+    from ydata_profiling import ProfileReport
+
+    from core.fhir_dates import parse_fhir_dates
+
     df = pd.read_csv(csv_path)
+    # Profile *_date columns as dates (FHIR partial dates and dateTimes included)
+    for column in [c for c in df.columns if c.endswith('_date') and pd.api.types.is_string_dtype(df[c])]:
+        dates = parse_fhir_dates(df[column])
+        if dates.notna().sum() >= df[column].notna().sum():
+            df[column] = dates
     profile = ProfileReport(df, title="OMOP QA Report", explorative=True)
     profile.to_file(output_html)
     return output_html
-
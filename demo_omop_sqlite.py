@@ -1,4 +1,6 @@
 import sqlite3
+from utils.db_utils import get_db_engine
+from utils.sql_inserts import load_llm_inserts
 
 # Minimal OMOP condition_occurrence table schema for demo
 schema = """
@@ -59,8 +61,10 @@ def main():
     conn = sqlite3.connect('omop_demo.db')
     cur = conn.cursor()
     cur.execute(schema)
-    cur.execute(sql_insert)
     conn.commit()
+    # Parse the LLM insert, check it against the table schema and load it as a prepared batch
+    written, _ = load_llm_inserts([sql_insert], get_db_engine(db_type='sqlite', db_path='omop_demo.db'))
+    print(f"Inserted rows: {written}")
     # Show inserted row
     cur.execute("SELECT * FROM condition_occurrence")
     for row in cur.fetchall():
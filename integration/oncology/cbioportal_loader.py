@@ -1,15 +1,189 @@
 # cBioPortal Loader Example
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 
-def fetch_cbioportal_study(study_id, base_url="https://www.cbioportal.org/api"):
+DEFAULT_BASE_URL = "https://www.cbioportal.org/api"
+
+# Data endpoint per molecular alteration type. Expression profiles (molecular-data)
+# can only be fetched per gene (entrezGeneId), so they are not supported here.
+ALTERATION_ENDPOINTS = {
+    'MUTATION_EXTENDED': 'mutations',
+    'COPY_NUMBER_ALTERATION': 'discrete-copy-number',
+}
+
+# Endpoints that honour pageSize/pageNumber; the others return everything in one response
+PAGED_ENDPOINTS = {'mutations'}
+
+# Typed columns for normalized frames; unknown columns are kept as-is
+CBIOPORTAL_DTYPES = {
+    'studyId': 'category',
+    'patientId': 'string',
+    'sampleId': 'string',
+    'uniqueSampleKey': 'string',
+    'uniquePatientKey': 'string',
+    'clinicalAttributeId': 'category',
+    'value': 'string',
+    'molecularProfileId': 'category',
+    'molecularAlterationType': 'category',
+    'datatype': 'category',
+    'entrezGeneId': 'Int64',
+    'hugoGeneSymbol': 'category',
+    'proteinChange': 'string',
+    'mutationType': 'category',
+    'mutationStatus': 'category',
+    'variantType': 'category',
+    'chr': 'category',
+    'startPosition': 'Int64',
+    'endPosition': 'Int64',
+    'referenceAllele': 'string',
+    'variantAllele': 'string',
+    'tumorAltCount': 'Int32',
+    'tumorRefCount': 'Int32',
+    'alteration': 'Int8',
+}
+
+
+class CBioPortalClient:
+    """
+    cBioPortal REST client with a pooled session, paginated and concurrent
+    fetches, and an on-disk JSON response cache (TTL + ETag revalidation).
+    base_url can point at a local stub server for testing.
+    """
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, cache_dir=None, ttl=24 * 3600,
+                 page_size=10000, max_workers=4, timeout=60, session=None):
+        self.base_url = base_url.rstrip('/')
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.page_size = page_size
+        self.max_workers = max_workers
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=3)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'Accept': 'application/json'})
+        self.session = session
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    # --- HTTP + cache ---
+
+    def _cache_path(self, url, params):
+        key = hashlib.sha1((url + json.dumps(params or {}, sort_keys=True)).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _get_json(self, path, params=None):
+        """GET a JSON document, served from cache while fresh and revalidated by ETag after."""
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        cache_path = self._cache_path(url, params) if self.cache_dir else None
+        cached = None
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if time.time() - cached['fetched_at'] < self.ttl:
+                return cached['body']
+        headers = {}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and cached:
+            body, etag = cached['body'], cached.get('etag')
+        else:
+            response.raise_for_status()
+            body, etag = response.json(), response.headers.get('ETag')
+        if cache_path:
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'url': url, 'params': params, 'etag': etag, 'fetched_at': time.time(), 'body': body}, f)
+            os.replace(tmp_path, cache_path)
+        return body
+
+    def _get_paged(self, path, params=None):
+        """Follow pageNumber/pageSize until a short page, or a repeat of the previous page, is returned."""
+        records, page, previous = [], 0, None
+        while True:
+            page_params = dict(params or {}, pageSize=self.page_size, pageNumber=page)
+            body = self._get_json(path, page_params)
+            if isinstance(body, dict) and 'clinicalData' in body:
+                body = body['clinicalData']
+            if body and body == previous:
+                # The server ignored the paging parameters and sent the full result again
+                return records
+            records.extend(body)
+            if len(body) < self.page_size:
+                return records
+            previous = body
+            page += 1
+
+    # --- API ---
+
+    def clinical_data(self, study_id, clinical_data_type='SAMPLE'):
+        records = self._get_paged(f"studies/{study_id}/clinical-data", {'clinicalDataType': clinical_data_type})
+        return normalize_records(records)
+
+    def molecular_profiles(self, study_id):
+        return normalize_records(self._get_paged(f"studies/{study_id}/molecular-profiles"))
+
+    def sample_lists(self, study_id):
+        return normalize_records(self._get_paged(f"studies/{study_id}/sample-lists"))
+
+    def profile_data(self, profile_id, alteration_type, sample_list_id):
+        endpoint = ALTERATION_ENDPOINTS.get((alteration_type or '').upper())
+        if endpoint is None:
+            raise ValueError(f"No supported endpoint for alteration type: {alteration_type}")
+        params = {'sampleListId': sample_list_id}
+        if endpoint == 'mutations':
+            params['projection'] = 'DETAILED'
+        path = f"molecular-profiles/{profile_id}/{endpoint}"
+        records = self._get_paged(path, params) if endpoint in PAGED_ENDPOINTS else self._get_json(path, params)
+        return normalize_records(records)
+
+    def fetch_profiles_data(self, study_id, profile_ids=None, sample_list_id=None, alteration_types=None):
+        """
+        Fetch data for several molecular profiles of a study concurrently.
+        profile_ids / alteration_types: restrict to these profiles / molecularAlterationType values
+        Returns {profile_id: DataFrame}; unsupported alteration types are skipped.
+        """
+        profiles = self.molecular_profiles(study_id)
+        if profiles.empty:
+            return {}
+        if profile_ids is not None:
+            profiles = profiles[profiles['molecularProfileId'].isin(profile_ids)]
+        supported = set(ALTERATION_ENDPOINTS) & set(alteration_types or ALTERATION_ENDPOINTS)
+        profiles = profiles[profiles['molecularAlterationType'].astype(str).isin(supported)]
+        if sample_list_id is None:
+            sample_lists = self.sample_lists(study_id)
+            if sample_lists.empty:
+                return {}
+            all_lists = sample_lists[sample_lists['sampleListId'] == f"{study_id}_all"]
+            sample_list_id = (all_lists if not all_lists.empty else sample_lists)['sampleListId'].iloc[0]
+        jobs = list(zip(profiles['molecularProfileId'], profiles['molecularAlterationType'].astype(str)))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            frames = pool.map(lambda job: self.profile_data(job[0], job[1], sample_list_id), jobs)
+            return dict(zip((p for p, _ in jobs), frames))
+
+
+def normalize_records(records):
+    """Build a DataFrame from API records, applying CBIOPORTAL_DTYPES where present."""
+    df = pd.json_normalize(records) if records else pd.DataFrame()
+    dtypes = {c: t for c, t in CBIOPORTAL_DTYPES.items() if c in df.columns}
+    return df.astype(dtypes) if dtypes else df
+
+
+def fetch_cbioportal_study(study_id, base_url=DEFAULT_BASE_URL, cache_dir=None):
     # Example: fetch sample clinical data for a study
-    url = f"{base_url}/studies/{study_id}/clinical-data"
-    response = requests.get(url)
-    response.raise_for_status()
-    data = response.json()
-    return pd.DataFrame(data['clinicalData'])
+    return CBioPortalClient(base_url=base_url, cache_dir=cache_dir).clinical_data(study_id)
 
 # Example usage:
 # df = fetch_cbioportal_study("brca_tcga")
 # df.to_csv("data/external/cbioportal_brca_clinical.csv", index=False)
+# client = CBioPortalClient(cache_dir=".cache/cbioportal")
+# frames = client.fetch_profiles_data("brca_tcga")
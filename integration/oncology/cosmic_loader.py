@@ -1,12 +1,191 @@
 # COSMIC Loader Example
+import os
+import sqlite3
+import tempfile
 import pandas as pd
 
-def load_cosmic_mutations(file_path):
-    # COSMIC data is often distributed as TSV/CSV
-    df = pd.read_csv(file_path, sep='\t')
-    # Filter or map columns as needed for OMOP or analysis
+# COSMIC column names used for filtering (CosmicMutantExport.tsv header)
+GENE_COLUMN = 'Gene name'
+SAMPLE_COLUMN = 'Sample name'
+MUTATION_TYPE_COLUMN = 'Mutation Description'
+
+# Compact dtypes for the low-cardinality COSMIC columns. Everything else is
+# read as plain strings; ids that are numeric in COSMIC use nullable ints.
+COSMIC_DTYPES = {
+    'Gene name': 'category',
+    'Accession Number': 'category',
+    'Gene CDS length': 'Int32',
+    'HGNC ID': 'Int32',
+    'Sample name': 'string',
+    'ID_sample': 'Int64',
+    'ID_tumour': 'Int64',
+    'Primary site': 'category',
+    'Site subtype 1': 'category',
+    'Site subtype 2': 'category',
+    'Site subtype 3': 'category',
+    'Primary histology': 'category',
+    'Histology': 'category',
+    'Histology subtype 1': 'category',
+    'Histology subtype 2': 'category',
+    'Histology subtype 3': 'category',
+    'Genome-wide screen': 'category',
+    'Mutation ID': 'string',
+    'Mutation CDS': 'string',
+    'Mutation AA': 'string',
+    'Mutation Description': 'category',
+    'Mutation zygosity': 'category',
+    'LOH': 'category',
+    'GRCh': 'category',
+    'Mutation strand': 'category',
+    'FATHMM prediction': 'category',
+    'Mutation somatic status': 'category',
+    'Sample Type': 'category',
+    'Tumour origin': 'category',
+}
+
+# Columns indexed in the SQLite cache so gene/sample/type lookups avoid a scan
+CACHE_INDEX_COLUMNS = [GENE_COLUMN, SAMPLE_COLUMN, MUTATION_TYPE_COLUMN]
+CACHE_TABLE = 'cosmic_mutations'
+
+
+def _as_set(values):
+    if values is None:
+        return None
+    if isinstance(values, str):
+        return {values}
+    return set(values)
+
+
+def _filter_chunk(chunk, genes=None, samples=None, mutation_types=None):
+    mask = pd.Series(True, index=chunk.index)
+    for column, wanted in ((GENE_COLUMN, genes), (SAMPLE_COLUMN, samples), (MUTATION_TYPE_COLUMN, mutation_types)):
+        if wanted is None:
+            continue
+        if column not in chunk.columns:
+            raise KeyError(f"Cannot filter on '{column}': column not in COSMIC file")
+        mask &= chunk[column].isin(wanted)
+    return chunk[mask]
+
+
+def iter_cosmic_mutations(file_path, columns=None, genes=None, samples=None, mutation_types=None,
+                          chunk_size=500_000):
+    """
+    Yield filtered COSMIC mutation chunks without loading the whole file.
+    columns: column projection (filter columns are read too, then dropped)
+    genes / samples / mutation_types: value or iterable matched against
+    'Gene name', 'Sample name' and 'Mutation Description'
+    chunk_size: rows parsed per chunk
+    """
+    genes, samples, mutation_types = _as_set(genes), _as_set(samples), _as_set(mutation_types)
+    wanted = None
+    if columns is not None:
+        filter_columns = [c for c, v in ((GENE_COLUMN, genes), (SAMPLE_COLUMN, samples),
+                                          (MUTATION_TYPE_COLUMN, mutation_types)) if v is not None]
+        wanted = list(dict.fromkeys(list(columns) + filter_columns))
+    reader = pd.read_csv(
+        file_path,
+        sep='\t',
+        usecols=(lambda c: c in wanted) if wanted is not None else None,
+        dtype=COSMIC_DTYPES,
+        chunksize=chunk_size,
+        low_memory=True,
+    )
+    for chunk in reader:
+        chunk = _filter_chunk(chunk, genes, samples, mutation_types)
+        if columns is not None:
+            chunk = chunk[[c for c in columns if c in chunk.columns]]
+        if not chunk.empty:
+            yield chunk
+
+
+def load_cosmic_mutations(file_path, columns=None, genes=None, samples=None, mutation_types=None,
+                          chunk_size=500_000):
+    # COSMIC data is often distributed as TSV/CSV; read it chunked with the
+    # projection and row filters applied per chunk so only matches are kept.
+    chunks = list(iter_cosmic_mutations(file_path, columns, genes, samples, mutation_types, chunk_size))
+    if not chunks:
+        return pd.DataFrame(columns=list(columns or []))
+    df = pd.concat(chunks, ignore_index=True)
+    # Re-apply categoricals lost when concatenating chunks with different categories
+    for col, dtype in COSMIC_DTYPES.items():
+        if dtype == 'category' and col in df.columns and df[col].dtype != 'category':
+            df[col] = df[col].astype('category')
     return df
 
+
+def build_cosmic_cache(file_path, cache_path, chunk_size=500_000):
+    """
+    Convert a COSMIC TSV once into an indexed SQLite cache.
+    The cache is built in a temporary file next to cache_path and moved into
+    place when complete, so readers never see a partial cache and a failed
+    build keeps the previous one.
+    Returns the number of rows written.
+    """
+    cache_dir = os.path.dirname(os.path.abspath(cache_path))
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=os.path.basename(cache_path) + '.', suffix='.tmp')
+    os.close(fd)
+    rows = 0
+    try:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            for chunk in iter_cosmic_mutations(file_path, chunk_size=chunk_size):
+                chunk.to_sql(CACHE_TABLE, conn, if_exists='append', index=False)
+                rows += len(chunk)
+            if not rows:
+                # Header-only file: still create the table so queries return an empty frame
+                pd.read_csv(file_path, sep='\t', nrows=0).to_sql(CACHE_TABLE, conn, index=False)
+            columns = {r[1] for r in conn.execute(f"PRAGMA table_info({CACHE_TABLE})")}
+            for i, col in enumerate(c for c in CACHE_INDEX_COLUMNS if c in columns):
+                conn.execute(f'CREATE INDEX IF NOT EXISTS idx_cosmic_{i} ON {CACHE_TABLE} ("{col}")')
+            conn.execute("ANALYZE")
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return rows
+
+
+def query_cosmic_cache(cache_path, columns=None, genes=None, samples=None, mutation_types=None):
+    """Query the SQLite cache built by build_cosmic_cache using its indexes."""
+    conn = sqlite3.connect(cache_path)
+    try:
+        available = [r[1] for r in conn.execute(f"PRAGMA table_info({CACHE_TABLE})")]
+        selected = [c for c in (columns or available) if c in available]
+        if not selected:
+            return pd.DataFrame(columns=list(columns or []))
+        clauses, params = [], []
+        for column, wanted in ((GENE_COLUMN, genes), (SAMPLE_COLUMN, samples), (MUTATION_TYPE_COLUMN, mutation_types)):
+            wanted = _as_set(wanted)
+            if wanted is None:
+                continue
+            if column not in available:
+                raise KeyError(f"Cannot filter on '{column}': column not in COSMIC cache")
+            clauses.append(f'"{column}" IN ({", ".join("?" * len(wanted))})')
+            params.extend(sorted(wanted))
+        sql = "SELECT " + ", ".join(f'"{c}"' for c in selected) + f" FROM {CACHE_TABLE}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        df = pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+    return df.astype({c: t for c, t in COSMIC_DTYPES.items() if c in df.columns})
+
+
+def load_cosmic_mutations_cached(file_path, cache_path, columns=None, genes=None, samples=None,
+                                 mutation_types=None, chunk_size=500_000):
+    """Build the cache on first use (or when the TSV is newer) and query it."""
+    if not os.path.exists(cache_path) or os.path.getmtime(cache_path) < os.path.getmtime(file_path):
+        build_cosmic_cache(file_path, cache_path, chunk_size=chunk_size)
+    return query_cosmic_cache(cache_path, columns, genes, samples, mutation_types)
+
 # Example usage:
-# df = load_cosmic_mutations("data/external/CosmicMutantExport.tsv")
-# print(df.head())
+# df = load_cosmic_mutations("data/external/CosmicMutantExport.tsv", genes=["TP53"],
+#                            columns=["Gene name", "Mutation AA", "Primary site"])
+# df = load_cosmic_mutations_cached("data/external/CosmicMutantExport.tsv",
+#                                   ".cache/cosmic_mutations.sqlite", genes="TP53")
@@ -1,15 +1,210 @@
 # OncoKB Loader Example
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 
+ONCOKB_API = "https://www.oncokb.org/api/v1"
+
+# Columns of the cohort annotation table returned by annotate_variants
+ANNOTATION_COLUMNS = [
+    'variant_key', 'hugo_symbol', 'alteration', 'tumor_type', 'oncogenic', 'mutation_effect',
+    'highest_sensitive_level', 'highest_resistance_level', 'source',
+]
+
+# Column names used by OncoKB CSV exports such as data/external/oncokb_tp53_variants.csv
+OFFLINE_COLUMNS = {
+    'Hugo_Symbol': 'hugo_symbol',
+    'Alteration': 'alteration',
+    'CancerType': 'tumor_type',
+    'Oncogenic': 'oncogenic',
+    'MutationEffect': 'mutation_effect',
+    'Level': 'highest_sensitive_level',
+}
+
 def fetch_oncokb_variants(api_token, gene='TP53'):
-    url = f"https://www.oncokb.org/api/v1/genes/{gene}/variants"
+    url = f"{ONCOKB_API}/genes/{gene}/variants"
     headers = {"Authorization": f"Bearer {api_token}"}
     response = requests.get(url, headers=headers)
     response.raise_for_status()
     variants = response.json()
     return pd.DataFrame(variants)
 
+
+def variant_key(gene, alteration):
+    """Join key shared with measurement_source_value in the genomic ETL, e.g. 'TP53:R248Q'."""
+    return f"{gene}:{normalize_alteration(alteration)}"
+
+
+def normalize_alteration(alteration):
+    alteration = str(alteration).strip()
+    return alteration[2:] if alteration.startswith('p.') else alteration
+
+
+class RateLimiter:
+    """Allow at most `rate` calls per second across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class AnnotationCache:
+    """SQLite cache of OncoKB annotations keyed by (gene, alteration, tumor type)."""
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        with sqlite3.connect(db_path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS oncokb_annotation (
+                    hugo_symbol TEXT NOT NULL,
+                    alteration TEXT NOT NULL,
+                    tumor_type TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (hugo_symbol, alteration, tumor_type)
+                )
+            """)
+
+    def get_many(self, keys):
+        found = {}
+        with sqlite3.connect(self.db_path) as conn:
+            for gene, alteration, tumor_type in keys:
+                row = conn.execute(
+                    "SELECT response FROM oncokb_annotation WHERE hugo_symbol=? AND alteration=? AND tumor_type=?",
+                    (gene, alteration, tumor_type or '')).fetchone()
+                if row:
+                    found[(gene, alteration, tumor_type)] = json.loads(row[0])
+        return found
+
+    def put_many(self, items):
+        now = time.time()
+        with sqlite3.connect(self.db_path) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO oncokb_annotation VALUES (?, ?, ?, ?, ?)",
+                [(g, a, t or '', json.dumps(resp), now) for (g, a, t), resp in items.items()])
+
+
+def _annotation_row(key, response, source):
+    gene, alteration, tumor_type = key
+    mutation_effect = response.get('mutationEffect') or {}
+    return {
+        'variant_key': variant_key(gene, alteration),
+        'hugo_symbol': gene,
+        'alteration': alteration,
+        'tumor_type': tumor_type,
+        'oncogenic': response.get('oncogenic'),
+        'mutation_effect': mutation_effect.get('knownEffect') if isinstance(mutation_effect, dict) else mutation_effect,
+        'highest_sensitive_level': response.get('highestSensitiveLevel'),
+        'highest_resistance_level': response.get('highestResistanceLevel'),
+        'source': source,
+    }
+
+
+def _variant_keys(variants):
+    """Accept a DataFrame (hugo_symbol, alteration[, tumor_type]) or (gene, alteration[, tumor_type]) tuples."""
+    if isinstance(variants, pd.DataFrame):
+        tumor_types = variants['tumor_type'] if 'tumor_type' in variants.columns else [None] * len(variants)
+        rows = zip(variants['hugo_symbol'], variants['alteration'], tumor_types)
+    else:
+        rows = (tuple(v) + (None,) * (3 - len(v)) for v in variants)
+    keys = {(str(g), normalize_alteration(a), t if isinstance(t, str) and t else None) for g, a, t in rows}
+    return sorted(keys, key=lambda k: (k[0], k[1], k[2] or ''))
+
+
+def load_offline_annotations(data_dir):
+    """Read oncokb_*_variants.csv exports into the annotation table layout."""
+    frames = [pd.read_csv(p) for p in sorted(glob.glob(os.path.join(data_dir, 'oncokb_*_variants.csv')))]
+    if not frames:
+        return pd.DataFrame(columns=ANNOTATION_COLUMNS)
+    df = pd.concat(frames, ignore_index=True).rename(columns=OFFLINE_COLUMNS)
+    df['alteration'] = df['alteration'].map(normalize_alteration)
+    df['variant_key'] = df['hugo_symbol'] + ':' + df['alteration']
+    df['highest_resistance_level'] = None
+    df['source'] = 'offline'
+    return df[ANNOTATION_COLUMNS]
+
+
+def annotate_variants(variants, api_token=None, cache_path=None, offline_dir=None, batch_size=100,
+                      max_workers=4, rate=5.0, api_url=ONCOKB_API, timeout=60):
+    """
+    Annotate many variants with OncoKB, concurrently and rate limited.
+    variants: DataFrame with hugo_symbol/alteration[/tumor_type] or tuples
+    cache_path: SQLite file for previously fetched annotations
+    offline_dir: directory with oncokb_*_variants.csv exports used when the
+        API is unreachable or no token is given
+    Returns one row per requested variant (ANNOTATION_COLUMNS), joinable to
+    OMOP measurement on variant_key = measurement_source_value.
+    """
+    keys = _variant_keys(variants)
+    cache = AnnotationCache(cache_path) if cache_path else None
+    results = {}
+    sources = {}
+    if cache:
+        for key, response in cache.get_many(keys).items():
+            results[key], sources[key] = response, 'cache'
+    missing = [k for k in keys if k not in results]
+    if missing and api_token:
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=3))
+        session.headers.update({"Authorization": f"Bearer {api_token}", "Content-Type": "application/json"})
+        limiter = RateLimiter(rate)
+
+        def annotate_batch(batch):
+            body = [{'gene': {'hugoSymbol': g}, 'alteration': a, 'tumorType': t} for g, a, t in batch]
+            limiter.wait()
+            response = session.post(f"{api_url}/annotate/mutations/byProteinChange", json=body, timeout=timeout)
+            response.raise_for_status()
+            return dict(zip(batch, response.json()))
+
+        batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                for fetched in pool.map(annotate_batch, batches):
+                    results.update(fetched)
+                    sources.update(dict.fromkeys(fetched, 'api'))
+                    if cache:
+                        cache.put_many(fetched)
+        except requests.RequestException as e:
+            if offline_dir is None:
+                raise
+            print(f"OncoKB API unavailable ({e}); falling back to offline annotations.")
+    rows = [_annotation_row(k, results[k], sources[k]) for k in keys if k in results]
+    annotated = pd.DataFrame(rows, columns=ANNOTATION_COLUMNS)
+    missing = [k for k in keys if k not in results]
+    if missing and offline_dir:
+        offline = load_offline_annotations(offline_dir)
+        wanted = pd.DataFrame(missing, columns=['hugo_symbol', 'alteration', 'tumor_type'])
+        wanted['variant_key'] = wanted['hugo_symbol'] + ':' + wanted['alteration']
+        # Prefer an exact tumor type match, otherwise the first export row for the variant
+        exact = wanted.merge(offline.drop(columns=['hugo_symbol', 'alteration']), on=['variant_key', 'tumor_type'])
+        # Fall back per (variant, tumor type): another tumor type's exact match does not cover this one
+        matched = exact[['variant_key', 'tumor_type']].drop_duplicates()
+        rest = wanted.merge(matched, on=['variant_key', 'tumor_type'], how='left', indicator=True)
+        rest = rest[rest['_merge'] == 'left_only'].drop(columns='_merge')
+        loose = rest.merge(offline.drop(columns=['hugo_symbol', 'alteration', 'tumor_type'])
+                           .drop_duplicates('variant_key'), on='variant_key')
+        annotated = pd.concat([annotated, exact[ANNOTATION_COLUMNS], loose[ANNOTATION_COLUMNS]], ignore_index=True)
+    return annotated
+
 # Example usage:
 # df = fetch_oncokb_variants(api_token="YOUR_ONCOKB_TOKEN")
 # df.to_csv("data/external/oncokb_tp53_variants.csv", index=False)
+# annotations = annotate_variants([("TP53", "R248Q"), ("EGFR", "L858R")], api_token="YOUR_ONCOKB_TOKEN",
+#                                 cache_path=".cache/oncokb.sqlite", offline_dir="data/external")
@@ -9,3 +9,22 @@ def load_config(config_path="config.yaml"):
     with open(config_path, "r") as f:
         config = yaml.safe_load(f)
     return config
+
+
+def apply_overrides(config, overrides):
+    """
+    Set dotted-path overrides on a loaded config, e.g.
+    {'database.backend': 'postgresql', 'performance.workers': 8}.
+    None values are ignored so unset CLI flags keep the config value.
+    """
+    for path, value in (overrides or {}).items():
+        if value is None:
+            continue
+        section = config
+        *parents, key = path.split('.')
+        for name in parents:
+            if not isinstance(section.get(name), dict):
+                section[name] = {}
+            section = section[name]
+        section[key] = value
+    return config
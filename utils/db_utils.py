@@ -4,20 +4,24 @@
 # Unified database utility for SQLite and PostgreSQL
 import os
 import sqlite3
-from sqlalchemy import create_engine
 
 def connect_omop_db(db_path="omop_demo.db"):
     """Connect to OMOP SQLite DB (legacy, for backward compatibility)."""
     return sqlite3.connect(db_path)
 
-def get_db_engine(db_type='sqlite', db_path='omop_demo.db', pg_settings=None):
+def get_db_engine(db_type='sqlite', db_path='omop_demo.db', pg_settings=None, shards=1):
     """
     Returns a SQLAlchemy engine for SQLite or PostgreSQL.
     db_type: 'sqlite' or 'postgresql'
     db_path: path to SQLite DB (if used)
     pg_settings: dict with keys user, password, host, port, db (if PostgreSQL)
+    shards: SQLite shard count; above 1 the engine reads the shards through attached views (utils/sharded_sqlite.py)
     """
+    from sqlalchemy import create_engine
     if db_type == 'sqlite':
+        if shards and shards > 1:
+            from utils.sharded_sqlite import ShardedSQLite
+            return ShardedSQLite(db_path, shards).attached_engine()
         return create_engine(f'sqlite:///{db_path}')
     elif db_type == 'postgresql':
         if pg_settings is None:
@@ -33,3 +37,55 @@ def get_db_engine(db_type='sqlite', db_path='omop_demo.db', pg_settings=None):
         return create_engine(url)
     else:
         raise ValueError(f"Unsupported db_type: {db_type}")
+
+def year_expression(engine, column):
+    """SQL expression for the calendar year of a DATE column on the engine's backend."""
+    if engine.dialect.name == 'sqlite':
+        return f"CAST(strftime('%Y', {column}) AS INTEGER)"
+    return f"CAST(EXTRACT(YEAR FROM {column}) AS INTEGER)"
+
+def _insert_or_ignore(pd_table, conn, keys, data_iter):
+    # pandas to_sql insertion method: rows whose primary key already exists are skipped
+    from sqlalchemy.dialects.sqlite import insert
+    result = conn.execute(insert(pd_table.table).on_conflict_do_nothing(), [dict(zip(keys, row)) for row in data_iter])
+    return result.rowcount
+
+def bulk_insert_frame(df, table, engine, chunk_size=50000, ignore_conflicts=False):
+    """
+    Append a DataFrame to an existing table as fast as the backend allows.
+    PostgreSQL uses COPY FROM STDIN; other backends use batched executemany.
+    ignore_conflicts: skip rows whose primary key is already in the table (PostgreSQL
+    copies into a temporary table and inserts from it with ON CONFLICT DO NOTHING)
+    Returns the number of rows written.
+    """
+    if df.empty:
+        return 0
+    if engine.dialect.name == 'postgresql':
+        import csv
+        import io
+        columns = ", ".join(f'"{c}"' for c in df.columns)
+        written = 0
+        raw = engine.raw_connection()
+        try:
+            with raw.cursor() as cur:
+                target = table
+                if ignore_conflicts:
+                    target = f"_stage_{table}"
+                    cur.execute(f"CREATE TEMP TABLE {target} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+                for start in range(0, len(df), chunk_size):
+                    buf = io.StringIO()
+                    df.iloc[start:start + chunk_size].to_csv(buf, index=False, header=False, quoting=csv.QUOTE_MINIMAL)
+                    buf.seek(0)
+                    cur.copy_expert(f'COPY {target} ({columns}) FROM STDIN WITH (FORMAT csv)', buf)
+                    if ignore_conflicts:
+                        cur.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {target} ON CONFLICT DO NOTHING")
+                        written += cur.rowcount
+                        cur.execute(f"TRUNCATE {target}")
+            raw.commit()
+        finally:
+            raw.close()
+        return written if ignore_conflicts else len(df)
+    if ignore_conflicts:
+        return df.to_sql(table, engine, if_exists='append', index=False, chunksize=chunk_size, method=_insert_or_ignore)
+    df.to_sql(table, engine, if_exists='append', index=False, chunksize=chunk_size)
+    return len(df)
@@ -0,0 +1,27 @@
+"""
+Worker pools shared by the parallel steps (mapping, FHIR export, sharded writes).
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+__all__ = ["process_pool"]
+
+
+def process_pool(workers):
+    """
+    Executor with `workers` processes, started with fork so the pool does not
+    re-import the launching script (Streamlit runs app.py as __main__).
+    Falls back to threads where fork is unavailable, or unsafe because other
+    threads are running (e.g. inside the Streamlit server): a forked child
+    could inherit locks those threads hold.
+    """
+    if 'fork' in multiprocessing.get_all_start_methods() and threading.active_count() == 1:
+        return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+    return ThreadPoolExecutor(workers)
+
+
+# Script usage:
+#   with process_pool(4) as pool:
+#       results = list(pool.map(work, items))
@@ -0,0 +1,219 @@
+"""
+Sharded SQLite storage for the OMOP tables.
+Tables with a person_id column are split across N SQLite files
+(<db>.shard0.db ... <db>.shardN-1.db) by a hash of person_id, so each shard
+is written by its own process and a person's rows always live together.
+Tables without person_id stay in the main database file.
+Reads either fan out one query per shard in parallel and merge the results
+(query/aggregate), or go through attached_engine(), which ATTACHes the
+shards to the main file behind TEMP views (UNION ALL over the shards) so
+existing SQL keeps working unchanged.
+"""
+
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils.parallel import process_pool
+
+__all__ = ["MAX_ATTACHED", "shard_paths", "shard_of", "sharded_of", "ShardedSQLite"]
+
+# SQLite's default SQLITE_MAX_ATTACHED: the attached view works up to this many shards
+MAX_ATTACHED = 10
+
+# Smaller writes go to the shards one after another (process start-up would cost more)
+MIN_PARALLEL_ROWS = 10000
+
+# Fibonacci hashing spreads sequential person_ids evenly over the shards
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def shard_paths(db_path, shards):
+    """Shard file paths next to db_path: omop_demo.db -> omop_demo.shard0.db, ..."""
+    stem, ext = os.path.splitext(db_path)
+    return [f"{stem}.shard{i}{ext or '.db'}" for i in range(shards)]
+
+
+def shard_of(person_ids, shards):
+    """Shard number (int64 array) of each person_id."""
+    keys = np.asarray(person_ids, dtype=np.int64).view(np.uint64)
+    return ((keys * _HASH_MULTIPLIER >> np.uint64(32)) % np.uint64(shards)).astype(np.int64)
+
+
+def sharded_of(engine):
+    """The ShardedSQLite behind an attached_engine(), or None for any other engine."""
+    return getattr(engine, 'sharded_sqlite', None)
+
+
+def _upsert(table, conn, keys, data_iter):
+    # pandas to_sql insertion method: rows with an existing primary key are updated in place
+    # (ON CONFLICT ... DO UPDATE keeps columns the frame does not carry, unlike INSERT OR REPLACE)
+    primary_key = [row[1] for row in conn.execute(f"PRAGMA table_info({table.name})").fetchall() if row[5]]
+    columns = ", ".join(f'"{k}"' for k in keys)
+    sql = f"INSERT INTO {table.name} ({columns}) VALUES ({', '.join('?' * len(keys))})"
+    if primary_key:
+        updates = ", ".join(f'"{k}" = excluded."{k}"' for k in keys if k not in primary_key)
+        conflict = ", ".join(f'"{k}"' for k in primary_key)
+        sql += f" ON CONFLICT ({conflict}) " + (f"DO UPDATE SET {updates}" if updates else "DO NOTHING")
+    conn.executemany(sql, data_iter)
+
+
+def _write_shard(path, frames, chunk_size, pre_sql, upsert=False):
+    """Append {table: DataFrame} to one shard file in a single transaction (runs in a worker process)."""
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            for statement in pre_sql:
+                conn.execute(statement)
+            for table, df in frames.items():
+                df.to_sql(table, conn, if_exists='append', index=False, chunksize=chunk_size,
+                          method=_upsert if upsert else None)
+        return {table: len(df) for table, df in frames.items()}
+    finally:
+        conn.close()
+
+
+class ShardedSQLite:
+    """
+    N SQLite shards of the database at db_path.
+    workers: processes/threads used for parallel writes and fan-out reads (default: one per shard)
+    """
+
+    def __init__(self, db_path, shards, workers=None):
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        self.db_path = db_path
+        self.shards = shards
+        self.paths = shard_paths(db_path, shards)
+        self.workers = max(1, min(workers or shards, shards))
+
+    def execute(self, statements):
+        """Run DDL/DML statements (e.g. DROP/CREATE TABLE, CREATE INDEX) on every shard."""
+        if isinstance(statements, str):
+            statements = [statements]
+        for path in self.paths:
+            conn = sqlite3.connect(path)
+            try:
+                with conn:
+                    for statement in statements:
+                        conn.execute(statement)
+            finally:
+                conn.close()
+
+    def write_frames(self, frames, chunk_size=50000, replace=False, upsert=False):
+        """
+        Append {table: DataFrame} to the shards, splitting each frame by
+        person_id hash and writing all shards in parallel (one process each).
+        Frames without a person_id column go to the main database file.
+        replace: delete the tables' existing rows first (in the same transaction)
+        upsert: overwrite rows with an existing primary key, so re-writing the
+                same frame after a partial failure does not duplicate rows
+        Returns {table: rows written}.
+        """
+        per_shard = [{} for _ in self.paths]
+        unsharded = {}
+        for table, df in frames.items():
+            if 'person_id' not in df.columns:
+                unsharded[table] = df
+                continue
+            # Rows without a person_id are kept together on shard 0
+            person_ids = df['person_id']
+            shard = np.where(person_ids.isna().to_numpy(), 0,
+                             shard_of(person_ids.fillna(0).to_numpy(dtype=np.int64), self.shards))
+            for i in range(self.shards):
+                per_shard[i][table] = df[shard == i]
+        counts = {table: 0 for table in frames}
+        pre_sql = [f"DELETE FROM {table}" for table in frames if table not in unsharded] if replace else []
+        if self.workers > 1 and sum(len(df) for df in frames.values()) >= MIN_PARALLEL_ROWS:
+            with process_pool(self.workers) as pool:
+                futures = [pool.submit(_write_shard, path, tables, chunk_size, pre_sql, upsert)
+                           for path, tables in zip(self.paths, per_shard)]
+                results = [future.result() for future in futures]
+        else:
+            results = [_write_shard(path, tables, chunk_size, pre_sql, upsert) for path, tables in zip(self.paths, per_shard)]
+        for result in results:
+            for table, rows in result.items():
+                counts[table] += rows
+        if unsharded:
+            pre_sql = [f"DELETE FROM {table}" for table in unsharded] if replace else []
+            for table, rows in _write_shard(self.db_path, unsharded, chunk_size, pre_sql, upsert).items():
+                counts[table] += rows
+        return counts
+
+    def tables(self):
+        """Tables present in the shards (those of shard 0)."""
+        if not os.path.exists(self.paths[0]):
+            return []
+        conn = sqlite3.connect(self.paths[0])
+        try:
+            return [name for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+        finally:
+            conn.close()
+
+    def _read_shard(self, path, sql, params):
+        import pandas as pd
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            return pd.read_sql(sql, conn, params=params)
+        finally:
+            conn.close()
+
+    def query(self, sql, params=None):
+        """Run one query on every shard in parallel; returns the per-shard DataFrames."""
+        # sqlite3 releases the GIL while a statement runs, so threads scan the shards concurrently
+        with ThreadPoolExecutor(self.workers) as pool:
+            return list(pool.map(lambda path: self._read_shard(path, sql, params or {}), self.paths))
+
+    def aggregate(self, sql, keys, merge, params=None):
+        """
+        Fan out a GROUP BY query and merge the per-shard groups.
+        keys: group-by output columns; merge: {output column: 'sum' | 'min' | 'max'}
+        (COUNT and SUM columns merge with 'sum'; compute averages as SUM and COUNT).
+        """
+        import pandas as pd
+        frames = [df for df in self.query(sql, params) if not df.empty]
+        if not frames:
+            return pd.DataFrame(columns=list(keys) + list(merge))
+        combined = pd.concat(frames, ignore_index=True)
+        if not keys:
+            return combined.agg(merge).to_frame().T
+        return combined.groupby(list(keys), dropna=False, as_index=False).agg(merge)
+
+    def count(self, table):
+        return int(sum(df.iloc[0, 0] for df in self.query(f"SELECT COUNT(*) FROM {table}")))
+
+    def attached_engine(self):
+        """
+        SQLAlchemy engine on the main database with the shards attached and a
+        TEMP view per sharded table, so unmodified SQL sees every shard. The
+        views are read-only: load sharded tables with write_frames (sharded_of(engine)
+        returns this ShardedSQLite for code that only has the engine).
+        """
+        import sqlalchemy
+        from sqlalchemy.pool import NullPool
+        if self.shards > MAX_ATTACHED:
+            raise ValueError(f"At most {MAX_ATTACHED} shards can be attached; use query/aggregate for more")
+
+        def connect():
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            for i, path in enumerate(self.paths):
+                conn.execute(f"ATTACH DATABASE ? AS shard{i}", (path,))
+            for table in self.tables():
+                union = " UNION ALL ".join(f"SELECT * FROM shard{i}.{table}" for i in range(self.shards))
+                conn.execute(f"CREATE TEMP VIEW {table} AS {union}")
+            return conn
+
+        # No pooling: each connection re-reads the shard tables, so views track ETL reloads
+        engine = sqlalchemy.create_engine("sqlite://", creator=connect, poolclass=NullPool)
+        engine.sharded_sqlite = self
+        return engine
+
+
+# Script usage:
+#   sharded = ShardedSQLite("omop_demo.db", shards=4)
+#   sharded.execute("CREATE TABLE IF NOT EXISTS person (person_id INTEGER PRIMARY KEY, year_of_birth INTEGER)")
+#   sharded.write_frames({"person": person_df})
+#   print(sharded.aggregate("SELECT year_of_birth, COUNT(*) AS n FROM person GROUP BY 1", ["year_of_birth"], {"n": "sum"}))
@@ -0,0 +1,269 @@
+# Safe, batched execution of LLM-generated INSERT statements.
+# LLM output is parsed into (table, columns, rows) with a small tokenizer that
+# only accepts literal values, checked against the database schema, and the
+# rows are written per table with prepared executemany batches in a single
+# transaction instead of executing the raw text statement by statement.
+import re
+from collections import namedtuple
+import sqlalchemy
+
+__all__ = ["SQLInsertError", "InsertStatement", "parse_inserts", "insert_complete", "InsertBatcher", "load_llm_inserts"]
+
+# conflict: None, 'REPLACE' or 'IGNORE' (from INSERT OR REPLACE / INSERT OR IGNORE)
+InsertStatement = namedtuple('InsertStatement', ['table', 'columns', 'rows', 'conflict'], defaults=(None,))
+
+
+class SQLInsertError(ValueError):
+    """LLM SQL that is not a plain literal INSERT, or does not match the schema."""
+
+
+_TOKEN = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<number>[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<quoted>"(?:[^"]|"")+"|`[^`]+`|\[[^\]]+\])
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<punct>[(),;.])
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+# INSERT only where a statement starts (line start or after ';'), not inside prose
+_INSERT_START = re.compile(r'(?:^|(?<=;))[ \t]*(INSERT\s+(?:OR\s+\w+\s+)?INTO\b)', re.IGNORECASE | re.MULTILINE)
+_LITERAL_WORDS = {'NULL': None, 'TRUE': True, 'FALSE': False}
+# SQLite conflict clauses: ABORT is the default behaviour; FAIL/ROLLBACK change transaction semantics
+_CONFLICTS = {'ABORT': None, 'REPLACE': 'REPLACE', 'IGNORE': 'IGNORE'}
+
+
+def _tokenize(sql, pos=0):
+    """Yield (kind, value, end) tokens from pos, skipping whitespace and comments."""
+    while pos < len(sql):
+        match = _TOKEN.match(sql, pos)
+        pos = match.end()
+        kind = match.lastgroup
+        text = match.group()
+        if kind in ('ws', 'comment'):
+            continue
+        if kind == 'string':
+            yield 'literal', text[1:-1].replace("''", "'"), pos
+        elif kind == 'number':
+            yield 'literal', float(text) if any(c in text for c in '.eE') else int(text), pos
+        elif kind == 'quoted':
+            yield 'ident', text[1:-1].replace('""', '"'), pos
+        elif kind == 'word' and text.upper() in _LITERAL_WORDS:
+            yield 'literal', _LITERAL_WORDS[text.upper()], pos
+        elif kind == 'word':
+            yield 'ident', text, pos
+        else:
+            yield kind, text, pos  # 'punct', or 'other' (rejected by the parser if consumed)
+
+
+class _Parser:
+    def __init__(self, sql, pos):
+        self.tokens = _tokenize(sql, pos)
+        self.current = next(self.tokens, None)
+        self.pos = pos
+
+    def take(self, kind=None, value=None):
+        token = self.current
+        if token is None:
+            raise SQLInsertError("Unexpected end of INSERT statement")
+        if (kind and token[0] != kind) or (value and str(token[1]).upper() != value):
+            raise SQLInsertError(f"Expected {value or kind}, found {token[1]!r}")
+        self.current = next(self.tokens, None)
+        self.pos = token[2]
+        return token
+
+    def peek(self, value):
+        return self.current is not None and self.current[0] in ('punct', 'ident') and str(self.current[1]).upper() == value
+
+    def statement(self):
+        self.take('ident', 'INSERT')
+        conflict = None
+        if self.peek('OR'):
+            self.take()
+            clause = str(self.take('ident')[1]).upper()
+            if clause not in _CONFLICTS:
+                raise SQLInsertError(f"Unsupported conflict clause: OR {clause}")
+            conflict = _CONFLICTS[clause]
+        self.take('ident', 'INTO')
+        table = self.take('ident')[1]
+        while self.peek('.'):  # schema-qualified name: keep the table part
+            self.take()
+            table = self.take('ident')[1]
+        columns = None
+        if self.peek('('):
+            self.take()
+            columns = [self.take('ident')[1]]
+            while self.peek(','):
+                self.take()
+                columns.append(self.take('ident')[1])
+            self.take('punct', ')')
+        self.take('ident', 'VALUES')
+        rows = [self.row()]
+        while self.peek(','):
+            self.take()
+            rows.append(self.row())
+        if self.peek(';'):
+            self.take()
+        return InsertStatement(table, columns, rows, conflict), self.pos
+
+    def row(self):
+        self.take('punct', '(')
+        values = [self.value()]
+        while self.peek(','):
+            self.take()
+            values.append(self.value())
+        self.take('punct', ')')
+        return tuple(values)
+
+    def value(self):
+        kind, value, _ = self.take()
+        if kind != 'literal':
+            # Function calls, sub-selects and expressions are rejected outright
+            raise SQLInsertError(f"Only literal values are allowed in VALUES, found {value!r}")
+        return value
+
+
+def parse_inserts(sql):
+    """
+    Extract every INSERT ... VALUES statement from LLM output (markdown fences
+    and surrounding prose are ignored). Returns a list of InsertStatement.
+    Raises SQLInsertError if a statement contains anything but literals.
+    """
+    statements = []
+    pos = 0
+    while True:
+        match = _INSERT_START.search(sql, pos)
+        if match is None:
+            return statements
+        statement, pos = _Parser(sql, match.start(1)).statement()
+        statements.append(statement)
+
+
+def insert_complete(sql):
+    """
+    True once `sql` (e.g. partial streamed LLM output) contains a whole INSERT
+    statement terminated by ';' -- later text cannot change that statement.
+    """
+    match = _INSERT_START.search(sql)
+    if match is None:
+        return False
+    try:
+        _, pos = _Parser(sql, match.start(1)).statement()
+    except SQLInsertError:
+        return False
+    return sql[:pos].rstrip().endswith(';')
+
+
+class InsertBatcher:
+    """
+    Collect parsed INSERT rows per (table, columns, conflict clause) and write
+    them with prepared executemany batches in one transaction.
+    Tables and columns are validated against the reflected schema.
+    OR REPLACE / OR IGNORE are kept: SQLite gets the clause itself, PostgreSQL
+    the equivalent ON CONFLICT (primary key) DO UPDATE / DO NOTHING.
+    """
+
+    def __init__(self, engine, batch_size=1000):
+        self.engine = engine
+        self.batch_size = batch_size
+        self._schema = {}
+        self._primary_keys = {}
+        self.pending = {}
+
+    def table_columns(self, table):
+        if table not in self._schema:
+            inspector = sqlalchemy.inspect(self.engine)
+            if not inspector.has_table(table):
+                raise SQLInsertError(f"Unknown OMOP table: {table}")
+            self._schema[table] = [c['name'] for c in inspector.get_columns(table)]
+            self._primary_keys[table] = inspector.get_pk_constraint(table).get('constrained_columns') or []
+        return self._schema[table]
+
+    def insert_sql(self, table, columns, conflict=None):
+        """Parameterized INSERT for one pending group, with its conflict handling in the engine's dialect."""
+        names = ", ".join(f'"{c}"' for c in columns)
+        params = ", ".join(f":p{i}" for i in range(len(columns)))
+        values = f'"{table}" ({names}) VALUES ({params})'
+        dialect = self.engine.dialect.name
+        if conflict is None:
+            return f"INSERT INTO {values}"
+        if dialect == 'sqlite':
+            return f"INSERT OR {conflict} INTO {values}"
+        if dialect != 'postgresql':
+            raise SQLInsertError(f"INSERT OR {conflict} is not supported on {dialect}")
+        self.table_columns(table)
+        key = self._primary_keys[table]
+        updates = ", ".join(f'"{c}" = EXCLUDED."{c}"' for c in columns if c not in key)
+        if conflict == 'REPLACE' and key and updates:
+            target = ", ".join(f'"{c}"' for c in key)
+            return f"INSERT INTO {values} ON CONFLICT ({target}) DO UPDATE SET {updates}"
+        return f"INSERT INTO {values} ON CONFLICT DO NOTHING"
+
+    def validate(self, statement):
+        """Check an InsertStatement against the schema; returns its resolved column names."""
+        known = self.table_columns(statement.table)
+        lookup = {c.lower(): c for c in known}
+        columns = statement.columns or known
+        unknown = [c for c in columns if c.lower() not in lookup]
+        if unknown:
+            raise SQLInsertError(f"Unknown column(s) for {statement.table}: {', '.join(unknown)}")
+        columns = tuple(lookup[c.lower()] for c in columns)
+        if len(set(columns)) != len(columns):
+            raise SQLInsertError(f"Duplicate column in INSERT into {statement.table}")
+        for row in statement.rows:
+            if len(row) != len(columns):
+                raise SQLInsertError(f"INSERT into {statement.table} has {len(columns)} columns but {len(row)} values")
+        return columns
+
+    def add(self, statement):
+        """Validate one InsertStatement and queue its rows. Returns the number of rows queued."""
+        columns = self.validate(statement)
+        self.pending.setdefault((statement.table, columns, statement.conflict), []).extend(statement.rows)
+        return len(statement.rows)
+
+    def add_sql(self, sql):
+        """Parse LLM output and queue all of its rows (all-or-nothing per text)."""
+        statements = parse_inserts(sql)
+        if not statements:
+            raise SQLInsertError("No INSERT ... VALUES statement found")
+        for statement in statements:
+            self.validate(statement)  # validate every statement before queueing any
+        return sum(self.add(statement) for statement in statements)
+
+    def flush(self):
+        """Write all queued rows in one transaction. Returns rows written per table."""
+        written = {}
+        with self.engine.begin() as conn:
+            for (table, columns, conflict), rows in self.pending.items():
+                stmt = sqlalchemy.text(self.insert_sql(table, columns, conflict))
+                for start in range(0, len(rows), self.batch_size):
+                    batch = rows[start:start + self.batch_size]
+                    conn.execute(stmt, [{f"p{i}": v for i, v in enumerate(row)} for row in batch])
+                written[table] = written.get(table, 0) + len(rows)
+        self.pending = {}
+        return written
+
+
+def load_llm_inserts(sql_texts, engine, batch_size=1000, skip_invalid=False):
+    """
+    Load many LLM-generated INSERT texts (one per mapped resource) in one transaction.
+    skip_invalid: skip texts that fail parsing/validation instead of raising.
+    Returns (rows written per table, [(index, error message), ...] for skipped texts).
+    """
+    batcher = InsertBatcher(engine, batch_size=batch_size)
+    skipped = []
+    for index, sql in enumerate(sql_texts):
+        try:
+            batcher.add_sql(sql)
+        except SQLInsertError as e:
+            if not skip_invalid:
+                raise SQLInsertError(f"Statement {index}: {e}") from e
+            skipped.append((index, str(e)))
+    return batcher.flush(), skipped
+
+
+# Script usage:
+#   from utils.db_utils import get_db_engine
+#   written, skipped = load_llm_inserts(llm_outputs, get_db_engine('sqlite', 'omop_demo.db'), skip_invalid=True)
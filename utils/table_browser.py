@@ -0,0 +1,216 @@
+# Server-side table browsing for OMOP tables: keyset pagination, column
+# projection, filters, sorting and cheap row-count estimates. Only the
+# requested page is transferred from the database.
+import csv
+import sqlalchemy
+import pandas as pd
+
+FILTER_OPS = {'=', '!=', '<', '<=', '>', '>=', 'like', 'in', 'is null', 'is not null'}
+
+
+class TableBrowser:
+    """
+    Browse tables through an SQLAlchemy engine. Table and column names are
+    checked against the reflected schema; values are always bound parameters.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._columns = {}
+        self._keys = {}
+
+    def tables(self):
+        inspector = sqlalchemy.inspect(self.engine)
+        return sorted(set(inspector.get_table_names() + self._sharded_views(inspector)))
+
+    def columns(self, table):
+        if table not in self._columns:
+            inspector = sqlalchemy.inspect(self.engine)
+            if not inspector.has_table(table):
+                raise ValueError(f"Unknown table: {table}")
+            self._columns[table] = [c['name'] for c in inspector.get_columns(table)]
+            self._keys[table] = inspector.get_pk_constraint(table).get('constrained_columns') or []
+            if not self._keys[table] and table in self._sharded_views(inspector):
+                # A shard view has no key of its own; the shard tables' primary key is unique across shards
+                self._keys[table] = inspector.get_pk_constraint(table, schema='shard0').get('constrained_columns') or []
+        return self._columns[table]
+
+    def _sharded_views(self, inspector):
+        # Sharded SQLite exposes its person-keyed tables as TEMP views (utils/sharded_sqlite.py)
+        if self.engine.dialect.name != 'sqlite':
+            return []
+        return inspector.get_temp_view_names()
+
+    def key_column(self, table):
+        """Unique column used as the keyset tie-breaker (primary key, or SQLite rowid)."""
+        self.columns(table)
+        keys = self._keys[table]
+        if len(keys) == 1:
+            return keys[0]
+        if self.engine.dialect.name == 'sqlite':
+            return 'rowid'
+        return None
+
+    def _check_column(self, table, column):
+        if column not in self.columns(table) and column != self.key_column(table):
+            raise ValueError(f"Unknown column for {table}: {column}")
+        return f'"{column}"' if column != 'rowid' else column
+
+    def _where(self, table, filters, params):
+        clauses = []
+        for i, (column, op, *value) in enumerate(filters or []):
+            op = op.lower()
+            if op not in FILTER_OPS:
+                raise ValueError(f"Unsupported filter operator: {op}")
+            col = self._check_column(table, column)
+            if op in ('is null', 'is not null'):
+                clauses.append(f"{col} {op.upper()}")
+            elif op == 'in':
+                names = []
+                for j, v in enumerate(value[0]):
+                    params[f"f{i}_{j}"] = v
+                    names.append(f":f{i}_{j}")
+                clauses.append(f"{col} IN ({', '.join(names) or 'NULL'})")
+            else:
+                params[f"f{i}"] = value[0]
+                clauses.append(f"{col} {op.upper()} :f{i}")
+        return clauses
+
+    def page(self, table, columns=None, filters=None, sort=None, descending=False, after=None, page_size=50):
+        """
+        Fetch one page. filters: [(column, op, value), ...]; sort: column name.
+        after: cursor returned by the previous call (None for the first page).
+        Returns (DataFrame, next_cursor); next_cursor is None on the last page.
+        """
+        key = self.key_column(table)
+        selected = [self._check_column(table, c) for c in (columns or self.columns(table))]
+        params = {'limit': int(page_size) + 1}
+        clauses = self._where(table, filters, params)
+        sort_col = self._check_column(table, sort) if sort else None
+        if key is None:
+            # No unique key to seek on: fall back to OFFSET paging
+            order = f" ORDER BY {sort_col} {'DESC' if descending else 'ASC'}" if sort_col else ""
+            params['offset'] = int(after or 0)
+            sql = f"SELECT {', '.join(selected)} FROM {table}"
+            sql += f" WHERE {' AND '.join(clauses)}" if clauses else ""
+            df = pd.read_sql(sqlalchemy.text(sql + order + " LIMIT :limit OFFSET :offset"), self.engine, params=params)
+            has_more = len(df) > page_size
+            return df.iloc[:page_size], (params['offset'] + page_size if has_more else None)
+        key_col = self._check_column(table, key)
+        cmp, direction = ('<', 'DESC') if descending else ('>', 'ASC')
+        if after is not None:
+            if sort_col:
+                last_is_null, last_sort, last_key = after
+                params['k'] = last_key
+                if last_is_null:
+                    clauses.append(f"{sort_col} IS NULL AND {key_col} {cmp} :k")
+                else:
+                    params['s'] = last_sort
+                    clauses.append(f"(({sort_col} IS NOT NULL AND ({sort_col} {cmp} :s OR ({sort_col} = :s AND {key_col} {cmp} :k))) "
+                                   f"OR {sort_col} IS NULL)")
+            else:
+                params['k'] = after
+                clauses.append(f"{key_col} {cmp} :k")
+        # NULL sort values always come last so the cursor predicate stays well defined
+        order = (f"CASE WHEN {sort_col} IS NULL THEN 1 ELSE 0 END, {sort_col} {direction}, " if sort_col else "") + f"{key_col} {direction}"
+        fetch = list(selected)
+        if key_col not in fetch:
+            fetch.append(f"{key_col} AS _browse_key")
+        if sort_col and sort_col not in fetch:
+            fetch.append(f"{sort_col} AS _browse_sort")
+        sql = f"SELECT {', '.join(fetch)} FROM {table}"
+        sql += f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql += f" ORDER BY {order} LIMIT :limit"
+        df = pd.read_sql(sqlalchemy.text(sql), self.engine, params=params)
+        has_more = len(df) > page_size
+        df = df.iloc[:page_size]
+        next_cursor = None
+        if has_more:
+            last = df.iloc[-1]
+            last_key = last['_browse_key'] if '_browse_key' in df.columns else last[key]
+            last_key = _py(last_key)
+            if sort_col:
+                last_sort = last['_browse_sort'] if '_browse_sort' in df.columns else last[sort]
+                next_cursor = (bool(pd.isna(last_sort)), None if pd.isna(last_sort) else _py(last_sort), last_key)
+            else:
+                next_cursor = last_key
+        return df.drop(columns=[c for c in ('_browse_key', '_browse_sort') if c in df.columns]), next_cursor
+
+    def count(self, table, filters=None, exact_limit=100000):
+        """
+        Row count for a table/filter. Unfiltered counts use catalog statistics
+        where available; filtered counts stop at exact_limit.
+        Returns (count, is_estimate).
+        """
+        self.columns(table)
+        if not filters:
+            estimate = self._catalog_estimate(table)
+            if estimate is not None:
+                return estimate, True
+        params = {'cap': int(exact_limit) + 1}
+        clauses = self._where(table, filters, params)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT COUNT(*) FROM (SELECT 1 FROM {table}{where} LIMIT :cap) AS capped"
+        with self.engine.connect() as conn:
+            n = conn.execute(sqlalchemy.text(sql), params).scalar()
+        return (exact_limit, True) if n > exact_limit else (n, False)
+
+    def _catalog_estimate(self, table):
+        with self.engine.connect() as conn:
+            if self.engine.dialect.name == 'postgresql':
+                n = conn.execute(sqlalchemy.text("SELECT reltuples::bigint FROM pg_class WHERE relname = :t"),
+                                 {'t': table}).scalar()
+                return int(n) if n is not None and n >= 0 else None
+            if self.engine.dialect.name == 'sqlite':
+                if table in self._sharded_views(sqlalchemy.inspect(conn)):
+                    return None  # views have neither statistics nor a rowid
+                has_stat = conn.execute(sqlalchemy.text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")).scalar()
+                if has_stat:
+                    stat = conn.execute(sqlalchemy.text(
+                        "SELECT stat FROM sqlite_stat1 WHERE tbl = :t AND idx IS NULL"), {'t': table}).scalar()
+                    if stat:
+                        return int(stat.split()[0])
+                try:
+                    # max(rowid) is an O(log n) upper bound; exact unless rows were deleted
+                    n = conn.execute(sqlalchemy.text(f"SELECT MAX(rowid) FROM {table}")).scalar()
+                    return int(n or 0)
+                except sqlalchemy.exc.OperationalError:
+                    return None  # WITHOUT ROWID table
+        return None
+
+
+def _py(value):
+    return value.item() if hasattr(value, 'item') else value
+
+
+def sample_table_to_csv(engine, table, csv_path, max_rows=100000, chunk_size=50000):
+    """
+    Write a table to CSV for QA without materializing it in memory.
+    Tables larger than max_rows are Bernoulli-sampled down to about max_rows.
+    Returns the number of rows written.
+    """
+    browser = TableBrowser(engine)
+    selected = ", ".join(f'"{c}"' for c in browser.columns(table))
+    total, _ = browser.count(table)
+    sql = f"SELECT {selected} FROM {table}"
+    params = {}
+    if total > max_rows:
+        params['p'] = int(max_rows / total * 1_000_000)
+        if engine.dialect.name == 'sqlite':
+            sql += " WHERE abs(random()) % 1000000 < :p"
+        else:
+            sql += " WHERE random() * 1000000 < :p"
+        sql += f" LIMIT {int(max_rows)}"
+    written = 0
+    with engine.connect().execution_options(stream_results=True) as conn:
+        chunks = pd.read_sql(sqlalchemy.text(sql), conn, params=params, chunksize=chunk_size)
+        with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+            header = True
+            for chunk in chunks:
+                chunk.to_csv(f, index=False, header=header, quoting=csv.QUOTE_MINIMAL)
+                header = False
+                written += len(chunk)
+            if header:
+                f.write(",".join(browser.columns(table)) + "\n")
+    return written